@@ -0,0 +1,182 @@
+import logging
+import numpy
+
+from system import *
+from stochastic import *
+
+#
+# A lockstep engine which simulates a block of iterations at once.
+#
+# Every iteration of the block is a row in a set of NumPy arrays, and each
+# disk of each RAID is a column. In every step, each live iteration pops its
+# earliest event and all iterations move forward together. The semantics are
+# the same as System.run(), so the results follow the same distribution.
+#
+class BatchSystem:
+
+    logger = logging.getLogger("sim")
+
+    def __init__(self, mission_time, raid_type, raid_num, disk_capacity,
+            disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, trace, filelevel, dedup, weighted):
+        self.mission_time = mission_time
+        self.raid_num = raid_num
+
+        (self.type, d, p) = raid_type.split("_");
+        self.data_fragments = int(d)
+        self.parity_fragments = int(p)
+        self.disk_num = self.data_fragments + self.parity_fragments
+
+        self.disk_capacity = disk_capacity
+        self.disk_fail_parms = disk_fail_parms
+        self.disk_repair_parms = disk_repair_parms
+        self.disk_lse_parms = disk_lse_parms
+        self.disk_scrubbing_parms = disk_scrubbing_parms
+
+        self.logger.debug("BatchSystem: mission_time = %d, raid_num = %d" % (self.mission_time, self.raid_num))
+
+        self.rng = numpy.random.RandomState()
+
+        # the number of LSEs of a disk over a scrubbing time
+        self.lse_count_dist = mixed_poisson(disk_lse_parms, disk_scrubbing_parms)
+
+        self.dedup_model = shared_dedup_model(trace, filelevel, dedup, weighted)
+
+    # the seed can be a list of words, see stochastic.seed_stream()
+    def seed(self, seed):
+        self.rng.seed(seed)
+
+    # for checkpoints
+    def get_rng_state(self):
+        return self.rng.get_state()
+
+    def set_rng_state(self, state):
+        self.rng.set_state(state)
+
+    def draw_weibull(self, parms, size):
+        (shape, scale, location) = parms
+        return numpy.maximum(scale * self.rng.weibull(shape, size), location)
+
+    # Simulate n iterations.
+    # Only the iterations with data loss events are returned,
+    # as a list of (iteration index, [raid failure result, lse result]).
+    def run(self, n):
+        D = self.disk_num
+        R = self.raid_num
+        p = self.parity_fragments
+        mission_time = self.mission_time
+
+        # the failure time if the disk is ok, the repair time if it is failed
+        next_time = self.draw_weibull(self.disk_fail_parms, (n, R*D))
+        failed = numpy.zeros((n, R*D), dtype=bool)
+        repair_start_time = numpy.zeros((n, R*D))
+        repair_time = numpy.zeros((n, R*D))
+        # events out of the mission time are never processed
+        event_time = numpy.where(next_time <= mission_time, next_time, numpy.inf)
+
+        failed_disk_count = numpy.zeros((n, R), dtype=numpy.int64)
+        critical_region = numpy.zeros((n, R))
+        raid_failed = numpy.zeros((n, R), dtype=bool)
+        corrupted_area = numpy.zeros((n, R))
+        lse_count = numpy.zeros((n, R), dtype=numpy.int64)
+
+        offsets = numpy.arange(D)
+        rows = numpy.arange(n)
+
+        while len(rows) > 0:
+            disk_idx = event_time[rows].argmin(axis=1)
+            t = event_time[rows, disk_idx]
+
+            # an iteration without pending events is finished
+            live = t <= mission_time
+            rows = rows[live]
+            disk_idx = disk_idx[live]
+            t = t[live]
+            raid_idx = disk_idx // D
+
+            repairing = failed[rows, disk_idx]
+
+            # upgrade
+            r_rows = rows[repairing]
+            r_disks = disk_idx[repairing]
+            r_raids = raid_idx[repairing]
+            fail_time = repair_time[r_rows, r_disks] + self.draw_weibull(self.disk_fail_parms, len(r_rows))
+            failed[r_rows, r_disks] = False
+            event_time[r_rows, r_disks] = numpy.where(fail_time <= mission_time, fail_time, numpy.inf)
+            failed_disk_count[r_rows, r_raids] -= 1
+            critical_region[r_rows, r_raids] = 0
+
+            # degrade
+            failing = ~repairing
+            f_rows = rows[failing]
+            f_disks = disk_idx[failing]
+            f_raids = raid_idx[failing]
+            f_time = t[failing]
+            end_time = f_time + self.draw_weibull(self.disk_repair_parms, len(f_rows))
+            failed[f_rows, f_disks] = True
+            repair_start_time[f_rows, f_disks] = f_time
+            repair_time[f_rows, f_disks] = end_time
+            event_time[f_rows, f_disks] = numpy.where(end_time <= mission_time, end_time, numpy.inf)
+            failed_disk_count[f_rows, f_raids] += 1
+
+            count = failed_disk_count[f_rows, f_raids]
+            degraded = count >= p
+            if not degraded.any():
+                continue
+
+            d_rows = f_rows[degraded]
+            d_raids = f_raids[degraded]
+            d_time = f_time[degraded]
+            d_count = count[degraded]
+            cols = d_raids[:, None] * D + offsets
+            cells = (d_rows[:, None], cols)
+
+            # the region where data may loss, see Raid.calc_critical_region()
+            # only the failed disks are taken into account
+            start = repair_start_time[cells]
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                progress = (d_time[:, None] - start) / (repair_time[cells] - start)
+            region = numpy.where(failed[cells], 1.0 - progress, 1.0).min(axis=1)
+            critical_region[d_rows, d_raids] = region
+
+            # RAID failure, see Raid.check_failure()
+            lost = d_count > p
+            raid_failed[d_rows[lost], d_raids[lost]] = True
+            corrupted_area[d_rows[lost], d_raids[lost]] = region[lost]
+            event_time[d_rows[lost][:, None], cols[lost]] = numpy.inf
+
+            # Sectors lost, see Raid.check_sectors_lost()
+            exposed = ~lost & (d_count == p)
+            if not exposed.any():
+                continue
+            e_rows = d_rows[exposed]
+            e_raids = d_raids[exposed]
+            e_cells = (e_rows[:, None], cols[exposed])
+            hit = ~failed[e_cells] & (self.rng.random_sample(e_cells[1].shape) < region[exposed][:, None])
+            sectors = numpy.zeros(hit.shape, dtype=numpy.int64)
+            sectors[hit] = self.lse_count_dist.draws(int(hit.sum()), self.rng)
+            lse_count[e_rows, e_raids] += sectors.sum(axis=1)
+
+        return self.calc_bytes_lost(raid_failed, corrupted_area, lse_count)
+
+    def calc_bytes_lost(self, raid_failed, corrupted_area, lse_count):
+        rows = numpy.flatnonzero(raid_failed.any(axis=1) | (lse_count > 0).any(axis=1))
+
+        # the sector errors of all RAIDs of these iterations in one draw
+        counts = lse_count[rows]
+        hit = counts > 0
+        lost = numpy.zeros(counts.shape, dtype=numpy.int64)
+        lost[hit] = self.dedup_model.sector_errors(counts[hit], self.rng)
+        lse_lost = lost.sum(axis=1)
+
+        losses = []
+        for (j, i) in enumerate(rows):
+            results = [0, int(lse_lost[j])]
+            for r_idx in xrange(self.raid_num):
+                if raid_failed[i, r_idx]:
+                    results[0] = self.dedup_model.raid_failure(float(corrupted_area[i, r_idx]))
+            losses.append((long(i), results))
+
+        return losses
+
+    def get_df(self):
+        return self.dedup_model.df
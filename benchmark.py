@@ -0,0 +1,461 @@
+#!/usr/bin/python
+#
+# Benchmarks of the simulator
+#
+import os
+import sys
+import time
+import json
+import shutil
+import getopt
+import random
+import tempfile
+import datetime
+import subprocess
+
+from system import *
+from scheduler import *
+from simulation import *
+from simd import get_presets
+
+#
+# The event queue used before EventScheduler: a list sorted in reverse order,
+# which is sorted again whenever a new event is out of order.
+# It is kept here as a baseline.
+#
+class SortedListScheduler:
+
+    def __init__(self, raid_num):
+        self.queue = []
+
+    def clear(self):
+        self.queue = []
+
+    def extend(self, events):
+        self.queue.extend(events)
+
+    def heapify(self):
+        self.queue = sorted(self.queue, reverse=True)
+
+    def push(self, event):
+        self.queue.append(event)
+        size = len(self.queue)
+        if size >= 2 and self.queue[size - 1] > self.queue[size - 2]:
+            self.queue = sorted(self.queue, reverse=True)
+
+    def pop(self):
+        return self.queue.pop()
+
+# Every disk keeps one pending event, as in System.
+# Each popped event is replaced by a later event of the same disk.
+def bench_queue(scheduler_class, raid_num, disk_num=16, events=20000):
+    scheduler = scheduler_class(raid_num)
+    random.seed(0)
+
+    scheduler.clear()
+    scheduler.extend([(random.random(), d, r) for r in xrange(raid_num) for d in xrange(disk_num)])
+    scheduler.heapify()
+
+    start = time.time()
+    for i in xrange(events):
+        (event_time, disk_idx, raid_idx) = scheduler.pop()
+        scheduler.push((event_time + random.random(), disk_idx, raid_idx))
+    return (time.time() - start) / events
+
+# The time of a System iteration, with the default parameters
+def bench_system(raid_num, raid_type="mds_14_2", iterations=200):
+    system = System(87600, raid_type, raid_num, 2*1024*1024*1024L, (1.13, 302016.0, 0), (1.65, 22.7, 0),
+            (1.0/12325), (1, 186, 0), None, False, False, False)
+    seed_stream(0)
+
+    start = time.time()
+    for i in xrange(iterations):
+        system.reset()
+        system.run()
+    return (time.time() - start) / iterations
+
+# The memory of a RAID after a reset (bytes),
+# without the distributions shared by the disks
+def bench_memory(raid_type="mds_14_2"):
+    system = System(87600, raid_type, 1, 2*1024*1024*1024L, (1.13, 302016.0, 0), (1.65, 22.7, 0),
+            (1.0/12325), (1, 186, 0), None, False, False, False)
+    system.reset()
+
+    raid = system.raids[0]
+    size = sys.getsizeof(raid)
+    for name in Raid.__slots__:
+        if name != "disk":
+            size += sys.getsizeof(getattr(raid, name))
+    return size
+
+def bench_scheduler(raid_nums):
+    results = {}
+
+    print "Event queue: time per event (us)"
+    print "%10s %15s %15s %10s" % ("raid_num", "sorted list", "heap", "speedup")
+    for raid_num in raid_nums:
+        t_list = bench_queue(SortedListScheduler, raid_num)
+        t_heap = bench_queue(EventScheduler, raid_num)
+        print "%10d %15.3f %15.3f %10.1f" % (raid_num, t_list * 1e6, t_heap * 1e6, t_list / t_heap)
+        results["queue_sorted_list n=%d" % raid_num] = t_list * 1e6
+        results["queue_heap n=%d" % raid_num] = t_heap * 1e6
+
+    print ""
+    print "System: time per iteration (ms)"
+    print "%10s %15s %15s" % ("raid_num", "ms/iteration", "us/raid")
+    for raid_num in raid_nums:
+        t = bench_system(raid_num)
+        print "%10d %15.3f %15.3f" % (raid_num, t * 1e3, t * 1e6 / raid_num)
+        results["system_iteration n=%d" % raid_num] = t * 1e6
+
+    print ""
+    memory = bench_memory()
+    print "RAID: memory (bytes)", memory
+    results["raid_memory"] = memory
+
+    return results
+
+#
+# Synthetic traces, in the formats read by the deduplication models of
+# system.py, so the models can be benchmarked without real traces.
+#
+# The chunks (or files) refer to a number of logical chunks drawn from a
+# geometric distribution, which are 8KB (or of a size drawn from a
+# lognormal distribution) if weighted. The fraction lost by a RAID
+# failure is 1 - (1 - corrupted area)^(D/F).
+#
+def trace_header(filelevel, dedup, weighted):
+    if filelevel:
+        level = "FILE"
+    else:
+        level = "CHUNK"
+    if dedup:
+        level += ":DEDUP"
+    else:
+        level += ":NO DEDUP"
+    if weighted:
+        return level + ":WEIGHTED\n"
+    return level + ":NOT WEIGHTED\n"
+
+def write_synthetic_trace(path, filelevel, dedup, weighted, entries=100000, seed=0):
+    rng = random.Random(seed)
+    f = open(path, "w")
+    f.write(trace_header(filelevel, dedup, weighted))
+
+    # FILE:NO DEDUP:NOT WEIGHTED only has the RAID failures
+    if dedup or weighted:
+        total = 0
+        for i in xrange(entries):
+            if dedup:
+                refs = 1 + int(rng.expovariate(1.0))
+            else:
+                refs = 1
+            total += refs
+            if weighted and filelevel:
+                size = 1 + int(rng.lognormvariate(10, 2))
+            else:
+                size = 8192
+            if weighted:
+                f.write("%d\n" % (refs * size))
+            else:
+                f.write("%d\n" % refs)
+        df = 1.0 * total / entries
+    else:
+        df = 1.0
+
+    if dedup:
+        f.write("%f\n" % df)
+    # the first line after the sizes of FILE:NO DEDUP:WEIGHTED is an integer 0
+    f.write("0\n")
+    for k in xrange(1, 101):
+        f.write("%f\n" % ((k / 100.0) ** df))
+    f.close()
+
+# (name, filelevel, dedup, weighted) of the deduplication models
+DEDUP_MODELS = [("chunk", False, False, False),
+        ("chunk_weighted", False, False, True),
+        ("chunk_dedup", False, True, False),
+        ("chunk_dedup_weighted", False, True, True),
+        ("file", True, False, False),
+        ("file_weighted", True, False, True),
+        ("file_dedup", True, True, False),
+        ("file_dedup_weighted", True, True, True)]
+
+# Write the traces of the models which need one into directory,
+# return {name: trace}
+def write_synthetic_traces(directory):
+    traces = {}
+    for (name, filelevel, dedup, weighted) in DEDUP_MODELS:
+        if not filelevel and not dedup:
+            traces[name] = None
+            continue
+        traces[name] = os.path.join(directory, name + ".trace")
+        write_synthetic_trace(traces[name], filelevel, dedup, weighted)
+    return traces
+
+# The best time of repeats calls of f
+def best_of(repeats, f):
+    return min([f() for r in xrange(repeats)])
+
+def new_system(raid_type, raid_num, parms="Elerath2014A", trace=None, filelevel=False, dedup=False, weighted=False):
+    (disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms) = get_presets(parms, 1.0)
+    return System(87600, raid_type, raid_num, 2*1024*1024*1024L, disk_fail_parms, disk_repair_parms,
+            disk_lse_parms, disk_scrubbing_parms, trace, filelevel, dedup, weighted)
+
+# The time of System.go_to_next_event() per event, over the events of
+# whole iterations. The resets are not timed.
+def bench_next_event(raid_type, raid_num, events=20000):
+    system = new_system(raid_type, raid_num)
+    seed_stream(0)
+
+    n = 0
+    elapsed = 0.0
+    while n < events:
+        system.reset()
+        start = time.time()
+        while system.go_to_next_event() != None:
+            n += 1
+        elapsed += time.time() - start
+    return elapsed / n
+
+# The time of Raid.check_sectors_lost() of a RAID with parity_fragments
+# failed disks
+def bench_sectors_lost(raid_type, calls=20000):
+    system = new_system(raid_type, 1)
+    seed_stream(0)
+
+    raid = system.raids[0]
+    raid.reset(0, system.mission_time, [1000.0 + idx for idx in xrange(raid.disk_num)])
+    for idx in xrange(raid.parity_fragments):
+        raid.update_to_event(1000.0 + idx, idx)
+    now = 1000.0 + raid.parity_fragments
+
+    start = time.time()
+    for i in xrange(calls):
+        raid.check_sectors_lost(now)
+    return (time.time() - start) / calls
+
+def bench_poisson(mean, calls=20000):
+    dist = Poisson(mean / 336.0)
+    seed_stream(0)
+
+    start = time.time()
+    for i in xrange(calls):
+        dist.draw(336)
+    return (time.time() - start) / calls
+
+# The time of sector_error() of a model, for LSE counts from 1 to 8
+def bench_sector_error(model, calls=20000):
+    seed_stream(0)
+
+    start = time.time()
+    for i in xrange(calls):
+        model.sector_error((i & 7) + 1)
+    return (time.time() - start) / calls
+
+def bench_micro(raid_types, traces, repeats):
+    results = {}
+
+    print "Micro-benchmarks: time per call (us)"
+    print "%-45s %15s" % ("benchmark", "us/call")
+
+    def report(name, t):
+        print "%-45s %15.3f" % (name, t * 1e6)
+        results[name] = t * 1e6
+
+    for raid_type in raid_types:
+        for raid_num in (1, 100):
+            report("go_to_next_event %s n=%d" % (raid_type, raid_num),
+                    best_of(repeats, lambda: bench_next_event(raid_type, raid_num)))
+        report("check_sectors_lost %s" % raid_type, best_of(repeats, lambda: bench_sectors_lost(raid_type)))
+
+    # the means of the LSEs over a scrubbing time, by inversion and by PTRS
+    for mean in (0.5, 5.0, 50.0):
+        report("Poisson.draw mean=%g" % mean, best_of(repeats, lambda: bench_poisson(mean)))
+
+    for (name, filelevel, dedup, weighted) in DEDUP_MODELS:
+        model = create_dedup_model(traces[name], filelevel, dedup, weighted)
+        report("sector_error %s" % name, best_of(repeats, lambda: bench_sector_error(model)))
+
+    return results
+
+# Run a Simulation of iterations quietly, return the iterations per second
+def bench_simulation(iterations, raid_type, raid_num, parms="Elerath2014A", trace=None, filelevel=False, dedup=False, weighted=False):
+    (disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms) = get_presets(parms, 1.0)
+    simulation = Simulation(87600, iterations, raid_type, raid_num, 2*1024*1024*1024L, disk_fail_parms, disk_repair_parms,
+            disk_lse_parms, disk_scrubbing_parms, False, 0.05, trace, filelevel, dedup, weighted, None, seed=0)
+    # the trace is parsed before the timing
+    shared_dedup_model(trace, filelevel, dedup, weighted)
+
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, "w")
+    try:
+        start = time.time()
+        simulation.simulate()
+        elapsed = time.time() - start
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+    return iterations / elapsed
+
+# The iterations of a configuration are scaled down by its RAIDs
+def bench_macro(raid_types, raid_nums, traces, iterations, repeats):
+    results = {}
+
+    print "Macro-benchmarks: Simulation.simulate() (iterations/s)"
+    print "%-45s %12s %15s" % ("configuration", "iterations", "iterations/s")
+
+    def report(name, n, f):
+        rate = max([f() for r in xrange(repeats)])
+        print "%-45s %12d %15.1f" % (name, n, rate)
+        results[name] = rate
+
+    for raid_type in raid_types:
+        for raid_num in raid_nums:
+            n = max(iterations / raid_num, 20)
+            report("%s n=%d" % (raid_type, raid_num), n, lambda: bench_simulation(n, raid_type, raid_num))
+
+    raid_type = raid_types[-1]
+    n = max(iterations / 10, 20)
+    for (name, filelevel, dedup, weighted) in DEDUP_MODELS:
+        report("%s n=10 %s" % (raid_type, name), n,
+                lambda: bench_simulation(n, raid_type, 10, "Elerath2014A", traces[name], filelevel, dedup, weighted))
+
+    return results
+
+def get_commit():
+    try:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        p = subprocess.Popen(["git", "rev-parse", "--short", "HEAD"], cwd=directory,
+                stdout=subprocess.PIPE, stderr=open(os.devnull, "w"))
+        commit = p.communicate()[0].strip()
+        if p.returncode == 0:
+            return commit
+    except OSError:
+        pass
+    return None
+
+#
+# The results are stored as
+# {"commit": ..., "date": ..., "python": ..., "numpy": ...,
+#  "scheduler": {...}, "micro": {benchmark: us/call}, "macro": {configuration: iterations/s}}
+#
+def save_results(results, path):
+    results["commit"] = get_commit()
+    results["date"] = datetime.datetime.now().isoformat()
+    results["python"] = sys.version.split()[0]
+    results["numpy"] = numpy.__version__
+
+    f = open(path, "w")
+    json.dump(results, f, indent=1, sort_keys=True)
+    f.write("\n")
+    f.close()
+
+# The speedup of the new results over the old ones; times are lower the
+# better, except the iterations/s of the macro-benchmarks.
+# The changes beyond threshold are marked.
+def compare(old_path, new_path, threshold):
+    old = json.load(open(old_path))
+    new = json.load(open(new_path))
+
+    print "old: %s (%s)" % (old_path, old.get("commit"))
+    print "new: %s (%s)" % (new_path, new.get("commit"))
+    for suite in ("scheduler", "micro", "macro"):
+        if suite not in old or suite not in new:
+            continue
+        print ""
+        print "%-45s %15s %15s %10s" % (suite, "old", "new", "speedup")
+        for name in sorted(set(old[suite]) & set(new[suite])):
+            (a, b) = (old[suite][name], new[suite][name])
+            if a == 0 or b == 0:
+                continue
+            if suite == "macro":
+                speedup = b / a
+            else:
+                speedup = a / b
+            mark = ""
+            if speedup > 1 + threshold:
+                mark = "+"
+            elif speedup < 1 - threshold:
+                mark = "-"
+            print "%-45s %15.3f %15.3f %10.2f %s" % (name, a, b, speedup, mark)
+
+def usage(arg):
+    print arg, ": -h [--help] -n <raid_nums> [--raid_num <raid_nums>] -r <raid_types> [--raid <raid_types>]"
+    print "-b <benchmarks> [--bench <benchmarks>] -i <iterations> [--iterations <iterations>] --repeat <repeats>"
+    print "-o <json_file> [--output <json_file>]"
+    print arg, ": --compare <old_json_file> <new_json_file> [--threshold <threshold>]"
+    print ""
+    print "raid_nums = a list of RAID numbers, \"(1, 10, 100, 500)\" by default"
+    print "raid_types = a comma separated list, mds_7_1,mds_14_2 by default"
+    print "benchmarks = a comma separated list of scheduler, micro and macro, all by default"
+    print "iterations = the iterations of a macro-benchmark of 1 RAID, 2000 by default,"
+    print "             divided by the RAID number for more RAIDs"
+    print "The macro-benchmarks of the deduplication models use synthetic traces"
+    print "--compare prints the speedups of the new results, marking those beyond threshold (0.05)"
+    sys.exit(2)
+
+if __name__ == "__main__":
+    raid_nums = (1, 10, 100, 500)
+    raid_types = ["mds_7_1", "mds_14_2"]
+    benchmarks = ["scheduler", "micro", "macro"]
+    iterations = 2000
+    repeats = 3
+    output = None
+    old = None
+    threshold = 0.05
+
+    try:
+        (opts, args) = getopt.getopt(sys.argv[1:], "hn:r:b:i:o:", ["help", "raid_num=", "raid=", "bench=", "iterations=",
+            "repeat=", "output=", "compare=", "threshold="])
+    except:
+        usage(sys.argv[0])
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage(sys.argv[0])
+        elif o in ("-n", "--raid_num"):
+            raid_nums = eval(a)
+        elif o in ("-r", "--raid"):
+            raid_types = a.split(",")
+        elif o in ("-b", "--bench"):
+            benchmarks = a.split(",")
+        elif o in ("-i", "--iterations"):
+            iterations = int(a)
+        elif o == "--repeat":
+            repeats = int(a)
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--compare":
+            old = a
+        elif o == "--threshold":
+            threshold = float(a)
+
+    if old is not None:
+        if len(args) != 1:
+            usage(sys.argv[0])
+        compare(old, args[0], threshold)
+        sys.exit(0)
+
+    for b in benchmarks:
+        if b not in ("scheduler", "micro", "macro"):
+            usage(sys.argv[0])
+
+    directory = tempfile.mkdtemp(prefix="simd-bench-")
+    try:
+        traces = write_synthetic_traces(directory)
+
+        results = {}
+        if "scheduler" in benchmarks:
+            results["scheduler"] = bench_scheduler(raid_nums)
+            print ""
+        if "micro" in benchmarks:
+            results["micro"] = bench_micro(raid_types, traces, repeats)
+            print ""
+        if "macro" in benchmarks:
+            results["macro"] = bench_macro(raid_types, raid_nums, traces, iterations, repeats)
+    finally:
+        shutil.rmtree(directory)
+
+    if output is not None:
+        save_results(results, output)
@@ -4,15 +4,13 @@ def list_to_bm(list):
         bm = bm | (1 << elm)
     return bm
 
+# bm & -bm is the lowest set bit
 def bm_to_list(bm):
     list = []
-    tmp_bm = bm
-    count = 0
-    while tmp_bm != 0:
-        if tmp_bm & 1:
-            list.append(count)
-        count = count + 1
-        tmp_bm = tmp_bm >> 1
+    while bm:
+        low = bm & -bm
+        list.append(low.bit_length() - 1)
+        bm ^= low
     return list
 
 def list_of_list_to_bm_list(list):
@@ -0,0 +1,69 @@
+import os
+import sys
+import hashlib
+
+from checkpoint import *
+
+#
+# The results of the simulations, cached on disk by configuration, see
+# simd.py --cache.
+#
+# An entry is keyed by the hash of the parameters which change the
+# results: those of Simulation.get_config() and of the estimators, with
+# the trace replaced by the hash of its content. The number of iterations
+# and the required relative error are not part of the key, nor are the
+# seed, the engine and the outputs of the simulation.
+#
+# An entry is written like a checkpoint (see checkpoint.py), with the
+# accumulators, the counters, the iterations and the rounds of the runs
+# of the configuration so far, and its seed. A simulation with an entry
+# only runs the iterations which are still needed, as the next round of
+# the entry, whose random streams follow those of the entry, see
+# simulation.STREAM_BLOCK. Without a seed, the simulation takes that of
+# the entry; with another seed, the streams of the next round still differ
+# from those of the entry, as the round does. A resumed simulation (see
+# simd.py --resume) does not read the entry, as its checkpoint holds the
+# results of the entry it continued, and writes it at the end.
+#
+
+# The digests of the traces, by (path, size, mtime)
+trace_digests = {}
+
+def file_digest(path):
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime)
+    if key not in trace_digests:
+        digest = hashlib.sha256()
+        f = open(path, "rb")
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            digest.update(data)
+        f.close()
+        trace_digests[key] = digest.hexdigest()
+    return trace_digests[key]
+
+# The path of the entry of the configuration, a dict of the parameters
+def cache_path(cache_dir, config):
+    config = dict(config)
+    if config["trace"] is not None:
+        config["trace"] = file_digest(config["trace"])
+    key = hashlib.sha256(repr(sorted(config.items()))).hexdigest()
+    return os.path.join(cache_dir, key)
+
+# The entry, or None if there is none or it cannot be read
+def load_cache(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        return load_checkpoint(path)
+    except Exception as e:
+        print >> sys.stderr, "The cached results are ignored:", e
+        return None
+
+def save_cache(path, entry):
+    cache_dir = os.path.dirname(path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    save_checkpoint(path, entry)
@@ -0,0 +1,34 @@
+import os
+import cPickle
+
+#
+# Checkpoints of a simulation.
+#
+# A checkpoint is a pickled dict with the parameters of the simulation,
+# its accumulators and counters, the position of the iterations and the
+# states of the random streams. It is written to a temporary file which
+# is then renamed, so a crash while writing leaves the last checkpoint
+# intact.
+#
+CHECKPOINT_VERSION = 6
+
+def save_checkpoint(path, state):
+    state["version"] = CHECKPOINT_VERSION
+
+    tmp = path + ".tmp"
+    f = open(tmp, "wb")
+    cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+    os.rename(tmp, path)
+
+def load_checkpoint(path):
+    f = open(path, "rb")
+    state = cPickle.load(f)
+    f.close()
+
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise Exception("%s: unsupported checkpoint version %s" % (path, state.get("version")))
+    return state
@@ -1,14 +1,22 @@
+import array
 import logging
 from stochastic import *
 from bm_ops import *
 
-class Disk:
+#
+# The distributions of a disk. The state of the disks is kept by Raid,
+# so a single Disk is shared by all disks of a system. All times are
+# absolute: a draw is added to the time the phase starts.
+#
+class Disk(object):
 
-    DISK_STATE_OK = "ok"
-    DISK_STATE_FAILED = "failed"
+    __slots__ = ("disk_fail_dist", "disk_repair_dist", "disk_scrubbing_dist", "disk_lse_dist", "disk_lse_count_dist")
 
-    DISK_EVENT_FAIL = "event disk fail"
-    DISK_EVENT_REPAIR = "event disk repair"
+    DISK_STATE_OK = 0
+    DISK_STATE_FAILED = 1
+
+    DISK_EVENT_FAIL = 0
+    DISK_EVENT_REPAIR = 1
 
     SECTOR_SIZE = 512 # bytes
 
@@ -22,37 +30,37 @@ disk_lse_parms = %s, disk_scrubbing_parms = %s" %
             (str(disk_fail_parms), str(disk_repair_parms), str(disk_lse_parms), str(disk_scrubbing_parms)))
 
         (shape, scale, location) = disk_fail_parms
-        self.disk_fail_dist = Weibull(shape, scale, location);
+        self.disk_fail_dist = shared_weibull(shape, scale, location)
         (shape, scale, location) = disk_repair_parms
-        self.disk_repair_dist = Weibull(shape, scale, location);
+        self.disk_repair_dist = shared_weibull(shape, scale, location)
         (shape, scale, location) = disk_scrubbing_parms
-        self.disk_scrubbing_dist = Weibull(shape, scale, location);
+        self.disk_scrubbing_dist = shared_weibull(shape, scale, location)
 
         (rate) = disk_lse_parms
         self.disk_lse_dist = Poisson(rate)
+        # the number of LSEs over a scrubbing time
+        self.disk_lse_count_dist = mixed_poisson(rate, disk_scrubbing_parms)
 
-        # When will the disk be repaired
-        self.repair_time = 0
-        # When the repair starts
-        self.repair_start_time = 0 
+    # When will a disk, which is new or repaired at start_time, fail
+    def draw_fail_time(self, start_time):
+        return self.disk_fail_dist.draw() + start_time
 
-        self.state = Disk.DISK_STATE_OK
-        # When will the disk fail
-        self.fail_time = 0
+    # When will num new disks fail
+    def draw_fail_times(self, num):
+        draw = self.disk_fail_dist.draw
+        return [draw() for i in xrange(num)]
 
-    def reset(self):
-        self.state = Disk.DISK_STATE_OK
-        self.fail_time = self.disk_fail_dist.draw()
-        self.repair_time = 0
-        self.repair_start_time = 0 
-        return self.fail_time
+    # When will a disk, which fails at fail_time, be repaired
+    def draw_repair_time(self, fail_time):
+        return self.disk_repair_dist.draw() + fail_time
 
-    def is_failure(self):
-        return self.state != Disk.DISK_STATE_OK
+    # Draw the time of a pending event again, given that it has not
+    # happened by current_time
+    def resample_fail_time(self, start_time, current_time):
+        return start_time + self.disk_fail_dist.draw_residual(current_time - start_time)
 
-    # call it only when disk is failed
-    def get_repair_process(self, current_time):
-        return (1.0 * current_time - self.repair_start_time)/(self.repair_time - self.repair_start_time)
+    def resample_repair_time(self, repair_start_time, current_time):
+        return repair_start_time + self.disk_repair_dist.draw_residual(current_time - repair_start_time)
 
     def get_scrubbing_time(self):
         return self.disk_scrubbing_dist.draw()
@@ -60,49 +68,76 @@ disk_lse_parms = %s, disk_scrubbing_parms = %s" %
     def generate_sector_errors(self, time):
         return self.disk_lse_dist.draw(time)
 
-    def repair(self):
-        self.state = Disk.DISK_STATE_OK
+#
+# A disk for importance sampling: the failures are more likely and the
+# repairs may be slower, so overlapping failures show up more often.
+# Each draw updates the likelihood ratio of the iteration.
+#
+class BiasedDisk(Disk):
+
+    __slots__ = ("mission_time",)
 
-        self.fail_time = self.disk_fail_dist.draw() + self.repair_time
-        self.repair_time = 0
-        self.repair_start_time = 0
-        return self.fail_time
+    def __init__(self, disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms,
+            bias, ratio, mission_time):
+        Disk.__init__(self, disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms)
 
-    def fail(self):
-        self.state = Disk.DISK_STATE_FAILED
+        (fail_bias, repair_bias) = bias
+        (shape, scale, location) = disk_fail_parms
+        self.disk_fail_dist = BiasedWeibull(shape, scale, location, scale / fail_bias, ratio)
+        (shape, scale, location) = disk_repair_parms
+        self.disk_repair_dist = BiasedWeibull(shape, scale, location, scale * repair_bias, ratio)
+
+        self.mission_time = mission_time
 
-        self.repair_time = self.disk_repair_dist.draw() + self.fail_time
-        self.repair_start_time = self.fail_time 
-        self.fail_time = 0
-        return self.repair_time
+    # A failure after the mission time is never processed,
+    # so the failure draws are censored at the mission time.
+    # The repair time is not censored, since it determines the critical region.
+    def draw_fail_time(self, start_time):
+        return self.disk_fail_dist.draw(self.mission_time - start_time) + start_time
 
-    def get_next_event(self):
-        if self.state == Disk.DISK_STATE_OK:
-            return (Disk.DISK_EVENT_FAIL, self.fail_time)
-        return (Disk.DISK_EVENT_REPAIR, self.repair_time)
+    def draw_fail_times(self, num):
+        return [self.disk_fail_dist.draw(self.mission_time) for i in xrange(num)]
 
-class Raid:
+#
+# A RAID consists of many disks. The state of its disks is kept in
+# arrays indexed by the disk, and the failed disks in a bitmap.
+#
+class Raid(object):
+
+    __slots__ = ("type", "data_fragments", "parity_fragments", "disk_num", "disk_capacity", "disk",
+            "disk_state", "fail_time", "repair_time", "repair_start_time", "start_time",
+            "failed_disk_count", "failed_disk_bitmap", "critical_region", "state", "corrupted_area", "lse_count")
 
     logger = logging.getLogger("sim")
 
-    RAID_STATE_OK = "ok"
-    RAID_STATE_FAILED = "failed"
+    RAID_STATE_OK = 0
+    RAID_STATE_FAILED = 1
 
-    # A RAID consists of many disks
-    def __init__(self, raid_type, disk_capacity, disk_fail_parms,
-            disk_repair_parms, disk_lse_parms, disk_scrubbing_parms):
+    # disk is the Disk (or BiasedDisk) of all disks
+    def __init__(self, raid_type, disk_capacity, disk):
         # default is "mds_7_1"
         (self.type, d, p) = raid_type.split("_");
         self.data_fragments = int(d)
         self.parity_fragments = int(p)
+        self.disk_num = self.data_fragments + self.parity_fragments
 
         # the capacity in byte is disk_capacity * SECTOR_SIZE
         self.disk_capacity = disk_capacity
 
         self.logger.debug("RAID: raid_type = %s, data = %d, parity = %d, disk_capacity = %d" % (self.type, self.data_fragments, self.parity_fragments, self.disk_capacity))
 
-        self.disks = [Disk(disk_fail_parms, disk_repair_parms,
-            disk_lse_parms, disk_scrubbing_parms) for i in range(self.data_fragments + self.parity_fragments)]
+        self.disk = disk
+
+        # the state of each disk
+        self.disk_state = array.array("b", [Disk.DISK_STATE_OK]) * self.disk_num
+        # When will the disk fail
+        self.fail_time = array.array("d", [0.0]) * self.disk_num
+        # When will the disk be repaired
+        self.repair_time = array.array("d", [0.0]) * self.disk_num
+        # When the repair starts
+        self.repair_start_time = array.array("d", [0.0]) * self.disk_num
+        # When the disk is new or repaired
+        self.start_time = array.array("d", [0.0]) * self.disk_num
 
         # the number of failed disks
         # > 0 indicates the RAID is degraded
@@ -115,7 +150,9 @@ class Raid:
         self.corrupted_area = 0
         self.lse_count = 0
 
-    def reset(self, r_idx, mission_time):
+    # fail_time is the list of the first failure times of the disks,
+    # drawn if None
+    def reset(self, r_idx, mission_time, fail_time=None):
         self.failed_disk_count = 0
         self.failed_disk_bitmap = 0
         self.critical_region = 0
@@ -125,23 +162,61 @@ class Raid:
         # for LSE
         self.lse_count = 0
 
+        n = self.disk_num
+        if fail_time is None:
+            fail_time = self.disk.draw_fail_times(n)
+
+        self.disk_state = array.array("b", [Disk.DISK_STATE_OK]) * n
+        self.fail_time = array.array("d", fail_time)
+        self.repair_time = array.array("d", [0.0]) * n
+        self.repair_start_time = array.array("d", [0.0]) * n
+        self.start_time = array.array("d", [0.0]) * n
+
+        return [(fail_time[idx], idx, r_idx) for idx in xrange(n) if fail_time[idx] <= mission_time]
+
+    def snapshot(self):
+        return (self.failed_disk_count, self.failed_disk_bitmap, self.critical_region, self.state,
+                self.corrupted_area, self.lse_count, self.disk_state[:], self.fail_time[:],
+                self.repair_time[:], self.repair_start_time[:], self.start_time[:])
+
+    # A snapshot can be restored many times, so its arrays are copied
+    def restore(self, snapshot):
+        (self.failed_disk_count, self.failed_disk_bitmap, self.critical_region, self.state,
+                self.corrupted_area, self.lse_count, disk_state, fail_time,
+                repair_time, repair_start_time, start_time) = snapshot
+        self.disk_state = disk_state[:]
+        self.fail_time = fail_time[:]
+        self.repair_time = repair_time[:]
+        self.repair_start_time = repair_start_time[:]
+        self.start_time = start_time[:]
+
+    # Draw the pending events of all disks again at current_time,
+    # and return them as reset() does
+    def resample(self, r_idx, current_time, mission_time):
         events = []
-        for idx in range(len(self.disks)):
-            event_time = self.disks[idx].reset()
+        for idx in xrange(self.disk_num):
+            if self.disk_state[idx] == Disk.DISK_STATE_OK:
+                event_time = self.disk.resample_fail_time(self.start_time[idx], current_time)
+                self.fail_time[idx] = event_time
+            else:
+                event_time = self.disk.resample_repair_time(self.repair_start_time[idx], current_time)
+                self.repair_time[idx] = event_time
             if event_time > mission_time:
                 continue
 
             events.append((event_time, idx, r_idx))
-        #events = sorted(events)
 
+        # the critical region depends on the repair times drawn again
+        if self.failed_disk_count >= self.parity_fragments:
+            self.calc_critical_region(current_time)
         return events
 
     # the region where data may loss
     def calc_critical_region(self, current_time):
-        failed_disk_idx = bm_to_list(self.failed_disk_bitmap)
         self.critical_region = 1.0
-        for idx in failed_disk_idx:
-            r = 1.0 - self.disks[idx].get_repair_process(current_time)
+        for idx in bm_to_list(self.failed_disk_bitmap):
+            start = self.repair_start_time[idx]
+            r = 1.0 - (1.0 * current_time - start)/(self.repair_time[idx] - start)
             if r < self.critical_region:
                 self.critical_region = r
 
@@ -152,9 +227,7 @@ class Raid:
 
         # calculate the bytes lost if the RAID is failure
         # We assume the RAID is well rotated.
-        data_fraction = 1.0 * self.data_fragments / (self.data_fragments + self.parity_fragments)
-
-        self.logger.debug("RAID Failure")
+        data_fraction = 1.0 * self.data_fragments / self.disk_num
 
         self.state = Raid.RAID_STATE_FAILED
 
@@ -169,55 +242,62 @@ class Raid:
 
         # No longer fault tolerent
         # Any LSE will lead to data loss
-        count = 0
-        for disk in self.disks:
-            if disk.is_failure() == True:
+        hits = 0
+        for idx in xrange(self.disk_num):
+            if self.disk_state[idx] != Disk.DISK_STATE_OK:
                 continue
             # Should we take repair time into account?
             if random.random() < self.critical_region:
-                time = disk.get_scrubbing_time()
-                count += disk.generate_sector_errors(time)
+                hits += 1
+
+        # The LSEs developed over the scrubbing times of the hit disks
+        count = self.disk.disk_lse_count_dist.draw_sum(hits)
 
         if count == 0:
             return False
 
-        self.logger.debug("%d sectors lost" % count)
-
         self.lse_count += count
         return True
 
     def degrade(self, disk_idx):
-        repair_time = self.disks[disk_idx].fail();
+        fail_time = self.fail_time[disk_idx]
+        repair_time = self.disk.draw_repair_time(fail_time)
+        self.disk_state[disk_idx] = Disk.DISK_STATE_FAILED
+        self.repair_time[disk_idx] = repair_time
+        self.repair_start_time[disk_idx] = fail_time
+        self.fail_time[disk_idx] = 0
+
         self.failed_disk_count += 1
         self.failed_disk_bitmap = bm_insert(self.failed_disk_bitmap, disk_idx)
         return repair_time
 
     def upgrade(self, disk_idx):
-        fail_time = self.disks[disk_idx].repair()
+        repair_time = self.repair_time[disk_idx]
+        fail_time = self.disk.draw_fail_time(repair_time)
+        self.disk_state[disk_idx] = Disk.DISK_STATE_OK
+        self.start_time[disk_idx] = repair_time
+        self.fail_time[disk_idx] = fail_time
+        self.repair_time[disk_idx] = 0
+        self.repair_start_time[disk_idx] = 0
+
         self.failed_disk_count -= 1
         self.failed_disk_bitmap = bm_rm(self.failed_disk_bitmap, disk_idx)
         self.critical_region = 0
         return fail_time
 
     def update_to_event(self, event_time, disk_idx):
-        event_type = 0
-        next_event_time = 0
-
-        if self.disks[disk_idx].is_failure() == True:
-            next_event_time = self.upgrade(disk_idx)
-            event_type = Disk.DISK_EVENT_REPAIR
-        else:
-            next_event_time = self.degrade(disk_idx)
-            if self.failed_disk_count >= self.parity_fragments:
-                self.calc_critical_region(event_time)
-            event_type = Disk.DISK_EVENT_FAIL
+        if self.disk_state[disk_idx] != Disk.DISK_STATE_OK:
+            return (Disk.DISK_EVENT_REPAIR, self.upgrade(disk_idx))
 
-        return (event_type, next_event_time)
+        next_event_time = self.degrade(disk_idx)
+        if self.failed_disk_count >= self.parity_fragments:
+            self.calc_critical_region(event_time)
+        return (Disk.DISK_EVENT_FAIL, next_event_time)
 
+# The mean time to failure and to repair of a disk
 def test():
     d = Disk()
     t = 0.0
-    last_t = 0.0
 
     fail_time = 0
     repair_time = 0
@@ -226,18 +306,11 @@ def test():
 
     while t < 1000000000.0:
         i += 1
-        (e, t) = d.get_next_event()
-        print e,t
-        if e == Disk.DISK_EVENT_FAIL:
-            d.fail(t)
-            fail_time += t - last_t
-        elif e == Disk.DISK_EVENT_REPAIR:
-            d.repair()
-            repair_time += t - last_t
-        else:
-            exit(2)
-        last_t = t
-    print i, fail_time, repair_time, fail_time/i*2, repair_time/i*2
+        next_t = d.draw_fail_time(t)
+        fail_time += next_t - t
+        t = d.draw_repair_time(next_t)
+        repair_time += t - next_t
+    print i, fail_time/i, repair_time/i
 
 if __name__ == "__main__":
     test()
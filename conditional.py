@@ -0,0 +1,106 @@
+import logging
+
+from system import *
+
+#
+# Conditional Monte Carlo on the first failures of the disks.
+#
+# A RAID only loses data when parity_fragments of its disks are failed at
+# once, so at least parity_fragments of its disks must fail for the first
+# time within the mission. Let A be the event that this happens in some
+# RAID. P(A) follows from the failure distribution, and the iterations
+# outside A lose nothing. So only iterations in A are simulated: the first
+# failure times are drawn given A, and each iteration is weighted by P(A).
+#
+# The disks are independent, so given A:
+#  - the first RAID in A is J, with P(J = j) = (1 - s)^j * s / P(A), where
+#    s is the probability of a RAID to be in A,
+#  - the RAIDs before J have less than parity_fragments first failures,
+#    RAID J has at least parity_fragments, and the others are free,
+#  - given the number of first failures of a RAID, the failed disks are
+#    uniform, their failure times are drawn below the mission time, and
+#    those of the other disks above it.
+#
+class ConditionalSystem(System):
+
+    logger = logging.getLogger("sim")
+
+    def __init__(self, mission_time, raid_type, raid_num, disk_capacity,
+            disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, trace, filelevel, dedup, weighted):
+        System.__init__(self, mission_time, raid_type, raid_num, disk_capacity,
+                disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, trace, filelevel, dedup, weighted)
+
+        (shape, scale, location) = disk_fail_parms
+        self.fail_dist = shared_weibull(shape, scale, location)
+
+        (type, d, p) = raid_type.split("_")
+        self.disk_num = int(d) + int(p)
+        self.parity_fragments = int(p)
+
+        # the number of first failures of a RAID is binomial
+        q = self.fail_dist.cdf(mission_time)
+        n = self.disk_num
+        self.count_pmf = binomial_pmf(n, q)
+
+        # the probability of a RAID, and of the system, to be in A
+        self.raid_prob = min(1.0, sum(self.count_pmf[self.parity_fragments:]))
+        if self.raid_prob < 1.0:
+            self.prob = -expm1(raid_num * log1p(-self.raid_prob))
+        else:
+            self.prob = 1.0
+
+        self.logger.debug("ConditionalSystem: P(A) = %e" % self.prob)
+
+    # Draw the number of first failures of a RAID in [low, high)
+    def draw_count(self, low, high):
+        u = random.random() * sum(self.count_pmf[low:high])
+        for k in xrange(low, high - 1):
+            u -= self.count_pmf[k]
+            if u < 0:
+                return k
+        return high - 1
+
+    # The index of the first RAID in A
+    def draw_first_raid(self):
+        if self.raid_prob >= 1.0:
+            return 0
+        j = int(log1p(-random.random() * self.prob) / log1p(-self.raid_prob))
+        return min(j, self.raid_num - 1)
+
+    # The first failure times of the disks of a RAID with count first failures
+    def draw_fail_times(self, count):
+        failed = set(random.sample(xrange(self.disk_num), count))
+        fail_time = []
+        for idx in xrange(self.disk_num):
+            if idx in failed:
+                fail_time.append(self.fail_dist.draw_below(self.mission_time))
+            else:
+                fail_time.append(self.fail_dist.draw_residual(self.mission_time))
+        return fail_time
+
+    # No data is lost if P(A) = 0, and nothing is simulated
+    def reset(self):
+        self.avail_raids = self.raid_num
+
+        if self.prob > 0:
+            first = self.draw_first_raid()
+        else:
+            first = self.raid_num
+
+        p = self.parity_fragments
+        n = self.disk_num + 1
+
+        self.event_queue.clear()
+        for r_idx in range(len(self.raids)):
+            if r_idx < first:
+                count = self.draw_count(0, p)
+            elif r_idx == first:
+                count = self.draw_count(p, n)
+            else:
+                count = self.draw_count(0, n)
+            self.event_queue.extend(self.raids[r_idx].reset(r_idx, self.mission_time, self.draw_fail_times(count)))
+        self.event_queue.heapify()
+
+    # Each iteration stands for the iterations in A
+    def get_weight(self):
+        return self.prob
@@ -0,0 +1,244 @@
+#!/usr/bin/python
+#
+# The logs of data loss events, written with -o and read by the injector.
+#
+# The text format has a line for each iteration with data loss events,
+# and a line with the number of iterations at the end of each run:
+#   R=0.2112        a RAID failure, with the corrupted area
+#   S=1             uncorrectable LSEs
+#   R=0.2121 S=1    both
+#   I=100000        the number of iterations
+# The lines of the events end with K=<seed>:<round>:<index>, the random
+# stream of the iteration, see simd.py --replay.
+#
+# The binary format is a header followed by fixed-width records:
+#   header: magic (8 bytes), number of iterations (int64), length of the
+#           configuration (uint32), the configuration as a Python literal,
+#           and padding to 8 bytes
+#   record: iteration (int64), corrupted area (float64), LSE count (int64),
+#           round (int64), index of the iteration in the round (int64)
+# The seed is in the configuration, so the random stream of an iteration
+# is known from its record, see simd.py --replay. The records of the
+# first version of the format (SIMDLOG1) have no round and index.
+# All numbers are little-endian. A binary log holds a single run, and the
+# number of iterations is written when the log is closed.
+#
+# The events are buffered and written by a background thread.
+#
+import os
+import sys
+import ast
+import struct
+import getopt
+import threading
+import Queue
+import numpy
+
+MAGIC = "SIMDLOG2"
+HEADER = struct.Struct("<8sqI")
+EVENT_DTYPE = numpy.dtype([("iteration", "<i8"), ("corrupted_area", "<f8"), ("lse_count", "<i8"),
+        ("round", "<i8"), ("round_iteration", "<i8")])
+
+# the records of the first version of the binary format
+MAGIC_V1 = "SIMDLOG1"
+EVENT_DTYPE_V1 = numpy.dtype([("iteration", "<i8"), ("corrupted_area", "<f8"), ("lse_count", "<i8")])
+
+# the number of events handed to the writer thread at once
+BUFFER_EVENTS = 4096
+
+class EventLog:
+
+    def __init__(self, f):
+        self.file = f
+        self.buffer = []
+
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self.write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # round_iteration is the index of the iteration in its round
+    def add(self, iteration, corrupted_area, lse_count, round, round_iteration):
+        self.buffer.append((iteration, corrupted_area, lse_count, round, round_iteration))
+        if len(self.buffer) >= BUFFER_EVENTS:
+            self.queue.put(self.buffer)
+            self.buffer = []
+
+    def write_loop(self):
+        while True:
+            events = self.queue.get()
+            if events is None:
+                self.queue.task_done()
+                break
+            self.write_events(events)
+            self.queue.task_done()
+
+    # Wait until all events are written
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.queue.put(self.buffer)
+            self.buffer = []
+        self.queue.join()
+        self.file.flush()
+
+    def size(self):
+        self.flush()
+        return os.fstat(self.file.fileno()).st_size
+
+    # Drop the events written after the log had the size, see Simulation.set_state()
+    def truncate(self, size):
+        self.flush()
+        self.file.truncate(size)
+        self.file.seek(0, 2)
+
+    def close(self, iterations):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+        self.write_iterations(iterations)
+        self.file.close()
+
+class TextEventLog(EventLog):
+
+    # a text log is appended to, seed is that of the random streams
+    def __init__(self, path, seed):
+        EventLog.__init__(self, open(path, "a"))
+        self.seed = seed
+
+    def write_events(self, events):
+        lines = []
+        for (iteration, corrupted_area, lse_count, round, round_iteration) in events:
+            fields = []
+            if corrupted_area != 0:
+                fields.append("R=%.6f" % corrupted_area)
+            if lse_count != 0:
+                fields.append("S=%d" % lse_count)
+            fields.append("K=%d:%d:%d" % (self.seed, round, round_iteration))
+            lines.append(" ".join(fields) + "\n")
+        self.file.write("".join(lines))
+
+    def write_iterations(self, iterations):
+        self.file.write("I=%d\n" % iterations)
+
+class BinaryEventLog(EventLog):
+
+    # config is a dict of the parameters of the simulation
+    def __init__(self, path, config, resume=False):
+        if resume:
+            f = open(path, "r+b")
+            f.seek(0, 2)
+        else:
+            f = open(path, "w+b")
+            f.write(pack_header(config, 0))
+        EventLog.__init__(self, f)
+
+    def write_events(self, events):
+        self.file.write(numpy.array(events, dtype=EVENT_DTYPE).tostring())
+
+    def write_iterations(self, iterations):
+        self.file.seek(len(MAGIC))
+        self.file.write(struct.pack("<q", iterations))
+
+# Collect the events in a worker process, see simulation.run_task()
+class EventList:
+
+    def __init__(self):
+        self.events = []
+
+    def add(self, iteration, corrupted_area, lse_count, round, round_iteration):
+        self.events.append((iteration, corrupted_area, lse_count, round, round_iteration))
+
+def pack_header(config, iterations):
+    config = repr(config)
+    header = HEADER.pack(MAGIC, iterations, len(config)) + config
+    return header + "\0" * (-len(header) % 8)
+
+def is_binary(path):
+    f = open(path, "rb")
+    magic = f.read(len(MAGIC))
+    f.close()
+    return magic in (MAGIC, MAGIC_V1)
+
+#
+# Return (config, iterations, events) of a binary log,
+# the events are a NumPy array of EVENT_DTYPE (or EVENT_DTYPE_V1) mapped
+# from the file
+#
+def read_binary_events(path):
+    f = open(path, "rb")
+    (magic, iterations, length) = HEADER.unpack(f.read(HEADER.size))
+    config = ast.literal_eval(f.read(length))
+    f.close()
+
+    dtype = EVENT_DTYPE
+    if magic == MAGIC_V1:
+        dtype = EVENT_DTYPE_V1
+
+    offset = HEADER.size + length
+    offset += -offset % 8
+    count = (os.path.getsize(path) - offset) / dtype.itemsize
+    if count == 0:
+        return (config, iterations, numpy.zeros(0, dtype=dtype))
+    return (config, iterations, numpy.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,)))
+
+#
+# Return (None, iterations, events) of a text log, in the same form as
+# read_binary_events(). The iterations of the events are unknown (-1),
+# and so are their rounds and indexes in lines without a K field.
+#
+def read_text_events(path):
+    events = []
+    iterations = 0L
+    for line in open(path, "r"):
+        corrupted_area = 0.0
+        lse_count = 0
+        (round, round_iteration) = (-1, -1)
+        for field in line.split():
+            (key, value) = field.split("=")
+            if key == "I":
+                iterations += long(value)
+            elif key == "R":
+                corrupted_area = float(value)
+            elif key == "S":
+                lse_count = int(value)
+            elif key == "K":
+                (round, round_iteration) = [long(v) for v in value.split(":")[1:]]
+        if corrupted_area != 0 or lse_count != 0:
+            events.append((-1, corrupted_area, lse_count, round, round_iteration))
+
+    return (None, iterations, numpy.array(events, dtype=EVENT_DTYPE))
+
+def read_events(path):
+    if is_binary(path):
+        return read_binary_events(path)
+    return read_text_events(path)
+
+# Convert a text log, which may hold several runs, to a binary log
+def text_to_binary(text_path, binary_path):
+    (config, iterations, events) = read_text_events(text_path)
+    f = open(binary_path, "wb")
+    f.write(pack_header({}, iterations))
+    f.write(events.tostring())
+    f.close()
+
+def usage(arg):
+    print arg, ": -h [--help] -c <text_log> <binary_log> [--convert <text_log> <binary_log>]"
+    sys.exit(2)
+
+if __name__ == "__main__":
+    try:
+        (opts, args) = getopt.gnu_getopt(sys.argv[1:], "hc", ["help", "convert"])
+    except:
+        usage(sys.argv[0])
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage(sys.argv[0])
+        elif o in ("-c", "--convert"):
+            if len(args) != 2:
+                usage(sys.argv[0])
+            text_to_binary(args[0], args[1])
+            sys.exit(0)
+
+    usage(sys.argv[0])
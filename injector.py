@@ -1,93 +1,112 @@
 #!/usr/bin/python
 import getopt
+import multiprocessing
 from system import *
 from statistics import *
 from simd import *
-
-def inject(eventfile, model):
-    total_iterations = 0L
-
-    systems_with_raid_failure = 0
-    systems_with_lse = 0
-    systems_with_data_loss = 0
-
-    lse_count = 0
-    raid_count = 0
-
+from eventlog import *
+
+#
+# Score the data loss events of a log against deduplication models.
+#
+# The log is read once, and only the non-zero corrupted areas and LSE
+# counts are kept. Each trace is then scored with the vectorized
+# raid_failures() and sector_errors() of its model, and the traces are
+# spread over worker processes.
+#
+
+# Return (config, iterations, systems with data loss, corrupted areas, LSE counts)
+# The events are read by eventlog.read_events(), in the text or the binary format
+def load_events(eventfile):
+    (config, iterations, events) = read_events(eventfile)
+
+    corrupted_areas = events["corrupted_area"]
+    corrupted_areas = numpy.array(corrupted_areas[corrupted_areas != 0])
+    lse_nums = events["lse_count"]
+    lse_nums = numpy.array(lse_nums[lse_nums != 0])
+
+    return (config, iterations, len(events), corrupted_areas, lse_nums)
+
+# rng draws the chunks or files hit by LSEs
+def inject(corrupted_areas, lse_nums, total_iterations, model, rng):
     raid_failure_samples = Samples()
     lse_samples = Samples()
 
-    for line in eventfile:
-        # I=100000; iteration
-        # R=0.2112; Raid Failure
-        # S=1; Uncorruptable LSE
-        # R=0.2121 S=1; Raid Failure and LSE
-        systems_with_data_loss += 1
-        for r in line.split():
-            result = r.split("=")
-            if result[0] is "I":
-                iteration = long(result[1])
-
-                lse_samples.addZeros(iteration-lse_count)
-                raid_failure_samples.addZeros(iteration-raid_count)
+    fractions = model.raid_failures(corrupted_areas)
+    raid_failure_samples.addSampleArray(fractions[fractions != 0], total_iterations)
 
-                total_iterations += iteration
-                systems_with_data_loss -= 1 
+    losses = model.sector_errors(lse_nums, rng)
+    lse_samples.addSampleArray(losses[losses != 0], total_iterations)
 
-                lse_count = 0
-                raid_count = 0
-
-                continue
+    raid_failure_samples.calcResults("0.95")
+    lse_samples.calcResults("0.95")
 
-            if result[0] is "R":
-                systems_with_raid_failure += 1
-                corrupted_area = float(result[1])
+    return (raid_failure_samples, lse_samples, len(corrupted_areas), len(lse_nums))
 
-                fraction = model.raid_failure(corrupted_area)
+# The events of the log, set in each worker process
+replay_events = None
 
-                raid_failure_samples.addSample(fraction)
+def init_replay(events):
+    global replay_events
+    replay_events = events
 
-                raid_count += 1
+# key is the key of the random stream, see stochastic.seed_stream()
+def replay_trace(trace, filelevel, dedup, weighted, key):
+    (iterations, corrupted_areas, lse_nums) = replay_events
 
-                #print >>sys.stderr, "R=%f -> %f" % (corrupted_area, fraction),
-            elif result[0] is "S":
-                systems_with_lse += 1
-                lse_num = int(result[1])
+    model = create_dedup_model(trace, filelevel, dedup, weighted)
+    rng = numpy.random.RandomState(seed_stream(*key))
 
-                loss = model.sector_error(lse_num)
+    return inject(corrupted_areas, lse_nums, iterations, model, rng) + (model.df,)
 
-                lse_samples.addSample(loss)
+def replay_task(args):
+    return replay_trace(*args)
 
-                lse_count += 1
+# Return a list of (raid_failure_samples, lse_samples, systems_with_raid_failure, systems_with_lse, df),
+# one for each trace
+def replay(events, traces, filelevel, dedup, weighted, seed, workers):
+    tasks = [(trace, filelevel, dedup, weighted, (seed, t)) for (t, trace) in enumerate(traces)]
 
-                #print >>sys.stderr, "S=%d -> %d" % (lse_num, loss),
+    if workers > 1 and len(traces) > 1:
+        pool = multiprocessing.Pool(min(workers, len(traces)), init_replay, (events,))
+        results = pool.map(replay_task, tasks)
+        pool.close()
+        pool.join()
+        return results
 
-        #print >>sys.stderr, ""
+    init_replay(events)
+    return [replay_task(task) for task in tasks]
 
-    #print >>sys.stderr, "I=%d" % total_iterations
-
-    raid_failure_samples.calcResults("0.95")
-    lse_samples.calcResults("0.95")
-
-    return (raid_failure_samples, lse_samples, systems_with_data_loss, systems_with_raid_failure,
-            systems_with_lse, total_iterations)
+def usage(arg):
+    print arg, ": -h [--help] -e <event_file> [--events <event_file>] -t <trace> [--trace <trace>] ... [<trace> ...]"
+    print "-f [--filelevel] -d [--dedup] -w [--weighted] -s <seed> [--seed <seed>] --workers <num_workers>"
+    print ""
+    print "The event file is written by simd.py -o, in the text or the binary format"
+    print "Each trace is scored with the same events, and its results are printed"
+    sys.exit(2)
 
 if __name__ == "__main__":
     try:
-        (opts, args) = getopt.gnu_getopt(sys.argv[1:], "e:fdwt:", ["events", "filelevel", "dedup", "weighted", "trace"]) 
+        (opts, args) = getopt.gnu_getopt(sys.argv[1:], "he:fdwt:s:", ["help", "events=", "filelevel", "dedup", "weighted", "trace=",
+            "seed=", "workers="])
     except:
-        sys.exit(1)
+        usage(sys.argv[0])
 
     eventfile = None
 
     filelevel = False
     dedup = False
     weighted = False
-    tracefile = None
+    traces = []
+
+    seed = None
+    workers = 1
 
     for o, a in opts:
-        if o in ("-e", "--events"):
-            eventfile = open(a, "r")
+        if o in ("-h", "--help"):
+            usage(sys.argv[0])
+        elif o in ("-e", "--events"):
+            eventfile = a
         elif o in ("-f", "--filelevel"):
             filelevel = True
         elif o in ("-d", "--dedup"):
@@ -95,29 +114,37 @@ if __name__ == "__main__":
         elif o in ("-w", "--weighted"):
             weighted = True
         elif o in ("-t", "--trace"):
-            tracefile = a
+            traces.append(a)
+        elif o in ("-s", "--seed"):
+            seed = long(a)
+        elif o == "--workers":
+            workers = int(a)
         else:
             print "invalid option"
             sys.exit(1)
 
-    model = None
-    if filelevel == False:
-        if dedup == False:
-            model = DeduplicationModel_Chunk_NoDedup(weighted)
-        else:
-            model = DeduplicationModel_Chunk_Dedup(tracefile, weighted)
+    traces.extend(args)
+    if len(traces) == 0:
+        traces = [None]
+    if eventfile == None:
+        usage(sys.argv[0])
+    if seed == None:
+        seed = random.SystemRandom().getrandbits(64)
+
+    (config, iterations, systems_with_data_loss, corrupted_areas, lse_nums) = load_events(eventfile)
+
+    # the system of a binary log is known
+    if config:
+        (raid_type, raid_num, disk_capacity) = (config["raid_type"], config["raid_num"], config["disk_capacity"])
     else:
-        if dedup == False and weighted == False:
-            model = DeduplicationModel_File_NoDedup_NotWeighted(tracefile)
-        elif dedup == False and weighted == True:
-            model = DeduplicationModel_File_NoDedup_Weighted(tracefile)
-        elif dedup == True:
-            model = DeduplicationModel_File_Dedup(tracefile, weighted)
-        else:
-            print "invalid model"
-            sys.exit(1)
+        (raid_type, raid_num, disk_capacity) = ("mds_14_2", 1, 2*1024*1024*1024)
+
+    results = replay((iterations, corrupted_areas, lse_nums), traces, filelevel, dedup, weighted, seed, workers)
 
-    (raid_failure_samples, lse_samples, systems_with_data_loss, systems_with_raid_failure, systems_with_lse, total_iterations) = inject(eventfile, model)
+    for (trace, result) in zip(traces, results):
+        (raid_failure_samples, lse_samples, systems_with_raid_failure, systems_with_lse, df) = result
+        # print_result() only needs the flags of the model
+        model = DeduplicationModel(trace, filelevel, dedup, weighted)
 
-    print_result(model, raid_failure_samples, lse_samples, systems_with_data_loss, systems_with_raid_failure, systems_with_lse, total_iterations, "mds_14_2", 1, 2*1024*1024*1024, model.df)
-    eventfile.close()
+        print "Trace:", trace
+        print_result(model, raid_failure_samples, lse_samples, systems_with_data_loss, systems_with_raid_failure, systems_with_lse, iterations, raid_type, raid_num, disk_capacity, df)
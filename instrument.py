@@ -0,0 +1,225 @@
+import time
+import json
+
+from system import *
+from stochastic import *
+
+#
+# Counters and timers of the hot paths of a simulation, see --instrument.
+#
+# System.go_to_next_event() and the queue count the events, and the
+# subclass made by instrumented() adds them to the Instrumentation after
+# each iteration. Its RAIDs are CountedRaids. The variates are counted by
+# the positions of the pools, see stochastic.pool_draws(), so the calls
+# of random.random() are not.
+#
+# The time is split into phases:
+#   reset  = drawing the first failures of the iterations
+#   events = processing the events, see System.run()
+#   loss   = the data lost, see System.calc_bytes_lost() and the
+#            deduplication models
+#   output = writing the data loss events, see TimedEventLog
+#   other  = the rest of the run (samples, progress and checkpoints),
+#            only known without worker processes
+# The first three are timed on the middle iteration of each block of
+# iterations (see Simulation.run_local_iterations()), as the first one
+# refills the pools, and scaled to all iterations. With worker
+# processes, the phases are the sums over the workers.
+#
+class Instrumentation:
+
+    COUNTERS = ["iterations", "repair_events", "queued_events", "heap_replaces", "heap_pops", "skipped_events",
+            "sector_checks", "exposed_sector_checks", "pool_draws", "timed_iterations"]
+    TIMED_PHASES = ["reset", "events", "loss"]
+    PHASES = ["reset", "events", "loss", "output", "other"]
+
+    def __init__(self):
+        # the resets of the system
+        self.iterations = 0
+        # the repairs processed, see get_events() for all events
+        self.repair_events = 0
+        # the events queued by reset(), the events re-inserted with a
+        # single sift, the events popped, and the events of failed RAIDs
+        # skipped at the head of the queue
+        self.queued_events = 0
+        self.heap_replaces = 0
+        self.heap_pops = 0
+        self.skipped_events = 0
+        # the calls of Raid.check_sectors_lost(), and those with at
+        # least parity_fragments failed disks, which draw the LSEs
+        self.sector_checks = 0
+        self.exposed_sector_checks = 0
+        # the variates drawn from the pools of stochastic.py
+        self.pool_draws = 0
+
+        self.times = dict([(phase, 0.0) for phase in self.PHASES])
+        # the times of the TIMED_PHASES of the timed iterations
+        self.timed_iterations = 0
+        self.timed_times = dict([(phase, 0.0) for phase in self.TIMED_PHASES])
+        self.wall_time = 0.0
+
+    # The TIMED_PHASES of all iterations, from those of the timed ones
+    def scale_times(self):
+        if self.timed_iterations > 0:
+            for phase in self.TIMED_PHASES:
+                self.times[phase] = self.timed_times[phase] * self.iterations / self.timed_iterations
+
+    # Each event processed is replaced or popped in the queue,
+    # so the events are not counted on their own
+    def get_events(self):
+        return self.heap_replaces + self.heap_pops
+
+    # Add the counters of another process
+    def merge(self, other):
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for phase in self.PHASES:
+            self.times[phase] += other.times[phase]
+        for phase in self.TIMED_PHASES:
+            self.timed_times[phase] += other.timed_times[phase]
+
+    def get_state(self):
+        state = dict([(name, getattr(self, name)) for name in self.COUNTERS])
+        state["events"] = self.get_events()
+        state["fail_events"] = self.get_events() - self.repair_events
+        state["times"] = dict(self.times)
+        state["wall_time"] = self.wall_time
+        return state
+
+    def save(self, path):
+        f = open(path, "w")
+        json.dump(self.get_state(), f, indent=1, sort_keys=True)
+        f.write("\n")
+        f.close()
+
+    def report(self):
+        iterations = max(self.iterations, 1)
+        events = self.get_events()
+
+        print "**************************************"
+        print "Instrumentation:"
+        print "Iterations: %d, Events: %d (%f per iteration), Failures: %d, Repairs: %d" % (self.iterations,
+                events, 1.0 * events / iterations, events - self.repair_events, self.repair_events)
+        print "Event queue: %d queued, %d replaced, %d popped, %d skipped (failed RAIDs)" % (self.queued_events,
+                self.heap_replaces, self.heap_pops, self.skipped_events)
+        print "check_sectors_lost: %d calls, %d with LSEs drawn" % (self.sector_checks, self.exposed_sector_checks)
+        print "Pool variates drawn: %d (%f per iteration), without those of random.random()" % (self.pool_draws,
+                1.0 * self.pool_draws / iterations)
+
+        total = sum(self.times.values())
+        print "Time: %f seconds (wall), %f seconds (phases, %d iterations timed)" % (self.wall_time, total,
+                self.timed_iterations)
+        for phase in self.PHASES:
+            share = 0.0
+            if total > 0:
+                share = 100.0 * self.times[phase] / total
+            print "%10s: %12f seconds %6.2f%%" % (phase, self.times[phase], share)
+
+# A Raid which counts its sector checks, counters is set by
+# InstrumentedSystem.instrument()
+class CountedRaid(Raid):
+
+    __slots__ = ("counters",)
+
+    def check_sectors_lost(self, current_time):
+        self.counters.sector_checks += 1
+        if self.failed_disk_count >= self.parity_fragments:
+            self.counters.exposed_sector_checks += 1
+        return Raid.check_sectors_lost(self, current_time)
+
+#
+# The subclass of a System class (System, SplittingSystem or
+# ConditionalSystem) which counts and times its iterations, see
+# instrumented(). Call instrument() on a system before running it.
+#
+def make_instrumented(system_class):
+
+    class InstrumentedSystem(system_class):
+
+        raid_class = CountedRaid
+
+        # counters is an Instrumentation
+        def instrument(self, counters):
+            self.counters = counters
+            self.counting = True
+            for raid in self.raids:
+                raid.counters = counters
+            self.timed = False
+            self.timed_in = -1
+
+        # Time the phases of the iteration after skip more iterations
+        def time_iteration(self, skip):
+            self.timed_in = skip
+
+        def reset(self):
+            self.timed = self.timed_in == 0
+            self.timed_in -= 1
+            if not self.timed:
+                system_class.reset(self)
+            else:
+                start = time.time()
+                system_class.reset(self)
+                self.counters.timed_times["reset"] += time.time() - start
+            self.counters.iterations += 1
+            self.counters.queued_events += len(self.event_queue)
+
+        # The time of the events is that of run() without calc_bytes_lost()
+        def run(self):
+            counters = self.counters
+            if not self.timed:
+                result = system_class.run(self)
+            else:
+                times = counters.timed_times
+                loss = times["loss"]
+                start = time.time()
+                result = system_class.run(self)
+                times["events"] += time.time() - start - (times["loss"] - loss)
+                counters.timed_iterations += 1
+                self.timed = False
+
+            # the counts of the iteration
+            counters.heap_replaces += self.heap_replaces
+            counters.heap_pops += self.heap_pops
+            counters.repair_events += self.repair_events
+            (self.heap_replaces, self.heap_pops, self.repair_events) = (0, 0, 0)
+            queue = self.event_queue
+            counters.skipped_events += queue.skipped
+            queue.skipped = 0
+            return result
+
+        def calc_bytes_lost(self):
+            if not self.timed:
+                return system_class.calc_bytes_lost(self)
+            start = time.time()
+            results = system_class.calc_bytes_lost(self)
+            self.counters.timed_times["loss"] += time.time() - start
+            return results
+
+    return InstrumentedSystem
+
+instrumented = system_subclass("Instrumented", make_instrumented)
+
+# An event log (see eventlog.py) whose writes are timed
+class TimedEventLog:
+
+    def __init__(self, output, counters):
+        self.output = output
+        self.counters = counters
+
+    def add(self, iteration, corrupted_area, lse_count, round, round_iteration):
+        start = time.time()
+        self.output.add(iteration, corrupted_area, lse_count, round, round_iteration)
+        self.counters.times["output"] += time.time() - start
+
+    def flush(self):
+        start = time.time()
+        self.output.flush()
+        self.counters.times["output"] += time.time() - start
+
+    def close(self, iterations):
+        start = time.time()
+        self.output.close(iterations)
+        self.counters.times["output"] += time.time() - start
+
+    def __getattr__(self, name):
+        return getattr(self.output, name)
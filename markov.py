@@ -0,0 +1,98 @@
+#
+# An analytical Markov model of RAID failures.
+#
+# With exponential failure and repair times, the number of failed disks of
+# a RAID is a birth-death chain: from state i, a disk fails at rate
+# (n - i) * fail_rate and is repaired at rate i * repair_rate, where n is
+# the number of disks. State parity + 1 (a RAID failure) is absorbing.
+# The probability of reaching it within the mission time is computed by
+# uniformization. Latent sector errors are not modeled.
+#
+# For Weibull parameters, the chain is built from exponential distributions
+# with the same means, which gives a rough approximation.
+#
+from math import *
+
+# The mean of max(W, location) where W is Weibull(shape, scale):
+# E[W] + the integral of the CDF from 0 to location (Simpson's rule)
+def weibull_mean(shape, scale, location):
+    mean = scale * gamma(1.0 + 1.0/shape)
+    if location <= 0:
+        return mean
+
+    steps = 1000
+    h = 1.0 * location / steps
+    cdf = [1.0 - exp(-pow(h * i / scale, shape)) for i in xrange(steps + 1)]
+    area = cdf[0] + cdf[-1] + 4 * sum(cdf[1:-1:2]) + 2 * sum(cdf[2:-1:2])
+    return mean + area * h / 3
+
+class MarkovModel:
+
+    def __init__(self, mission_time, raid_type, raid_num, disk_fail_parms, disk_repair_parms):
+        self.mission_time = mission_time
+        self.raid_num = raid_num
+
+        (self.type, d, p) = raid_type.split("_");
+        self.data_fragments = int(d)
+        self.parity_fragments = int(p)
+
+        # True if both distributions are exponential, i.e., the model is exact
+        self.exact = True
+        for (shape, scale, location) in (disk_fail_parms, disk_repair_parms):
+            if shape != 1 or location != 0:
+                self.exact = False
+
+        self.fail_rate = 1.0 / weibull_mean(*disk_fail_parms)
+        self.repair_rate = 1.0 / weibull_mean(*disk_repair_parms)
+
+    # The probability that a RAID fails within the mission time
+    def raid_failure_probability(self):
+        n = self.data_fragments + self.parity_fragments
+        p = self.parity_fragments
+
+        up = [(n - i) * self.fail_rate for i in xrange(p + 1)]
+        down = [i * self.repair_rate for i in xrange(p + 1)]
+
+        # uniformization: P = I + Q/q
+        q = max([up[i] + down[i] for i in xrange(p + 1)])
+        stay = [1.0 - (up[i] + down[i]) / q for i in xrange(p + 1)]
+        up = [r / q for r in up]
+        down = [r / q for r in down]
+
+        # the probability of being in each state after k jumps of the chain
+        v = [0.0] * (p + 2)
+        v[0] = 1.0
+
+        # P(absorbed by T) = sum over k of Poisson(k; qT) * v_k[p+1]
+        qt = q * self.mission_time
+        last = int(qt + 10 * sqrt(qt) + 20)
+        result = 0.0
+        for k in xrange(last + 1):
+            weight = exp(-qt + k * log(qt) - lgamma(k + 1)) if qt > 0 else (1.0 if k == 0 else 0.0)
+            result += weight * v[p + 1]
+
+            next_v = [0.0] * (p + 2)
+            for i in xrange(p + 1):
+                next_v[i] += v[i] * stay[i]
+                next_v[i + 1] += v[i] * up[i]
+                if i > 0:
+                    next_v[i - 1] += v[i] * down[i]
+            next_v[p + 1] += v[p + 1]
+            v = next_v
+
+        return min(result, 1.0)
+
+    # The probability that any RAID of the system fails,
+    # assuming the RAIDs are independent
+    def system_failure_probability(self):
+        return 1.0 - pow(1.0 - self.raid_failure_probability(), self.raid_num)
+
+def test():
+    # a RAID-5 of 8 disks, MTTF = 461386 hours and MTTR = 12 hours
+    m = MarkovModel(87600, "mds_7_1", 1, (1, 461386.0, 0), (1, 12.0, 0))
+    # The classic approximation is T * n(n-1) * fail_rate^2 / repair_rate
+    n = 8
+    print m.raid_failure_probability(), 87600 * n * (n - 1) * pow(m.fail_rate, 2) / m.repair_rate
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,68 @@
+import heapq
+
+#
+# A priority queue of disk events (event_time, disk_idx, raid_idx),
+# the earliest event first.
+#
+# When a RAID fails, its pending events are not searched for and removed.
+# They are discarded lazily once they reach the head of the queue.
+# The storage of the queue is kept and reused across iterations.
+#
+class EventScheduler:
+
+    def __init__(self, raid_num):
+        self.heap = []
+        # discarded[raid_idx] is True if the RAID has failed
+        self.discarded = [False] * raid_num
+        self.discarded_count = 0
+        # the events of failed RAIDs skipped by head(), see instrument.py
+        self.skipped = 0
+
+    def clear(self):
+        del self.heap[:]
+
+        if self.discarded_count != 0:
+            for r_idx in xrange(len(self.discarded)):
+                self.discarded[r_idx] = False
+            self.discarded_count = 0
+
+    # Add events in any order, then call heapify()
+    def extend(self, events):
+        self.heap.extend(events)
+
+    # O(n) instead of sorting
+    def heapify(self):
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.heap)
+
+    # Return the earliest event of a RAID which has not failed,
+    # or None if there is no such event.
+    # The event stays in the queue until pop() or replace().
+    def head(self):
+        heap = self.heap
+        discarded = self.discarded
+        while heap:
+            event = heap[0]
+            if not discarded[event[2]]:
+                return event
+            heapq.heappop(heap)
+            self.skipped += 1
+        return None
+
+    def push(self, event):
+        heapq.heappush(self.heap, event)
+
+    def pop(self):
+        return heapq.heappop(self.heap)
+
+    # Pop the head and push a new event, with a single sift
+    def replace(self, event):
+        return heapq.heapreplace(self.heap, event)
+
+    # All events of the RAID will be ignored
+    def discard(self, raid_idx):
+        if not self.discarded[raid_idx]:
+            self.discarded[raid_idx] = True
+            self.discarded_count += 1
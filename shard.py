@@ -0,0 +1,89 @@
+import os
+import hashlib
+import cPickle
+
+from statistics import *
+
+#
+# Shards of a simulation, run on several machines and merged later.
+#
+# A shard is a run of simd.py with --shard <shard_file>, which writes its
+# results to the file when it ends: the accumulators of the two Samples,
+# the counts of the systems with data loss events, the iterations, the
+# D/F of the deduplication model, the configuration and the seed. The
+# file is pickled like a checkpoint (see checkpoint.py).
+#
+# The shards of a configuration run with different seeds, so their random
+# streams do not overlap, see stochastic.seed_stream(). A shard without a
+# seed draws one.
+#
+# merge_shards() checks that the shards have the same configuration, by
+# its fingerprint, and the same D/F, and that their seeds differ. Their
+# Samples are merged as those of the worker processes, see Samples.merge(),
+# so the result is that of a single run of all their iterations.
+#
+SHARD_VERSION = 1
+
+# The parameters which may differ between the shards of a configuration:
+# the trace is compared by the D/F of its model, as its path may differ
+# from machine to machine, and the batch engine gives the same estimates
+SHARD_FREE_PARMS = ("seed", "trace", "batch_size")
+
+def shard_fingerprint(config):
+    items = sorted([(k, v) for (k, v) in config.items() if k not in SHARD_FREE_PARMS])
+    return hashlib.sha256(repr(items)).hexdigest()
+
+def save_shard(path, shard):
+    shard["version"] = SHARD_VERSION
+
+    tmp = path + ".tmp"
+    f = open(tmp, "wb")
+    cPickle.dump(shard, f, cPickle.HIGHEST_PROTOCOL)
+    f.close()
+
+    os.rename(tmp, path)
+
+def load_shard(path):
+    f = open(path, "rb")
+    shard = cPickle.load(f)
+    f.close()
+
+    if shard.get("version") != SHARD_VERSION:
+        raise Exception("%s: unsupported shard version %s" % (path, shard.get("version")))
+    return shard
+
+#
+# Merge the shards of the files into one, raise an Exception if they are
+# not shards of the same configuration or if their streams overlap
+#
+def merge_shards(paths):
+    merged = None
+    seeds = {}
+    for path in paths:
+        shard = load_shard(path)
+
+        if shard["seed"] in seeds:
+            raise Exception("%s: the seed %d is that of %s, the random streams overlap" % (path, shard["seed"],
+                    seeds[shard["seed"]]))
+        seeds[shard["seed"]] = path
+
+        if merged is None:
+            merged = shard
+            merged["seeds"] = [shard["seed"]]
+            continue
+
+        if shard["fingerprint"] != merged["fingerprint"]:
+            config = merged["config"]
+            parms = [k for k in sorted(config) if k not in SHARD_FREE_PARMS and shard["config"].get(k) != config[k]]
+            raise Exception("%s: the configuration differs from that of %s: %s" % (path, paths[0],
+                    ", ".join(["%s=%r instead of %r" % (k, shard["config"].get(k), config[k]) for k in parms])))
+        if shard["df"] != merged["df"]:
+            raise Exception("%s: the D/F %f differs from %f of %s" % (path, shard["df"], merged["df"], paths[0]))
+
+        merged["raid_failure_samples"].merge(shard["raid_failure_samples"])
+        merged["lse_samples"].merge(shard["lse_samples"])
+        for name in ("systems_with_data_loss", "systems_with_raid_failures", "systems_with_lse", "iterations"):
+            merged[name] += shard[name]
+        merged["seeds"].append(shard["seed"])
+
+    return merged
@@ -1,4 +1,5 @@
 #!/usr/bin/python
+import os
 import time
 import sys
 import logging
@@ -8,6 +9,8 @@ import getopt
 from simulation import *
 from statistics import *
 from system import *
+from markov import *
+from checkpoint import *
 
 def usage(arg):
     print arg, ": -h [--help] -l [--log] -m <mission_time> [--mission_time <mission_time>]"
@@ -23,6 +26,24 @@ def usage(arg):
     print "-f [--filelevel]"
     print "-d [--dedup]"
     print "-w [--weighted]"
+    print "-b <block_size> [--batch <block_size>]"
+    print "-s <seed> [--seed <seed>]"
+    print "--workers <num_workers>"
+    print "-B <bias> [--bias <bias>]"
+    print "--splitting <splits>"
+    print "--conditional"
+    print "--antithetic --control"
+    print "-M [--markov]"
+    print "--checkpoint <checkpoint_file> --checkpoint_interval <seconds>"
+    print "--resume <checkpoint_file>"
+    print "-o <event_file> [--output <event_file>] --binary"
+    print "--instrument --instrument_json <json_file>"
+    print "--trajectories <trajectory_file> --trajectory_size <records>"
+    print "--replay <seed>:<round>:<index> OR --replay <binary_event_file>:<iteration>"
+    print "--status <status_file> --status_interval <seconds>"
+    print "--shard <shard_file>"
+    print "--merge <shard_file> ..."
+    print "--cache <cache_dir>"
     print ""
     print "Detail:"
     print "mission_time = simulation end time in hours, default is 87600"
@@ -54,11 +75,107 @@ def usage(arg):
     print ""
     print "required_re = the required relative error, disable by default"
     print ""
+    print "block_size = simulate blocks of iterations in lockstep with NumPy, disable by default"
+    print ""
+    print "seed = the seed of the random streams, a random one by default"
+    print ""
+    print "num_workers = the number of worker processes, 1 by default"
+    print ""
+    print "bias = \"(fail_bias)\" OR \"(fail_bias, repair_bias)\", importance sampling, disable by default"
+    print "                      fail_bias = the disk failure scale is divided by fail_bias"
+    print "                      repair_bias = the disk repair scale is multiplied by repair_bias, 1 by default"
+    print ""
+    print "splits = multilevel splitting, the number of copies when a RAID reaches more failed disks, disable by default"
+    print ""
+    print "--conditional = only simulate the iterations where parity_fragments disks of a RAID fail within the"
+    print "                mission time, and weight them by the probability of this condition"
+    print ""
+    print "--antithetic = run the iterations in pairs, where the second iteration draws the disk failure and repair"
+    print "               times from 1 - U instead of U"
+    print "--control = correct the estimates by a control variate: the number of RAIDs where parity_fragments disks"
+    print "            fail for the first time within the mission time, whose mean is known"
+    print ""
+    print "--markov = only report the Markov model estimate of RAID failures, without simulation"
+    print "           (exact for exponential distributions, otherwise fitted by the means)"
+    print ""
+    print "event_file = write the data loss events to this file, to be injected with injector.py"
+    print "--binary = write the events in the binary format of eventlog.py instead of text"
+    print ""
+    print "checkpoint_file = write the state of the simulation to this file periodically, disable by default"
+    print "seconds = the interval between checkpoints, 600 by default"
+    print "--resume = continue the simulation of a checkpoint, with its parameters; the other options are ignored,"
+    print "           except those of the outputs: the checkpoint, instrument, trajectory, status, shard and cache"
+    print "           options. The checkpoint is kept updated unless --checkpoint says otherwise."
+    print ""
+    print "--instrument = count the events, the queue operations, the sector checks and the variates drawn,"
+    print "               and time the phases of the iterations; the report is printed after the results"
+    print "json_file = also write the report of --instrument to this file as JSON"
+    print ""
+    print "trajectory_file = write the events of the iterations which lose data to this file, disable by default"
+    print "records = the last events kept for an iteration, 4096 by default"
+    print ""
+    print "--replay = run a single iteration again and print its events, instead of simulating:"
+    print "           <seed>:<round>:<index> is the K field of an event of a text event_file, and the other options"
+    print "           must be those of the simulation which wrote it;"
+    print "           <binary_event_file>:<iteration> is an event of a binary event_file, with its parameters,"
+    print "           and the other options are ignored"
+    print ""
+    print "status_file = keep the status of the simulation in this JSON file: the iterations done, the rate, the loss"
+    print "              counts, the current estimates and the time left; it is replaced atomically, disable by default"
+    print "seconds = the interval between the updates of status_file, 10 by default"
+    print ""
+    print "shard_file = write the results to this file at the end, to be merged with those of other runs of the same"
+    print "             configuration, e.g., on other machines; the runs must have different seeds (the default)"
+    print "--merge = merge the results of the shard files of a configuration and print them, instead of simulating"
+    print ""
+    print "cache_dir = keep the results of the configurations in this directory, by the hash of the parameters and"
+    print "            of the content of the trace; a configuration in the cache only runs the iterations needed to"
+    print "            reach num_iterations or required_re, and continues the random streams of the cached results,"
+    print "            with their seed unless -s is given, disable by default"
+    print ""
+    print "Send SIGUSR1 to write a checkpoint and print the current results without stopping."
+    print ""
     print "Samples:"
     print arg, "-i 10000 -r \"mds_5_1\" -a 0.05"
 
     sys.exit(2)
 
+# "(scale)" OR "(shape, scale)" OR "(shape, scale, location)"
+def get_dist_parms(arg):
+    dist = eval(arg)
+    if type(dist) != tuple:
+        dist = (dist,)
+
+    if len(dist) == 1:
+        return (1, dist[0], 0)
+    elif len(dist) == 2:
+        return (dist[0], dist[1], 0)
+    elif len(dist) == 3:
+        return dist
+    return None
+
+# The (fail, repair, lse, scrubbing) parameters of a named set, None if unknown
+def get_presets(parms, capacity_factor):
+    if parms == "Elerath2009":
+        # data from [Elerath2009]
+        return ((1.2, 461386.0, 0),
+                (2.0, 12.0 * capacity_factor, 6.0 * capacity_factor),
+                (1.08/10000),
+                (3, 168 * capacity_factor, 6 * capacity_factor))
+    elif parms == "Elerath2014A":
+        #data from [Elerath2014], SATA Disk A
+        return ((1.13, 302016.0, 0),
+                (1.65, 22.7 * capacity_factor, 0),
+                (1.0/12325),
+                (1, 186 * capacity_factor, 0))
+    elif parms == "Elerath2014B":
+        #data from [Elerath2014], SATA Disk B
+        return ((0.576, 4833522.0, 0),
+                (1.15, 20.25 * capacity_factor, 0),
+                (1.0/42857),
+                (0.97, 160 * capacity_factor, 0))
+    return None
+
 def get_parms():
     logging.basicConfig(level = getattr(logging, "WARNING"))
     # 87600 hours, for 10 years
@@ -94,9 +211,62 @@ def get_parms():
 
     # output all data loss events
     output_events = None
+    binary = False
+
+    # the number of iterations simulated in lockstep
+    batch_size = None
+
+    # the random streams are derived from the seed
+    seed = None
+    # the number of worker processes
+    workers = 1
+
+    # importance sampling, (fail_bias, repair_bias)
+    bias = None
+
+    # multilevel splitting, the number of copies at each level
+    splits = None
+
+    # conditional Monte Carlo on the first failures
+    conditional = False
+
+    # variance reduction by antithetic pairs and by a control variate
+    antithetic = False
+    control = False
+
+    # only solve the Markov model
+    analytic = False
+
+    # periodic checkpoints, and the checkpoint to continue from
+    checkpoint_file = None
+    checkpoint_interval = 600
+    resume = None
+
+    # count and time the hot paths, and the file of the JSON report
+    instrument = False
+    instrument_file = None
+
+    # the trajectories of the iterations which lose data
+    trajectory_file = None
+    trajectory_size = 4096
+
+    # the iteration to run again
+    replay = None
+
+    # the JSON status of the simulation, updated periodically
+    status_file = None
+    status_interval = 10
+
+    # the results of this run, to be merged with other runs,
+    # and the merge of the shards given as arguments
+    shard_file = None
+    merge = False
+
+    # the cache of the results by configuration
+    cache_dir = None
 
     try:
-        (opts, args) = getopt.getopt(sys.argv[1:], "hl:m:i:r:n:c:p:F:R:L:S:a:t:fdwo:", ["help", "log", "mission_time", 
+        (opts, args) = getopt.getopt(sys.argv[1:], "hl:m:i:r:n:c:p:F:R:L:S:a:t:fdwo:b:s:B:M", ["help", "log", "mission_time", 
                                                                              "iterations",
                                                                              "raid", "raid_num", 
                                                                              "capacity", 
@@ -111,6 +281,29 @@ def get_parms():
                                                                              "dedup",
                                                                              "weighted",
                                                                              "output",
+                                                                             "batch=",
+                                                                             "seed=",
+                                                                             "workers=",
+                                                                             "bias=",
+                                                                             "splitting=",
+                                                                             "conditional",
+                                                                             "antithetic",
+                                                                             "control",
+                                                                             "markov",
+                                                                             "binary",
+                                                                             "checkpoint=",
+                                                                             "checkpoint_interval=",
+                                                                             "resume=",
+                                                                             "instrument",
+                                                                             "instrument_json=",
+                                                                             "trajectories=",
+                                                                             "trajectory_size=",
+                                                                             "replay=",
+                                                                             "status=",
+                                                                             "status_interval=",
+                                                                             "shard=",
+                                                                             "merge",
+                                                                             "cache=",
                                                                              ])
     except:
         usage(sys.argv[0])
@@ -125,43 +318,31 @@ def get_parms():
             logger = logging.getLogger("sim")
             logger.setLevel(getattr(logging, a.upper()))
         if o in ("-F", "--disk_fail_dist"):
-            if len(eval(a)) == 1:
-                disk_fail_parms = (1, eval(a), 0)
-
-            elif len(eval(a)) == 2:
-                (shape, scale) = eval(a)
-                disk_fail_parms = (shape, scale, 0)
-
-            elif len(eval(a)) == 3:
-                (shape, scale, location) = eval(a)
-                disk_fail_parms = (shape, scale, location)
-
-            else:
+            disk_fail_parms = get_dist_parms(a)
+            if disk_fail_parms == None:
                 bad_opt = o + " : " + a
                 break
         
         elif o in ("-R", "--disk_repair_dist"):
-            if len(eval(a)) == 1:
-                disk_repair_parms = (1, eval(a), 0)
-
-            elif len(eval(a)) == 2:
-                (shape, scale) = eval(a)
-                disk_repair_parms = (shape, scale, 0)
-
-            elif len(eval(a)) == 3:
-                (shape, scale, location) = eval(a)
-                disk_repair_parms = (shape, scale, location)
+            disk_repair_parms = get_dist_parms(a)
+            if disk_repair_parms == None:
+                bad_opt = o + " : " + a
+                break
 
-            else:
+        elif o in ("-S", "--disk_scrubbing_dist"):
+            disk_scrubbing_parms = get_dist_parms(a)
+            if disk_scrubbing_parms == None:
                 bad_opt = o + " : " + a
                 break
 
         elif o in ("-L", "--disk_lse_dist"):
-            if len(eval(a)) == 1: # the lse rate 
-                disk_lse_parms = eval(a)
-            else:
-                bad_opt = o + " : num args must be 1"
-                break
+            disk_lse_parms = eval(a)
+            if type(disk_lse_parms) == tuple:
+                if len(disk_lse_parms) == 1: # the lse rate 
+                    disk_lse_parms = disk_lse_parms[0]
+                else:
+                    bad_opt = o + " : num args must be 1"
+                    break
 
         elif o in ("-m", "--mission_time"):
             mission_time = float(a) 
@@ -192,6 +373,77 @@ def get_parms():
             weighted = True
         elif o in ("-o", "--output"):
             output_events = a
+        elif o in ("-b", "--batch"):
+            batch_size = int(a)
+        elif o in ("-s", "--seed"):
+            seed = long(a)
+        elif o == "--workers":
+            workers = int(a)
+        elif o in ("-B", "--bias"):
+            bias = eval(a)
+            if type(bias) != tuple:
+                bias = (bias, 1.0)
+            elif len(bias) == 1:
+                bias = (bias[0], 1.0)
+            bias = (float(bias[0]), float(bias[1]))
+        elif o == "--splitting":
+            splits = int(a)
+        elif o == "--conditional":
+            conditional = True
+        elif o == "--antithetic":
+            antithetic = True
+        elif o == "--control":
+            control = True
+        elif o in ("-M", "--markov"):
+            analytic = True
+        elif o == "--binary":
+            binary = True
+        elif o == "--checkpoint":
+            checkpoint_file = a
+        elif o == "--checkpoint_interval":
+            checkpoint_interval = float(a)
+        elif o == "--resume":
+            resume = a
+        elif o == "--instrument":
+            instrument = True
+        elif o == "--instrument_json":
+            instrument = True
+            instrument_file = a
+        elif o == "--trajectories":
+            trajectory_file = a
+        elif o == "--trajectory_size":
+            trajectory_size = int(a)
+        elif o == "--replay":
+            replay = parse_replay(a)
+            if replay == None:
+                usage(sys.argv[0])
+        elif o == "--status":
+            status_file = a
+        elif o == "--status_interval":
+            status_interval = float(a)
+        elif o == "--shard":
+            shard_file = a
+        elif o == "--merge":
+            merge = True
+        elif o == "--cache":
+            cache_dir = a
+
+    if merge:
+        if len(args) == 0:
+            usage(sys.argv[0])
+        print_merged_shards(args)
+        sys.exit(0)
+
+    # the parameters of the simulation are those of the event log
+    if replay != None and replay[0] != None:
+        return get_log_replay_parms(*replay)
+
+    # the parameters of the simulation are those of the checkpoint
+    if resume != None:
+        if checkpoint_file == None:
+            checkpoint_file = resume
+        return load_checkpoint(resume)["parms"] + (checkpoint_file, checkpoint_interval, resume, instrument, instrument_file,
+                trajectory_file, trajectory_size, None, status_file, status_interval, shard_file, cache_dir)
 
     # TO-DO: We should verify these numbers
     # We assume larger disks will have longer repair and scrubbing time
@@ -200,39 +452,134 @@ def get_parms():
     # The following parameters may change with disk capacity
     # For failure, restore, and scrubbing, the parameters are (shape, scale, location)
 
-    if disk_fail_parms != None and disk_repair_parms != None and disk_lse_parms != None and disk_scrubbing_dist != None:
+    if disk_fail_parms != None and disk_repair_parms != None and disk_lse_parms != None and disk_scrubbing_parms != None:
             parms = None
 
-    if parms == "Elerath2009":
-        # data from [Elerath2009]
-        disk_fail_parms = (1.2, 461386.0, 0)
-        disk_repair_parms = (2.0, 12.0 * capacity_factor, 6.0 * capacity_factor)
-        disk_lse_parms = (1.08/10000) 
-        disk_scrubbing_parms = (3, 168 * capacity_factor, 6 * capacity_factor)
-    elif parms == "Elerath2014A":
-        #data from [Elerath2014], SATA Disk A
-        disk_fail_parms = (1.13, 302016.0, 0)
-        disk_repair_parms = (1.65, 22.7 * capacity_factor, 0)
-        disk_lse_parms = (1.0/12325) 
-        disk_scrubbing_parms = (1, 186 * capacity_factor, 0)
-    elif parms == "Elerath2014B":
-        #data from [Elerath2014], SATA Disk B
-        disk_fail_parms = (0.576, 4833522.0, 0)
-        disk_repair_parms = (1.15, 20.25 * capacity_factor, 0)
-        disk_lse_parms = (1.0/42857) 
-        disk_scrubbing_parms = (0.97, 160 * capacity_factor, 0)
-    else:
-        if parms != None:
+    presets = get_presets(parms, capacity_factor)
+    if presets == None and parms != None:
+        usage(sys.argv[0])
+        print "Invaid parms"
+        exit(2)
+
+    # The distributions given by -F/-R/-L/-S take precedence over the parameter set
+    if presets != None:
+        if disk_fail_parms == None:
+            disk_fail_parms = presets[0]
+        if disk_repair_parms == None:
+            disk_repair_parms = presets[1]
+        if disk_lse_parms == None:
+            disk_lse_parms = presets[2]
+        if disk_scrubbing_parms == None:
+            disk_scrubbing_parms = presets[3]
+
+    weighted_methods = [m for m in (bias, splits, conditional) if m not in (None, False)]
+    if len(weighted_methods) > 0 and batch_size != None:
+        print "Importance sampling, splitting and conditioning are not supported by the batch engine"
+        usage(sys.argv[0])
+    if len(weighted_methods) > 1:
+        print "Importance sampling, splitting and conditioning cannot be combined"
+        usage(sys.argv[0])
+    if (antithetic or control) and (len(weighted_methods) > 0 or batch_size != None):
+        print "Antithetic pairs and control variates only support the plain scalar engine"
+        usage(sys.argv[0])
+    if (instrument or trajectory_file != None) and batch_size != None:
+        print "The batch engine is neither instrumented nor traced"
+        usage(sys.argv[0])
+    # The events are not weighted, so they cannot be injected later
+    if len(weighted_methods) > 0 and output_events != None:
+        print "Importance sampling, splitting and conditioning do not support the output of data loss events"
+        usage(sys.argv[0])
+
+    if replay != None:
+        if batch_size != None:
+            print "The iterations of the batch engine cannot be replayed"
             usage(sys.argv[0])
-            print "Invaid parms"
-            exit(2)
+        (path, seed, round, index) = replay
+        return (mission_time, index + 1, raid_type, raid_num, disk_capacity,
+                disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, False, required_re,
+                fs_trace, filelevel, dedup, weighted, None, None, seed, 1, bias, splits, False,
+                False, conditional, antithetic, control, None, checkpoint_interval, None, False, None,
+                None, trajectory_size, (round, index))
 
     return (mission_time, iterations, raid_type, raid_num, disk_capacity, 
             disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, force_re, required_re, 
-            fs_trace, filelevel, dedup, weighted, output_events)
+            fs_trace, filelevel, dedup, weighted, output_events, batch_size, seed, workers, bias, splits, analytic,
+            binary, conditional, antithetic, control, checkpoint_file, checkpoint_interval, resume, instrument, instrument_file,
+            trajectory_file, trajectory_size, None, status_file, status_interval, shard_file, cache_dir)
+
+# "<seed>:<round>:<index>" OR "<binary_event_file>:<iteration>",
+# return (path, seed, round, index), where path is None for the first
+# form and the others are None for the second, or None if invalid
+def parse_replay(arg):
+    fields = arg.split(":")
+    if len(fields) == 3 and all([field.isdigit() for field in fields]):
+        return (None, long(fields[0]), long(fields[1]), long(fields[2]))
+
+    (path, iteration) = arg.rsplit(":", 1)
+    if not iteration.isdigit() or not os.path.exists(path) or not is_binary(path):
+        print "Not an event of a binary event log:", arg
+        return None
+    return (path, long(iteration), None, None)
+
+# The parameters of the simulation which wrote a binary event log,
+# to replay the event of an iteration
+def get_log_replay_parms(path, iteration, round, index):
+    (config, iterations, events) = read_binary_events(path)
+    if "round" not in events.dtype.names:
+        print "The events of %s do not name their random streams, it was written by an older version" % path
+        sys.exit(2)
+    if config["batch_size"] != None:
+        print "The iterations of the batch engine cannot be replayed"
+        sys.exit(2)
+
+    found = events[events["iteration"] == iteration]
+    if len(found) == 0:
+        print "No event of iteration %d in %s" % (iteration, path)
+        sys.exit(2)
+    (round, index) = (long(found[0]["round"]), long(found[0]["round_iteration"]))
+
+    return (config["mission_time"], index + 1, config["raid_type"], config["raid_num"], config["disk_capacity"],
+            config["disk_fail_parms"], config["disk_repair_parms"], config["disk_lse_parms"], config["disk_scrubbing_parms"],
+            False, 0.05, config["trace"], config["filelevel"], config["dedup"], config["weighted"], None, None,
+            config["seed"], 1, None, None, False, False, False, config["antithetic"], False, None, 600, None, False, None,
+            None, 4096, (round, index))
+
+# Merge the shards of the files and print their results, see shard.py
+def print_merged_shards(paths):
+    try:
+        shard = merge_shards(paths)
+    except Exception as e:
+        print "Cannot merge the shards:", e
+        sys.exit(2)
+
+    config = shard["config"]
+    model = DeduplicationModel(config["trace"], config["filelevel"], config["dedup"], config["weighted"])
+    model.df = shard["df"]
+    markov = MarkovModel(config["mission_time"], config["raid_type"], config["raid_num"], config["disk_fail_parms"],
+            config["disk_repair_parms"])
+
+    shard["raid_failure_samples"].calcResults("0.95")
+    shard["lse_samples"].calcResults("0.95")
+
+    print "Merged %d shards, seeds %s" % (len(paths), ", ".join([str(seed) for seed in shard["seeds"]]))
+    print_result(model, shard["raid_failure_samples"], shard["lse_samples"], shard["systems_with_data_loss"],
+            shard["systems_with_raid_failures"], shard["systems_with_lse"], shard["iterations"], config["raid_type"],
+            config["raid_num"], config["disk_capacity"], shard["df"], markov)
+
+def print_replay(simulation, replay):
+    (round, index) = simulation.replay_position
+    (result, trajectory) = replay
+
+    print "**************************************"
+    print "Replay of iteration %d of round %d, seed %d" % (index, round, simulation.seed)
+    if trajectory is None:
+        print "iteration %d: no data loss" % index
+    else:
+        sys.stdout.write(format_trajectory(index, result, trajectory))
+    print "**************************************"
 
 def print_result(model, raid_failure_samples, lse_samples, systems_with_data_loss, 
-        systems_with_raid_failures, systems_with_lse, iterations, raid_type, raid_num, disk_capacity, df):
+        systems_with_raid_failures, systems_with_lse, iterations, raid_type, raid_num, disk_capacity, df, markov=None):
 
     (type, d, p) = raid_type.split("_");
     data_fragments = int(d)
@@ -245,13 +592,19 @@ def print_result(model, raid_failure_samples, lse_samples, systems_with_data_los
     print "Filelevel =", model.filelevel, ", Dedup =", model.dedup, ", Weighted =", model.weighted
     print "Summary: %d of systems with data loss events (%d by raid failures, %d by lse)" % (systems_with_data_loss, systems_with_raid_failures, systems_with_lse)
 
-    prob_result = (raid_failure_samples.prob_mean, 100*raid_failure_samples.prob_re, raid_failure_samples.prob_mean - raid_failure_samples.prob_ci, 
-            raid_failure_samples.prob_mean + raid_failure_samples.prob_ci, raid_failure_samples.prob_dev)
+    prob_result = (raid_failure_samples.prob_mean, 100*raid_failure_samples.prob_re, raid_failure_samples.prob_ci_low, 
+            raid_failure_samples.prob_ci_high, raid_failure_samples.prob_dev)
     value_result = (raid_failure_samples.value_mean, 100*raid_failure_samples.value_re, raid_failure_samples.value_mean - raid_failure_samples.value_ci, 
             raid_failure_samples.value_mean + raid_failure_samples.value_ci, raid_failure_samples.value_dev)
 
     print "******** RAID Failure Part ***********"
     print "Probability of RAID Failures: %e +/- %f Percent , CI (%e,%e), StdDev: %e" % prob_result
+    if raid_failure_samples.weighted:
+        print "Effective Sample Size: %e, Effective Data Loss Events: %f" % (raid_failure_samples.prob_ess, raid_failure_samples.prob_eff_events)
+    if raid_failure_samples.value_vrf is not None:
+        print "Variance Reduction Factor: %f (probability), %f (fraction lost)" % (raid_failure_samples.prob_vrf, raid_failure_samples.value_vrf)
+    if markov is not None:
+        print_markov_estimate(markov)
     if model.filelevel == False:
         print "Fraction of Blocks/Chunks Lost in the Failed Disk: %e +/- %f Percent, CI (%e,%e), StdDev: %e" % value_result
     elif model.weighted == False:
@@ -259,13 +612,17 @@ def print_result(model, raid_failure_samples, lse_samples, systems_with_data_los
     else:
         print "Fraction of Files Lost Weighted by Bytes: %e +/- %f Percent, CI (%e,%e), StdDev: %e" % value_result
 
-    prob_result = (lse_samples.prob_mean, 100*lse_samples.prob_re, lse_samples.prob_mean - lse_samples.prob_ci, 
-            lse_samples.prob_mean + lse_samples.prob_ci, lse_samples.prob_dev)
+    prob_result = (lse_samples.prob_mean, 100*lse_samples.prob_re, lse_samples.prob_ci_low, 
+            lse_samples.prob_ci_high, lse_samples.prob_dev)
     value_result = (lse_samples.value_mean, 100*lse_samples.value_re, lse_samples.value_mean - lse_samples.value_ci, 
             lse_samples.value_mean + lse_samples.value_ci, lse_samples.value_dev)
 
     print "************* LSE Part ***************"
     print "Probability of LSEs: %e +/- %f Percent , CI (%e,%e), StdDev: %e" % prob_result
+    if lse_samples.weighted:
+        print "Effective Sample Size: %e, Effective Data Loss Events: %f" % (lse_samples.prob_ess, lse_samples.prob_eff_events)
+    if lse_samples.value_vrf is not None:
+        print "Variance Reduction Factor: %f (probability), %f (lost)" % (lse_samples.prob_vrf, lse_samples.value_vrf)
 
     NOMDL = value_result[0]/total_capacity
     if model.filelevel == False:
@@ -284,10 +641,34 @@ def print_result(model, raid_failure_samples, lse_samples, systems_with_data_los
             print "NOMDL (Normalized Magnitude of Data Loss): %e bytes per TB" % NOMDL
     print "**************************************"
 
+def print_markov_estimate(markov):
+    if markov.exact:
+        kind = "exact"
+    else:
+        kind = "fitted exponential"
+    print "Markov Model (%s) Probability of RAID Failures: %e" % (kind, markov.system_failure_probability())
+
+def print_markov_result(markov, raid_type, raid_num):
+    localtime = time.asctime(time.localtime(time.time()))
+    print "**************************************"
+    print "System (%s): %d of %s RAID, mission time %.0f hours" % (localtime, raid_num, raid_type, markov.mission_time)
+    print "Disk failure rate: %e, Disk repair rate: %e" % (markov.fail_rate, markov.repair_rate)
+    print_markov_estimate(markov)
+    print "**************************************"
+
 def do_it():
 
     parms = get_parms()
     simulation = Simulation(*parms)
+    simulation.reporter = print_current_result
+
+    if simulation.analytic:
+        print_markov_result(simulation.markov_model(), simulation.raid_type, simulation.raid_num)
+        return
+
+    if simulation.replay_position is not None:
+        print_replay(simulation, simulation.replay(*simulation.replay_position))
+        return
 
     (model, raid_failure_samples, lse_samples, systems_with_data_loss, 
             systems_with_raid_failures, systems_with_lse, iterations, df) = simulation.simulate()
@@ -297,34 +678,58 @@ def do_it():
     disk_capacity = parms[4]
 
     print_result(model, raid_failure_samples, lse_samples, systems_with_data_loss, 
-            systems_with_raid_failures, systems_with_lse, iterations, raid_type, raid_num, disk_capacity, df)
+            systems_with_raid_failures, systems_with_lse, iterations, raid_type, raid_num, disk_capacity, df, simulation.markov_model())
 
-def sig_quit(sig, frame):
+    if simulation.instrumentation is not None:
+        simulation.instrumentation.report()
 
-    # backtrace to get the simulation object
-    object = frame.f_locals.get("self", None)
-    while not isinstance(object, Simulation):
-        frame = frame.f_back
+# backtrace to get the simulation object, None if there is no simulation yet
+def find_simulation(frame):
+    while frame is not None:
         object = frame.f_locals.get("self", None)
+        if isinstance(object, Simulation):
+            return object
+        frame = frame.f_back
+    return None
 
-    print >>sys.stderr, "\nThe simulation is interrupted!"
-
+# print the results of the iterations done so far
+def print_current_result(object):
     object.raid_failure_samples.calcResults("0.95")
     object.lse_samples.calcResults("0.95")
 
-    iterations = object.iterations - object.more_iterations + object.cur_i
+    iterations = object.done_i + object.cur_i
     print_result(object.system.dedup_model, object.raid_failure_samples, object.lse_samples, object.systems_with_data_loss, 
             object.systems_with_raid_failures, object.systems_with_lse, 
-            iterations, object.raid_type, object.raid_num, object.disk_capacity, object.system.get_df())
+            iterations, object.raid_type, object.raid_num, object.disk_capacity, object.system.get_df(), object.markov_model())
+    sys.stdout.flush()
+
+# The results are printed by the simulation between iterations
+def sig_report(sig, frame):
+    object = find_simulation(frame)
+    if object is not None:
+        object.report_requested = True
+
+def sig_quit(sig, frame):
+
+    object = find_simulation(frame)
+    if object is None:
+        sys.exit(1)
+
+    print >>sys.stderr, "\nThe simulation is interrupted!"
+
+    print_current_result(object)
+    iterations = object.done_i + object.cur_i
     if object.output is not None:
-        print >>object.output, "I=%d" % iterations
-        object.output.close()
+        object.output.close(iterations)
+    if object.trajectory_log is not None:
+        object.trajectory_log.close()
 
     sys.exit(1)
 
 if __name__ == "__main__":
     simulation = None
     signal.signal(signal.SIGINT, sig_quit)
+    signal.signal(signal.SIGUSR1, sig_report)
     do_it()
 
 
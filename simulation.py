@@ -1,10 +1,47 @@
+import os
 import sys
 import logging
 import datetime
 import time
+import random
+import signal
+import multiprocessing
 
 from system import *
+from batch import *
+from splitting import *
+from conditional import *
+from markov import *
 from statistics import *
+from checkpoint import *
+from eventlog import *
+from instrument import *
+from tracing import *
+from status import *
+from shard import *
+from cache import *
+
+# The number of iterations of a task of the worker processes.
+# It is fixed, so the results of a seed do not depend on the number of workers.
+TASK_ITERATIONS = 65536
+
+# Each block of STREAM_BLOCK iterations of a round runs with its own random
+# stream, so an iteration is replayed by running its block up to it, see
+# replay(). The tasks of the workers start at the start of a block, so the
+# results of a seed are the same with and without workers.
+# tick() is called between the blocks.
+STREAM_BLOCK = 256
+
+# With -a, an estimator without any data loss event has no relative error.
+# The iterations are doubled for it until EMPTY_ROUNDS rounds are done,
+# then it is left out of the stopping rule, see relative_error().
+EMPTY_ROUNDS = 4
+
+# The records kept for the trajectory of a replayed iteration
+REPLAY_TRAJECTORY_SIZE = 1 << 20
+
+# The pools of variates are drawn again for each iteration of an antithetic pair
+ANTITHETIC_POOL_BLOCK = 64
 
 class Simulation:
 
@@ -12,9 +49,13 @@ class Simulation:
 
     def __init__(self, mission_time, iterations, raid_type, raid_num, disk_capacity, 
             disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, force_re, required_re, 
-            fs_trace, filelevel, dedup, weighted, output_file):
+            fs_trace, filelevel, dedup, weighted, output_file, batch_size=None, seed=None, workers=1, bias=None, splits=None, analytic=False,
+            binary=False, conditional=False, antithetic=False, control=False, checkpoint_file=None, checkpoint_interval=600, resume=None,
+            instrument=False, instrument_file=None, trajectory_file=None, trajectory_size=4096, replay=None,
+            status_file=None, status_interval=10, shard_file=None, cache_dir=None):
         self.mission_time = mission_time
         self.iterations = iterations
+        self.initial_iterations = iterations
         self.raid_type = raid_type
         self.raid_num = raid_num
         self.disk_capacity = disk_capacity
@@ -30,6 +71,7 @@ class Simulation:
         # The required relative error
         self.force_re = force_re
         self.required_re = required_re
+        self.conf_level = "0.95"
 
         self.raid_failure_samples = Samples()
         self.lse_samples = Samples()
@@ -40,6 +82,8 @@ class Simulation:
 
         self.cur_i = 0L
         self.more_iterations = 0L
+        # the iterations of the previous rounds
+        self.done_i = 0L
 
         self.fs_trace = fs_trace
         self.filelevel = filelevel 
@@ -48,9 +92,122 @@ class Simulation:
         
         self.start_time = datetime.datetime.now()
 
+        # simulate blocks of iterations in lockstep if not None
+        self.batch_size = batch_size
+
+        # Each block of iterations uses its own random stream, derived from
+        # the seed, the round and the block, see STREAM_BLOCK. The batch
+        # engine has a stream for each round and task instead. Without a
+        # seed, the random module is left as it is.
+        self.seed = seed
+        self.round = 0
+        # the index in the round of the first iteration run by
+        # run_local_iterations(), which is not 0 in the tasks of the workers
+        self.stream_offset = 0L
+
+        # importance sampling if not None, see System
+        self.bias = bias
+
+        # multilevel splitting if not None, see SplittingSystem
+        self.splits = splits
+
+        # only solve the Markov model, see MarkovModel
+        self.analytic = analytic
+
+        # only simulate the iterations which may lose data, see ConditionalSystem
+        self.conditional = conditional
+
+        # variance reduction by antithetic pairs of iterations, and by the
+        # number of critical RAIDs as a control variate, see Samples
+        self.antithetic = antithetic
+        self.control = control
+
+        # the results of the previous runs of the configuration, which
+        # are continued, and their seed, see cache.py. A checkpoint holds
+        # the cached results it continued, and its seed.
+        self.cache_dir = cache_dir
+        self.cache_path = None
+        self.cached = None
+        if cache_dir is not None:
+            self.cache_path = cache_path(cache_dir, self.get_cache_config())
+            if resume is None:
+                self.cached = load_cache(self.cache_path)
+            if self.cached is not None and self.seed is None:
+                self.seed = self.cached["seed"]
+
+        # split the iterations across worker processes if > 1
+        self.workers = workers
+        # the events of the log name their random streams, see eventlog.py,
+        # the shards must have different seeds, see shard.py, and the
+        # cached results are continued with the same seed
+        if (self.workers > 1 or output_file is not None or shard_file is not None or cache_dir is not None) and self.seed is None:
+            self.seed = random.SystemRandom().getrandbits(64)
+        self.pool = None
+        # the iterations done by the workers, for the progress bar
+        self.progress = None
+        # set in a worker process to report its progress to the parent
+        self.progress_report = None
+        self.reported_i = 0L
+        # no progress bar if quiet
+        self.quiet = False
+
+        # write a checkpoint every checkpoint_interval seconds,
+        # resume is the checkpoint to continue from
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_time = time.time()
+        self.resume = resume
+
+        # the log of data loss events, see eventlog.py
+        self.output_file = output_file
+        self.binary = binary
         self.output = None
         if output_file is not None:
-            self.output = open(output_file, "a")
+            if binary:
+                self.output = BinaryEventLog(output_file, self.get_config(), resume is not None)
+            else:
+                self.output = TextEventLog(output_file, self.seed)
+
+        # count and time the hot paths if instrument, see Instrumentation,
+        # and dump the counters as JSON to instrument_file if not None.
+        # The counters start again on resume.
+        self.instrument = instrument
+        self.instrument_file = instrument_file
+        self.instrumentation = None
+        if instrument:
+            self.instrumentation = Instrumentation()
+            if self.output is not None:
+                self.output = TimedEventLog(self.output, self.instrumentation)
+
+        # write the trajectories of the iterations which lose data to
+        # trajectory_file, keeping the last trajectory_size records of
+        # each iteration, see tracing.py. The log is opened by simulate().
+        self.trajectory_file = trajectory_file
+        self.trajectory_size = trajectory_size
+        self.trajectory_log = None
+        self.tracing = trajectory_file is not None
+
+        # (round, index) of the iteration to run again instead of
+        # simulating, see replay()
+        self.replay_position = replay
+
+        # write the status of the simulation to status_file every
+        # status_interval seconds, see status.py
+        self.status_file = status_file
+        self.status_interval = status_interval
+        self.status_time = time.time()
+        # the time and the iterations done when the simulation started
+        self.status_start = (time.time(), 0L)
+        # the first iteration of the round of the workers, see get_done()
+        self.round_start = 0L
+
+        # write the results to shard_file at the end, see shard.py
+        self.shard_file = shard_file
+
+        # set by a signal handler to report the results as they are
+        self.report_requested = False
+        # called with the simulation to report the results
+        self.reporter = None
 
     def get_runtime(self):
         delta = datetime.datetime.now() - self.start_time
@@ -60,80 +217,734 @@ class Simulation:
         h = delta.seconds/60/60
         return (d, h, m, s)
 
-    def run_iterations(self, iterations):
-        for self.cur_i in xrange(iterations):
-
-            if (self.cur_i & 16383) == 0:
-                progress = 1.0*self.cur_i/self.iterations
-                num = int(progress * 100)
-                print >> sys.stderr,  "%6.2f%%: [" % (progress*100), "\b= "*num, "\b\b>", " "*(100-num), "\b\b]", "%3dd%2dh%2dm%2ds \r"% self.get_runtime(),
+    def print_progress(self, done):
+        if self.quiet:
+            return
+        if self.progress_report is not None:
+            # in a worker process, report to the parent instead
+            with self.progress_report.get_lock():
+                self.progress_report.value += done - self.reported_i
+            self.reported_i = done
+            return
+
+        progress = 1.0*(self.done_i + done)/self.iterations
+        num = int(progress * 100)
+        print >> sys.stderr,  "%6.2f%%: [" % (progress*100), "\b= "*num, "\b\b>", " "*(100-num), "\b\b]", "%3dd%2dh%2dm%2ds \r"% self.get_runtime(),
+
+    def print_done(self, iterations):
+        if self.quiet:
+            return
+        if self.progress_report is not None:
+            self.print_progress(iterations)
+            return
 
-            self.system.reset()
-        
-            result = self.system.run()
+        print >> sys.stderr,  "%6.2f%%: [" % (100.0), "\b= "*100, "\b\b>", "\b]", "%3dd%2dh%2dm%2ds"% self.get_runtime() 
 
-            if result[0] != 0 or result[1] != 0:
-                self.systems_with_data_loss += 1
+    # Count the data loss events of the ith iteration of the round, and log them
+    def count_result(self, result, i):
+        if result[0] != 0 or result[1] != 0:
+            self.systems_with_data_loss += 1
 
-                if result[0] != 0:
-                    self.logger.debug("%dth iteration: %s, %d bytes lost" % (self.cur_i, "RAID Failure", result[0]))
-                    self.systems_with_raid_failures += 1
-                    #print "%f" % result[0]
+            if result[0] != 0:
+                self.systems_with_raid_failures += 1
 
-                    if self.output:
-                        print >>self.output, "R=%.6f" % result[0],
+            if result[1] != 0:
+                self.systems_with_lse += 1
 
-                if result[1] != 0:
-                    self.logger.debug("%dth iterations: %s, %d bytes lost" % (self.cur_i, "Sectors Lost", result[1]))
-                    self.systems_with_lse += 1
-                    if self.output:
-                        print >>self.output, "S=%d" % result[1],
+            if self.output is not None:
+                self.output.add(self.done_i + i, result[0], result[1], self.round, i)
+            if self.trajectory_log is not None:
+                self.trajectory_log.write(self.done_i + i, result, self.system.pop_trajectory())
 
-                if self.output is not None:
-                    print >>self.output, ""
+    # The weight is the likelihood ratio of the iteration for importance sampling,
+    # and control is the control variate of the iteration
+    def record_result(self, result, weight=None, control=None):
+        self.count_result(result, self.cur_i)
 
+        if control is not None:
+            self.raid_failure_samples.addControlledSample(result[0], control)
+            self.lse_samples.addControlledSample(result[1], control)
+        elif weight is None:
             self.raid_failure_samples.addSample(result[0])
             self.lse_samples.addSample(result[1])
+        else:
+            self.raid_failure_samples.addWeightedSample(result[0], weight)
+            self.lse_samples.addWeightedSample(result[1], weight)
+
+    def use_stream(self, *key):
+        words = seed_stream(*key)
+        if self.batch_size is not None:
+            self.system.seed(words)
+
+    # Called at the start of each block of iterations, see STREAM_BLOCK
+    def use_block_stream(self):
+        self.use_stream(self.seed, self.round, (self.stream_offset + self.cur_i) / STREAM_BLOCK)
+
+    # The iterations of an antithetic pair and their control variates,
+    # see run_antithetic_iterations()
+    def record_pair(self, results, controls):
+        for (k, result) in enumerate(results):
+            self.count_result(result, self.cur_i + k)
+
+        control = None
+        if self.control:
+            control = float(sum(controls)) / len(controls)
+        self.raid_failure_samples.addAntitheticSamples([result[0] for result in results], control)
+        self.lse_samples.addAntitheticSamples([result[1] for result in results], control)
+
+    def set_control(self, samples):
+        if self.control:
+            samples.setControl(self.system.get_critical_raids_mean())
+
+    # The trajectories of a split iteration, see SplittingSystem
+    def record_trajectories(self, trajectories):
+        raid_failure = [(result[0], weight) for (result, weight) in trajectories]
+        lse = [(result[1], weight) for (result, weight) in trajectories]
+
+        if any([r[0] != 0 or r[1] != 0 for (r, w) in trajectories]):
+            self.systems_with_data_loss += 1
+            if self.trajectory_log is not None:
+                result = (sum([r * w for (r, w) in raid_failure]), sum([r * w for (r, w) in lse]))
+                self.trajectory_log.write(self.done_i + self.cur_i, result, self.system.pop_trajectory())
+        if any([r[0] != 0 for (r, w) in trajectories]):
+            self.systems_with_raid_failures += 1
+        if any([r[1] != 0 for (r, w) in trajectories]):
+            self.systems_with_lse += 1
+
+        self.raid_failure_samples.addSplitSamples(raid_failure)
+        self.lse_samples.addSplitSamples(lse)
+
+    # The largest relative error of the RAID failure and LSE estimators,
+    # both of the probability and of the amount of data lost. It is
+    # infinite for an estimator without any data loss event, for the
+    # first EMPTY_ROUNDS rounds.
+    def relative_error(self):
+        re = 0.0
+        for samples in (self.raid_failure_samples, self.lse_samples):
+            if samples.hasEvents():
+                re = max(re, samples.value_re, samples.prob_re)
+            elif self.round < EMPTY_ROUNDS:
+                re = float("inf")
+        return re
+
+    # The estimators left out of the stopping rule, see relative_error()
+    def warn_no_events(self):
+        for (name, samples) in (("RAID failure", self.raid_failure_samples), ("LSE", self.lse_samples)):
+            if not samples.hasEvents():
+                print >> sys.stderr, "No %s in %d iterations, its relative error is not required." % (name, self.done_i)
+
+    # True if the required relative error is met
+    def converged(self):
+        self.raid_failure_samples.calcResults(self.conf_level)
+        self.lse_samples.calcResults(self.conf_level)
+        return self.relative_error() <= self.required_re
+
+    # The relative error shrinks with the square root of the number of
+    # iterations, so n * (re/required_re)^2 iterations are needed in total.
+    # Without any data loss event, the number of iterations is doubled.
+    def plan_iterations(self, re):
+        n = self.done_i
+        if re == float("inf"):
+            more = n
+        else:
+            more = long(n * (re/self.required_re)**2) - n
+        return max(more, 10000L)
+
+    #
+    # The state needed to continue the simulation, see checkpoint.py.
+    # It is only taken between iterations, see tick().
+    #
+    def get_state(self):
+        state = {"parms": self.get_parms(),
+                "iterations": self.iterations,
+                "more_iterations": self.more_iterations,
+                "done_i": self.done_i,
+                "cur_i": self.cur_i,
+                "round": self.round,
+                "raid_failure_samples": self.raid_failure_samples,
+                "lse_samples": self.lse_samples,
+                "systems_with_data_loss": self.systems_with_data_loss,
+                "systems_with_raid_failures": self.systems_with_raid_failures,
+                "systems_with_lse": self.systems_with_lse,
+                "random_state": random.getstate(),
+                "pool_state": get_pool_state(),
+                "rng_state": None,
+                "output_size": None,
+                "trajectory_size": None}
+
+        if self.batch_size is not None and self.workers <= 1:
+            state["rng_state"] = self.system.get_rng_state()
+
+        # the events written after the checkpoint are dropped on resume
+        if self.output is not None:
+            state["output_size"] = self.output.size()
+        if self.trajectory_log is not None:
+            state["trajectory_size"] = self.trajectory_log.size()
+
+        return state
+
+    def set_state(self, state):
+        self.iterations = state["iterations"]
+        self.more_iterations = state["more_iterations"]
+        self.done_i = state["done_i"]
+        self.cur_i = state["cur_i"]
+        self.round = state["round"]
+        self.raid_failure_samples = state["raid_failure_samples"]
+        self.lse_samples = state["lse_samples"]
+        self.systems_with_data_loss = state["systems_with_data_loss"]
+        self.systems_with_raid_failures = state["systems_with_raid_failures"]
+        self.systems_with_lse = state["systems_with_lse"]
+
+        random.setstate(state["random_state"])
+        set_pool_state(state["pool_state"])
+        if state["rng_state"] is not None:
+            self.system.set_rng_state(state["rng_state"])
 
-        print >> sys.stderr,  "%6.2f%%: [" % (100.0), "\b= "*100, "\b\b>", "\b]", "%3dd%2dh%2dm%2ds"% self.get_runtime() 
+        if self.output is not None:
+            self.output.truncate(state["output_size"])
+        # the log is kept as it is if the checkpointed run had no trajectories
+        if self.trajectory_log is not None and state["trajectory_size"] is not None:
+            self.trajectory_log.truncate(state["trajectory_size"])
+
+    def write_checkpoint(self):
+        save_checkpoint(self.checkpoint_file, self.get_state())
+        self.checkpoint_time = time.time()
+
+    # The iterations done so far, including those of the running tasks of the workers
+    def get_done(self):
+        if self.pool is not None:
+            return self.done_i + self.round_start + self.progress.value
+        return self.done_i + self.cur_i
+
+    # The status of the simulation, see status.py
+    def get_status(self, state="running"):
+        now = time.time()
+        done = self.get_done()
+        raid_failure = estimator_status(self.raid_failure_samples, self.conf_level)
+        lse = estimator_status(self.lse_samples, self.conf_level)
+
+        re = None
+        if raid_failure is not None and lse is not None:
+            re = finite(self.relative_error())
+
+        (start_time, start_done) = self.status_start
+        rate = None
+        if now > start_time and done > start_done:
+            rate = (done - start_done) / (now - start_time)
+
+        # the iterations needed, see plan_iterations()
+        target = self.iterations
+        if self.force_re:
+            target = None
+            if re is not None:
+                target = long(self.raid_failure_samples.num_samples * (re / self.required_re)**2)
+        eta = None
+        if state == "done":
+            eta = 0.0
+        elif rate is not None and target is not None:
+            eta = max(target - done, 0) / rate
+
+        required_re = None
+        if self.force_re:
+            required_re = self.required_re
+
+        return {"state": state,
+                "time": now,
+                "elapsed": now - start_time,
+                "round": self.round,
+                "iterations": done,
+                "planned": self.iterations,
+                "iterations_per_second": rate,
+                "eta": eta,
+                "systems_with_data_loss": self.systems_with_data_loss,
+                "systems_with_raid_failures": self.systems_with_raid_failures,
+                "systems_with_lse": self.systems_with_lse,
+                "raid_failure": raid_failure,
+                "lse": lse,
+                "relative_error": re,
+                "required_re": required_re}
+
+    def write_status(self, state="running"):
+        save_status(self.status_file, self.get_status(state))
+        self.status_time = time.time()
+
+    # Called between iterations: write a checkpoint or the status if it is
+    # time to, and report the results if requested
+    def tick(self):
+        if self.report_requested:
+            self.report_requested = False
+            if self.checkpoint_file is not None:
+                self.write_checkpoint()
+            if self.reporter is not None:
+                self.reporter(self)
+        elif self.checkpoint_file is not None and time.time() - self.checkpoint_time >= self.checkpoint_interval:
+            self.write_checkpoint()
+
+        if self.status_file is not None and time.time() - self.status_time >= self.status_interval:
+            self.write_status()
+
+    # Return the number of iterations done, which is less than the
+    # number requested if the required relative error is met earlier.
+    # A round resumed from a checkpoint starts at iteration start.
+    def run_iterations(self, iterations, start=0L):
+        if self.workers > 1:
+            done = self.run_parallel_iterations(iterations, start)
+        else:
+            if self.batch_size is not None and self.seed is not None and start == 0:
+                self.use_stream(self.seed, self.round, 0)
+            done = self.run_local_iterations(iterations, start)
+
+        self.round += 1
+        return done
+
+    # With force_re, the relative error is checked as the iterations go
+    def run_local_iterations(self, iterations, start=0L):
+        if self.batch_size is not None:
+            return self.run_batch_iterations(iterations, start)
+        if self.antithetic:
+            return self.run_antithetic_iterations(iterations, start)
+
+        for self.cur_i in xrange(start, iterations):
 
-    def simulate(self):
+            if (self.cur_i & 16383) == 0:
+                if self.force_re and self.cur_i > 0 and self.converged():
+                    self.print_done(self.cur_i)
+                    return self.cur_i
+                self.print_progress(self.cur_i)
+            # stream_offset is a multiple of STREAM_BLOCK
+            if (self.cur_i & (STREAM_BLOCK - 1)) == 0:
+                self.tick()
+                if self.seed is not None:
+                    self.use_block_stream()
+                # the phases are timed on an iteration of each block
+                if self.instrumentation is not None:
+                    self.system.time_iteration(STREAM_BLOCK / 2)
 
-        self.system = System(self.mission_time, self.raid_type, self.raid_num, self.disk_capacity, self.disk_fail_parms,
-            self.disk_repair_parms, self.disk_lse_parms, self.disk_scrubbing_parms, self.fs_trace, self.filelevel, self.dedup, self.weighted)
+            self.system.reset()
+        
+            result = self.system.run()
 
-        self.more_iterations = self.iterations
-        while True:
+            if self.splits is not None:
+                self.record_trajectories(result)
+            elif self.control:
+                self.record_result(result, None, self.system.critical_raids)
+            else:
+                self.record_result(result, self.system.get_weight())
 
-            self.run_iterations(self.more_iterations)
+        self.print_done(iterations)
+        return iterations
 
-            self.raid_failure_samples.calcResults("0.95")
-            self.lse_samples.calcResults("0.95")
+    # The iterations in antithetic pairs, see stochastic.begin_antithetic().
+    # A pair starts at an even iteration, and the last one may be single.
+    # STREAM_BLOCK is even, so a pair does not span two blocks.
+    def run_antithetic_iterations(self, iterations, start=0L):
+        for self.cur_i in xrange(start, iterations, 2):
 
-            if self.force_re == False:
+            if (self.cur_i & 16383) == 0:
+                if self.force_re and self.cur_i > 0 and self.converged():
+                    self.print_done(self.cur_i)
+                    return self.cur_i
+                self.print_progress(self.cur_i)
+            # stream_offset is a multiple of STREAM_BLOCK
+            if (self.cur_i & (STREAM_BLOCK - 1)) == 0:
+                self.tick()
+                if self.seed is not None:
+                    self.use_block_stream()
+                # the phases are timed on an iteration of each block
+                if self.instrumentation is not None:
+                    self.system.time_iteration(STREAM_BLOCK / 2)
+
+            results = []
+            controls = []
+            for second in (False, True)[:iterations - self.cur_i]:
+                begin_antithetic(second)
+                self.system.reset()
+                results.append(self.system.run())
+                controls.append(self.system.critical_raids)
+
+            self.record_pair(results, controls)
+
+        self.print_done(iterations)
+        return iterations
+
+    # The BatchSystem only reports iterations with data loss events,
+    # so the remaining ones are added to the samples as zeros.
+    def run_batch_iterations(self, iterations, start=0L):
+        done = start
+        while done < iterations:
+            self.cur_i = done
+            self.print_progress(done)
+            self.tick()
+
+            n = min(self.batch_size, iterations - done)
+            losses = self.system.run(n)
+            for (i, result) in losses:
+                self.cur_i = done + i
+                self.record_result(result)
+
+            self.raid_failure_samples.addZeros(n - len(losses))
+            self.lse_samples.addZeros(n - len(losses))
+            done += n
+
+            if self.force_re and done < iterations and self.converged():
                 break
 
-            if self.raid_failure_samples.value_re > self.lse_samples.value_re and self.raid_failure_samples.value_re > self.required_re:
-                self.more_iterations = long((self.raid_failure_samples.value_re/self.required_re - 1) * self.iterations)
-                print >> sys.stderr, "Since RAID FAILURE Relative Error %5f > %5f," % (self.raid_failure_samples.value_re, self.required_re),
-            elif self.lse_samples.value_re > self.required_re:
-                self.more_iterations = long((self.lse_samples.value_re/self.required_re - 1) * self.iterations)
-                print >> sys.stderr, "Since LSE Relative Error %5f > %5f," % (self.lse_samples.value_re, self.required_re),
-            else:
-                break
+        self.cur_i = done
+        self.print_done(done)
+        return done
+
+    # The iterations are split into tasks of TASK_ITERATIONS, whose blocks
+    # run with their own random streams, see STREAM_BLOCK. The results are
+    # merged in the order of the tasks, so a given seed always leads to the
+    # same results.
+    # The relative error is only checked between rounds, and checkpoints
+    # are taken between tasks.
+    def run_parallel_iterations(self, iterations, start=0L):
+        self.progress.value = 0
+        self.cur_i = start
+        self.round_start = start
+
+        tasks = []
+        for t in xrange(start / TASK_ITERATIONS, (iterations + TASK_ITERATIONS - 1) / TASK_ITERATIONS):
+            n = min(TASK_ITERATIONS, iterations - t * TASK_ITERATIONS)
+            tasks.append((n, self.pool.apply_async(run_task, (n, (self.seed, self.round, t), self.output is not None))))
+
+        for (n, task) in tasks:
+            while not task.ready():
+                self.print_progress(start + self.progress.value)
+                self.tick()
+                task.wait(1)
+
+            (raid_failure_samples, lse_samples, systems_with_data_loss, systems_with_raid_failures,
+                    systems_with_lse, events, instrumentation, trajectories) = task.get()
+
+            self.raid_failure_samples.merge(raid_failure_samples)
+            self.lse_samples.merge(lse_samples)
+            self.systems_with_data_loss += systems_with_data_loss
+            self.systems_with_raid_failures += systems_with_raid_failures
+            self.systems_with_lse += systems_with_lse
+            if instrumentation is not None:
+                self.instrumentation.merge(instrumentation)
+            if self.output is not None:
+                for (i, corrupted_area, lse_count, round, round_iteration) in events:
+                    self.output.add(self.done_i + self.cur_i + i, corrupted_area, lse_count, self.round, self.cur_i + i)
+            if self.trajectory_log is not None:
+                for (i, result, trajectory) in trajectories:
+                    self.trajectory_log.write(self.done_i + self.cur_i + i, result, trajectory)
+
+            self.cur_i += n
+
+        self.print_done(iterations)
+        return iterations
+
+    def markov_model(self):
+        return MarkovModel(self.mission_time, self.raid_type, self.raid_num, self.disk_fail_parms, self.disk_repair_parms)
+
+    def build_system(self):
+        # the class of the system, and its arguments after those of System
+        if self.splits is not None:
+            (system_class, extra) = (SplittingSystem, (self.splits,))
+        elif self.conditional:
+            (system_class, extra) = (ConditionalSystem, ())
+        elif self.batch_size is None:
+            (system_class, extra) = (System, (self.bias,))
+        else:
+            # The scalar System is kept as the reference implementation
+            (system_class, extra) = (BatchSystem, ())
+
+        # the batch engine is not instrumented
+        if self.instrumentation is not None and self.batch_size is None:
+            system_class = instrumented(system_class)
+        # nor traced
+        if self.tracing and self.batch_size is None:
+            system_class = traced(system_class)
+
+        self.system = system_class(self.mission_time, self.raid_type, self.raid_num, self.disk_capacity, self.disk_fail_parms,
+            self.disk_repair_parms, self.disk_lse_parms, self.disk_scrubbing_parms, self.fs_trace, self.filelevel, self.dedup, self.weighted, *extra)
+        if self.instrumentation is not None and self.batch_size is None:
+            self.system.instrument(self.instrumentation)
+        if self.tracing and self.batch_size is None:
+            self.system.trace(self.trajectory_size)
+
+        if self.antithetic:
+            set_pool_block(ANTITHETIC_POOL_BLOCK)
+        self.set_control(self.raid_failure_samples)
+        self.set_control(self.lse_samples)
+
+    # The arguments of Simulation(), except those of the checkpoints
+    def get_parms(self):
+        return (self.mission_time, self.initial_iterations, self.raid_type, self.raid_num, self.disk_capacity, 
+                self.disk_fail_parms, self.disk_repair_parms, self.disk_lse_parms, self.disk_scrubbing_parms, self.force_re, self.required_re, 
+                self.fs_trace, self.filelevel, self.dedup, self.weighted, self.output_file, self.batch_size, self.seed, self.workers,
+                self.bias, self.splits, self.analytic, self.binary, self.conditional, self.antithetic, self.control)
+
+    # The parameters written to the header of binary event logs,
+    # enough to replay their events, see simd.py --replay
+    def get_config(self):
+        return {"mission_time": self.mission_time, "raid_type": self.raid_type, "raid_num": self.raid_num,
+                "disk_capacity": self.disk_capacity, "disk_fail_parms": self.disk_fail_parms,
+                "disk_repair_parms": self.disk_repair_parms, "disk_lse_parms": self.disk_lse_parms,
+                "disk_scrubbing_parms": self.disk_scrubbing_parms, "seed": self.seed,
+                "trace": self.fs_trace, "filelevel": self.filelevel, "dedup": self.dedup, "weighted": self.weighted,
+                "batch_size": self.batch_size, "antithetic": self.antithetic}
+
+    # The parameters which change the results, see shard.py and cache.py
+    def get_result_config(self):
+        config = self.get_config()
+        config.update({"bias": self.bias, "splits": self.splits, "conditional": self.conditional, "control": self.control})
+        return config
+
+    # The engine does not change the estimates, and the rounds of an entry
+    # may continue with another seed
+    def get_cache_config(self):
+        config = self.get_result_config()
+        del config["batch_size"]
+        del config["seed"]
+        return config
+
+    # The results of the rounds done, to be continued, see cache.py
+    def get_cache_entry(self):
+        return {"seed": self.seed,
+                "iterations": self.iterations,
+                "round": self.round,
+                "raid_failure_samples": self.raid_failure_samples,
+                "lse_samples": self.lse_samples,
+                "systems_with_data_loss": self.systems_with_data_loss,
+                "systems_with_raid_failures": self.systems_with_raid_failures,
+                "systems_with_lse": self.systems_with_lse}
+
+    # Continue the rounds of the cached results with the iterations which
+    # are still needed, as the requested iterations or the required
+    # relative error may be met already
+    def continue_cached(self, entry):
+        self.done_i = entry["iterations"]
+        self.round = entry["round"]
+        self.raid_failure_samples = entry["raid_failure_samples"]
+        self.lse_samples = entry["lse_samples"]
+        self.systems_with_data_loss = entry["systems_with_data_loss"]
+        self.systems_with_raid_failures = entry["systems_with_raid_failures"]
+        self.systems_with_lse = entry["systems_with_lse"]
+
+        if self.force_re:
+            self.more_iterations = 0L
+            if not self.converged():
+                self.more_iterations = self.plan_iterations(self.relative_error())
+        else:
+            self.more_iterations = max(self.initial_iterations - self.done_i, 0L)
+        self.iterations = self.done_i + self.more_iterations
+
+        print >> sys.stderr, "%d iterations cached, %d more iterations." % (self.done_i, self.more_iterations)
+
+    # The results of a shard of the simulation, see shard.py
+    def get_shard(self):
+        config = self.get_result_config()
+        return {"config": config,
+                "fingerprint": shard_fingerprint(config),
+                "seed": self.seed,
+                "iterations": self.iterations,
+                "raid_failure_samples": self.raid_failure_samples,
+                "lse_samples": self.lse_samples,
+                "systems_with_data_loss": self.systems_with_data_loss,
+                "systems_with_raid_failures": self.systems_with_raid_failures,
+                "systems_with_lse": self.systems_with_lse,
+                "df": self.system.get_df()}
+
+    def start_workers(self):
+        parms = (self.mission_time, self.iterations, self.raid_type, self.raid_num, self.disk_capacity, 
+                self.disk_fail_parms, self.disk_repair_parms, self.disk_lse_parms, self.disk_scrubbing_parms, False, self.required_re, 
+                self.fs_trace, self.filelevel, self.dedup, self.weighted, None, self.batch_size, self.seed, 1, self.bias, self.splits,
+                False, False, self.conditional, self.antithetic, self.control, None, self.checkpoint_interval, None, self.instrument,
+                None, self.trajectory_file, self.trajectory_size)
+
+        self.progress = multiprocessing.Value("L", 0)
+        self.pool = multiprocessing.Pool(self.workers, init_worker, (parms, self.progress))
+
+    def stop_workers(self):
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+
+    def simulate(self):
+        wall_time = time.time()
 
-            if self.more_iterations < 10000:
-                self.more_iterations = 10000L
+        self.build_system()
+        if self.trajectory_file is not None:
+            self.trajectory_log = TrajectoryLog(self.trajectory_file)
 
+        self.more_iterations = self.iterations
+        start = 0L
+        if self.resume is not None:
+            self.set_state(load_checkpoint(self.resume))
+            start = self.cur_i
+        elif self.cached is not None:
+            self.continue_cached(self.cached)
+        # the cached results may need no more iterations
+        if self.workers > 1 and self.more_iterations > 0:
+            self.start_workers()
+        draws = pool_draws()
+        self.status_start = (time.time(), self.get_done())
+
+        while self.more_iterations > 0:
+
+            done = self.run_iterations(self.more_iterations, start)
+            start = 0L
+            # stopped early
+            self.iterations -= self.more_iterations - done
+            self.done_i += done
+            self.cur_i = 0L
+
+            if self.force_re == False or self.converged():
+                break
+
+            re = self.relative_error()
+            self.more_iterations = self.plan_iterations(re)
+            print >> sys.stderr, "Since Relative Error %5f > %5f," % (re, self.required_re),
             print >> sys.stderr, "%d more iterations to meet the requirement." % self.more_iterations
 
             self.iterations += self.more_iterations
 
+        if self.force_re:
+            self.warn_no_events()
+
+        self.raid_failure_samples.calcResults("0.95")
+        self.lse_samples.calcResults("0.95")
+
+        if self.pool is not None:
+            self.stop_workers()
+
         if self.output is not None:
-            print >>self.output, "I=%d"%self.iterations
-            self.output.close()
+            self.output.close(self.iterations)
+        if self.trajectory_log is not None:
+            self.trajectory_log.close()
+
+        if self.instrumentation is not None:
+            self.finish_instrumentation(time.time() - wall_time, pool_draws() - draws)
+        if self.status_file is not None:
+            self.write_status("done")
+        if self.shard_file is not None:
+            save_shard(self.shard_file, self.get_shard())
+        if self.cache_dir is not None:
+            save_cache(self.cache_path, self.get_cache_entry())
 
         # finished, return results
         # the format of result:
         return (self.system.dedup_model, self.raid_failure_samples, self.lse_samples, self.systems_with_data_loss, self.systems_with_raid_failures, 
                 self.systems_with_lse, self.iterations, self.system.get_df())
+
+    #
+    # Run the iteration index of a round again, with its random stream and
+    # a traced system, see simd.py --replay. The iterations of its block
+    # run before it, as they draw from the same stream. Return its result
+    # and its trajectory, see TracedSystem.pop_trajectory(), where the
+    # trajectory is None if the iteration loses no data.
+    #
+    def replay(self, round, index):
+        self.tracing = True
+        self.trajectory_size = REPLAY_TRAJECTORY_SIZE
+        self.build_system()
+
+        self.round = round
+        self.trajectory_log = TrajectoryList()
+        self.force_re = False
+        self.quiet = True
+        self.run_local_iterations(index + 1, index - index % STREAM_BLOCK)
+
+        for (i, result, trajectory) in self.trajectory_log.trajectories:
+            if i == index:
+                return (result, trajectory)
+        return ((0, 0), None)
+
+    # Without worker processes, the phases which are not instrumented are
+    # the rest of the wall time
+    def finish_instrumentation(self, wall_time, draws):
+        counters = self.instrumentation
+        counters.wall_time = wall_time
+        counters.pool_draws += draws
+        counters.scale_times()
+        if self.workers <= 1:
+            counters.times["other"] = max(wall_time - sum(counters.times.values()), 0.0)
+
+        if self.instrument_file is not None:
+            counters.save(self.instrument_file)
+
+# The simulation object of a worker process
+worker = None
+
+def init_worker(parms, progress):
+    global worker
+
+    # the parent handles SIGINT and SIGUSR1
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+    worker = Simulation(*parms)
+    worker.build_system()
+    worker.progress_report = progress
+
+def run_task(iterations, key, output):
+    worker.raid_failure_samples = Samples()
+    worker.lse_samples = Samples()
+    worker.set_control(worker.raid_failure_samples)
+    worker.set_control(worker.lse_samples)
+    worker.systems_with_data_loss = 0
+    worker.systems_with_raid_failures = 0
+    worker.systems_with_lse = 0
+    worker.reported_i = 0L
+
+    # the events are written by the parent
+    worker.output = None
+    if output:
+        worker.output = EventList()
+
+    # the trajectories are written by the parent
+    worker.trajectory_log = None
+    if worker.tracing:
+        worker.trajectory_log = TrajectoryList()
+
+    # the counters of the task
+    if worker.instrument and worker.batch_size is None:
+        worker.instrumentation = Instrumentation()
+        worker.system.instrument(worker.instrumentation)
+        if output:
+            worker.output = TimedEventLog(worker.output, worker.instrumentation)
+
+    # the blocks of the task take their streams from the round,
+    # but the batch engine has a stream for the task
+    (seed, worker.round, t) = key
+    worker.stream_offset = t * TASK_ITERATIONS
+    if worker.batch_size is not None:
+        worker.use_stream(*key)
+    draws = pool_draws()
+    worker.run_local_iterations(iterations)
+    if worker.instrumentation is not None:
+        worker.instrumentation.pool_draws += pool_draws() - draws
+
+    events = []
+    if output:
+        events = worker.output.events
+    trajectories = []
+    if worker.trajectory_log is not None:
+        trajectories = worker.trajectory_log.trajectories
+
+    return (worker.raid_failure_samples, worker.lse_samples, worker.systems_with_data_loss, worker.systems_with_raid_failures,
+            worker.systems_with_lse, events, worker.instrumentation, trajectories)
+
+#
+# Check that -a stops without any data loss event, in a mission too short
+# for a disk to fail, and that the relative errors reported are 0
+#
+def test():
+    simulation = Simulation(1, 10000, "mds_14_2", 1, 2*1024*1024*1024L, (1.2, 461386.0, 0), (2.0, 12.0, 6.0),
+            (1.08/10000), (3, 168, 6), True, 0.5, None, False, False, False, None, seed=1)
+    simulation.quiet = True
+    (dedup_model, raid_failure_samples, lse_samples) = simulation.simulate()[:3]
+
+    assert simulation.round == EMPTY_ROUNDS
+    assert simulation.done_i == 10000 * 2 ** (EMPTY_ROUNDS - 1)
+    for samples in (raid_failure_samples, lse_samples):
+        assert not samples.hasEvents()
+        assert samples.prob_re == 0 and samples.value_re == 0
+    print "Stopping without data loss events: OK"
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,83 @@
+import logging
+
+from system import *
+
+#
+# Multilevel splitting for rare data loss events.
+#
+# The levels are the numbers of failed disks of a RAID, from 1 to the
+# number of parity fragments. When a trajectory first reaches a higher
+# level, the system state is saved and the trajectory is split into
+# independent copies. Each copy restores the state, draws the pending
+# events again given that they have not happened yet, and continues with
+# 1/splits of the weight. So only the trajectories which reach a degraded
+# state cost more, and the weighted results stay unbiased.
+#
+# The split happens before the LSEs of the failure are checked, since
+# they depend on the repair times of the failed disks (see
+# Raid.calc_critical_region()), which each copy draws again. So each
+# copy checks them with its own repair times.
+#
+class SplittingSystem(System):
+
+    logger = logging.getLogger("sim")
+
+    def __init__(self, mission_time, raid_type, raid_num, disk_capacity,
+            disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, trace, filelevel, dedup, weighted, splits):
+        System.__init__(self, mission_time, raid_type, raid_num, disk_capacity,
+                disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, trace, filelevel, dedup, weighted)
+
+        self.splits = splits
+
+        self.logger.debug("SplittingSystem: splits = %d" % self.splits)
+
+    # Return a list of ([raid failure result, lse result], weight),
+    # one for each trajectory of the iteration
+    def run(self):
+        return self.run_trajectory(1.0, 0)
+
+    def run_trajectory(self, weight, level):
+
+        while True:
+
+            e = self.go_to_next_event()
+            if e == None:
+                break
+
+            (event_type, event_time, raid_idx) = e
+
+            if event_type == Disk.DISK_EVENT_REPAIR:
+                continue
+
+            raid = self.raids[raid_idx]
+
+            # Check whether the failed disk causes a RAID failure
+            if raid.check_failure(event_time) == True:
+                self.event_queue.discard(raid_idx)
+                self.avail_raids -= 1
+                if self.avail_raids == 0:
+                    break
+
+                continue
+
+            if raid.failed_disk_count > level:
+                return self.split(event_time, weight, raid_idx)
+
+            raid.check_sectors_lost(event_time)
+
+        # The mission concludes or all RAIDs fail
+        return [(self.calc_bytes_lost(), weight)]
+
+    # Split at the failure of a disk of the RAID, whose LSEs are checked by each copy
+    def split(self, current_time, weight, raid_idx):
+        snapshot = self.snapshot()
+        level = self.raids[raid_idx].failed_disk_count
+
+        trajectories = []
+        for i in xrange(self.splits):
+            self.restore(snapshot)
+            self.resample(current_time)
+            self.raids[raid_idx].check_sectors_lost(current_time)
+            trajectories.extend(self.run_trajectory(weight / self.splits, level))
+
+        return trajectories
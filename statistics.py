@@ -8,6 +8,20 @@
 import random
 import math
 
+#
+# The quantile of the standard normal distribution, by bisection
+#
+def normal_quantile(p):
+    low = -10.0
+    high = 10.0
+    for i in range(100):
+        middle = (low + high) / 2
+        if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
 #
 # A Class that incapsulates a set of samples with 
 # operations over those samples (i.e. statistics)
@@ -24,9 +38,25 @@ class Samples:
         self.value_sum = 0L
         self.value2_sum = 0L
         self.prob_sum = 0L
+        # equals to prob_sum unless the samples are weighted
+        self.prob2_sum = 0L
 
         self.num_samples = 0
 
+        # True if any sample is weighted, e.g., by a likelihood ratio
+        self.weighted = False
+
+        #
+        # Streaming (Welford) accumulators: the means and the sums of squared
+        # deviations over the first welford_n samples. The zeros added since
+        # then are merged lazily, so a zero sample costs nothing.
+        #
+        self.welford_n = 0L
+        self.value_m = 0.0
+        self.value_m2 = 0.0
+        self.prob_m = 0.0
+        self.prob_m2 = 0.0
+
         # 
         # A static table used to estimate the confidence 
         # interval around a sample mean
@@ -50,27 +80,231 @@ class Samples:
         self.prob_dev = None
         self.prob_ci = None
         self.prob_re = None
+        # the bounds of the confidence interval of the probability,
+        # which is not symmetric for rare events
+        self.prob_ci_low = None
+        self.prob_ci_high = None
+
+        # the number of plain samples with the same variance
+        # of the estimated probability
+        self.prob_ess = None
+        # (sum of weights)^2 / sum of squared weights over the data loss events,
+        # much lower than the number of events if a few weights dominate
+        self.prob_eff_events = None
+
+        #
+        # Variance reduction, see addAntitheticSamples() and addControlledSample().
+        # The plain sums are over the single iterations of the antithetic pairs.
+        #
+        self.antithetic = False
+        self.plain_n = 0L
+        self.plain_value2_sum = 0.0
+        self.plain_prob2_sum = 0.0
+
+        # the known mean of the control variate, None without a control
+        self.control_mean = None
+        # the sums over the deviations d of the controls from their mean:
+        # d, d^2, value * d and prob * d
+        self.control_sum = 0.0
+        self.control2_sum = 0.0
+        self.value_control_sum = 0.0
+        self.prob_control_sum = 0.0
+
+        # the variance of plain averaging over the same iterations divided by
+        # the variance of the estimate, None without variance reduction
+        self.value_vrf = None
+        self.prob_vrf = None
         
+    # Merge the zeros added since the last update into the Welford accumulators
+    def flushZeros(self):
+        zeros = self.num_samples - self.welford_n
+        if zeros == 0:
+            return
+
+        if self.welford_n > 0:
+            n = float(self.welford_n + zeros)
+            self.value_m2 += pow(self.value_m, 2) * self.welford_n * zeros / n
+            self.value_m *= self.welford_n / n
+            self.prob_m2 += pow(self.prob_m, 2) * self.welford_n * zeros / n
+            self.prob_m *= self.welford_n / n
+
+        self.welford_n = self.num_samples
+
+    # Add a non-zero sample to the Welford accumulators
+    def updateWelford(self, value, prob):
+        self.flushZeros()
+
+        self.welford_n += 1
+        self.num_samples += 1L
+
+        delta = value - self.value_m
+        self.value_m += delta / self.welford_n
+        self.value_m2 += delta * (value - self.value_m)
+
+        delta = prob - self.prob_m
+        self.prob_m += delta / self.welford_n
+        self.prob_m2 += delta * (prob - self.prob_m)
+
     # only non-zeros in samples, num shows the actual number of samples */
     def addSamples(self, samples, num):
         for sample in samples:
             self.value_sum += sample
             self.value2_sum += pow(sample, 2)
             self.prob_sum += 1
+            self.prob2_sum += 1
+            self.updateWelford(sample, 1)
 
-        self.num_samples += num 
+        self.num_samples += num - len(samples)
+
+    # A NumPy array of non-zero samples, num shows the actual number of samples
+    def addSampleArray(self, samples, num):
+        other = Samples()
+        n = len(samples)
+        if n > 0:
+            samples = samples.astype(float)
+            other.value_sum = float(samples.sum())
+            other.value2_sum = float((samples ** 2).sum())
+            other.prob_sum = float(n)
+            other.prob2_sum = float(n)
+
+            other.welford_n = long(n)
+            other.value_m = other.value_sum / n
+            other.value_m2 = float(((samples - other.value_m) ** 2).sum())
+            other.prob_m = 1.0
+        other.num_samples = long(num)
+
+        self.merge(other)
 
     def addSample(self, sample):
         if sample > 0:
             self.value_sum += sample
             self.value2_sum += pow(sample, 2)
             self.prob_sum += 1
+            self.prob2_sum += 1
+            self.updateWelford(sample, 1)
+        else:
+            self.num_samples += 1L
 
-        self.num_samples += 1L
+    # The sample is drawn from a biased distribution, and weighted
+    # by the likelihood ratio to keep the estimates unbiased
+    def addWeightedSample(self, sample, weight):
+        self.weighted = True
+        if sample > 0:
+            value = weight * sample
+            self.value_sum += value
+            self.value2_sum += pow(value, 2)
+            self.prob_sum += weight
+            self.prob2_sum += pow(weight, 2)
+            self.updateWelford(value, weight)
+        else:
+            self.num_samples += 1L
 
     def addZeros(self, num):
         self.num_samples += long(num)
 
+    # The samples are corrected by a control variate of known mean,
+    # see addControlledSample()
+    def setControl(self, mean):
+        self.control_mean = mean
+
+    def updateControl(self, control, value, prob):
+        d = control - self.control_mean
+        self.control_sum += d
+        self.control2_sum += d * d
+        self.value_control_sum += value * d
+        self.prob_control_sum += prob * d
+
+    # A sample with its control variate
+    def addControlledSample(self, sample, control):
+        self.addSample(sample)
+        if sample > 0:
+            self.updateControl(control, sample, 1)
+        else:
+            self.updateControl(control, 0, 0)
+
+    # The iterations of an antithetic pair, averaged as one sample.
+    # The last pair of a run may have a single iteration.
+    # control is the mean of the control variates of the pair, if any.
+    def addAntitheticSamples(self, samples, control=None):
+        self.antithetic = True
+        weight = 1.0 / len(samples)
+        value = 0.0
+        prob = 0.0
+        for sample in samples:
+            self.plain_n += 1
+            if sample > 0:
+                self.plain_value2_sum += pow(sample, 2)
+                self.plain_prob2_sum += 1
+                value += weight * sample
+                prob += weight
+
+        # the average of the pair is not weighted by a likelihood ratio
+        self.addAveragedSample(value, prob)
+        if control is not None:
+            self.updateControl(control, value, prob)
+
+    # The trajectories of a split iteration, a list of (sample, weight).
+    # Together they are one sample: the weighted sum of the trajectories.
+    def addSplitSamples(self, samples):
+        self.weighted = True
+        value = 0.0
+        prob = 0.0
+        for (sample, weight) in samples:
+            if sample > 0:
+                value += weight * sample
+                prob += weight
+
+        self.addAveragedSample(value, prob)
+
+    # A sample made of several iterations or trajectories, with the
+    # value and the probability of a loss averaged over them
+    def addAveragedSample(self, value, prob):
+        if prob > 0:
+            self.value_sum += value
+            self.value2_sum += pow(value, 2)
+            self.prob_sum += prob
+            self.prob2_sum += pow(prob, 2)
+            self.updateWelford(value, prob)
+        else:
+            self.num_samples += 1L
+
+    #
+    # Merge the samples collected by another instance, e.g., in another process
+    #
+    def merge(self, samples):
+        # Chan et al.'s parallel combination of the Welford accumulators
+        self.flushZeros()
+        samples.flushZeros()
+        n = self.welford_n + samples.welford_n
+        if n > 0:
+            delta = samples.value_m - self.value_m
+            self.value_m2 += samples.value_m2 + pow(delta, 2) * self.welford_n * samples.welford_n / float(n)
+            self.value_m += delta * samples.welford_n / float(n)
+            delta = samples.prob_m - self.prob_m
+            self.prob_m2 += samples.prob_m2 + pow(delta, 2) * self.welford_n * samples.welford_n / float(n)
+            self.prob_m += delta * samples.welford_n / float(n)
+        self.welford_n = n
+
+        self.value_sum += samples.value_sum
+        self.value2_sum += samples.value2_sum
+        self.prob_sum += samples.prob_sum
+        self.prob2_sum += samples.prob2_sum
+
+        self.num_samples += samples.num_samples
+        self.weighted = self.weighted or samples.weighted
+
+        self.antithetic = self.antithetic or samples.antithetic
+        self.plain_n += samples.plain_n
+        self.plain_value2_sum += samples.plain_value2_sum
+        self.plain_prob2_sum += samples.plain_prob2_sum
+
+        if self.control_mean is None:
+            self.control_mean = samples.control_mean
+        self.control_sum += samples.control_sum
+        self.control2_sum += samples.control2_sum
+        self.value_control_sum += samples.value_control_sum
+        self.prob_control_sum += samples.prob_control_sum
+
     #
     # Calculate the sample mean based on the samples for this instance
     #
@@ -79,76 +313,233 @@ class Samples:
         self.value2_mean = self.value2_sum / float(self.num_samples)
 
         self.prob_mean = self.prob_sum / float(self.num_samples)
+        self.prob2_mean = self.prob2_sum / float(self.num_samples)
 
     #
     # Calculate the standard deviation based on the samples for this instance
-    # dev = E(X-EX)^2 = EX^2 - (EX)^2
+    # dev = sqrt(E(X-EX)^2), from the Welford accumulators which do not
+    # suffer from the cancellation in EX^2 - (EX)^2
+    #
+    # The accumulators are not updated here, so reporting the results
+    # does not change the results of the following samples.
     #
     def calcStdDev(self ):
         self.calcMean()
-        self.value_dev = math.sqrt(self.value2_mean - pow(self.value_mean, 2))
-        self.prob_dev = math.sqrt(self.prob_mean - pow(self.prob_mean, 2))
+
+        value_m2 = self.value_m2
+        prob_m2 = self.prob_m2
+        zeros = self.num_samples - self.welford_n
+        if zeros > 0 and self.welford_n > 0:
+            value_m2 += pow(self.value_m, 2) * self.welford_n * zeros / float(self.num_samples)
+            prob_m2 += pow(self.prob_m, 2) * self.welford_n * zeros / float(self.num_samples)
+
+        self.value_dev = math.sqrt(value_m2 / self.num_samples)
+        self.prob_dev = math.sqrt(prob_m2 / self.num_samples)
+
+    #
+    # Correct the means by the control variate, and measure the reduction
+    # of the variance against plain averaging over the same iterations.
+    #
+    # The corrected mean is mean - beta * (mean of d), where d is the
+    # deviation of the control from its known mean and beta = Cov(X, d) / Var(d),
+    # so the variance is Var(X) * (1 - rho^2).
+    #
+    def calcVarianceReduction(self):
+        if not self.antithetic and self.control_mean is None:
+            return
+
+        n = float(self.num_samples)
+        value_var = pow(self.value_dev, 2)
+        prob_var = pow(self.prob_dev, 2)
+
+        # the variances of the single iterations
+        if self.antithetic:
+            plain_n = float(self.plain_n)
+            plain_value_var = self.plain_value2_sum / plain_n - pow(self.value_mean, 2)
+            plain_prob_var = self.plain_prob2_sum / plain_n - pow(self.prob_mean, 2)
+        else:
+            plain_n = n
+            plain_value_var = value_var
+            plain_prob_var = prob_var
+
+        if self.control_mean is not None:
+            d_mean = self.control_sum / n
+            d_var = self.control2_sum / n - pow(d_mean, 2)
+            if d_var > 0:
+                cov = self.value_control_sum / n - self.value_mean * d_mean
+                self.value_mean -= cov / d_var * d_mean
+                value_var = max(value_var - pow(cov, 2) / d_var, 0.0)
+
+                cov = self.prob_control_sum / n - self.prob_mean * d_mean
+                self.prob_mean -= cov / d_var * d_mean
+                prob_var = max(prob_var - pow(cov, 2) / d_var, 0.0)
+
+        self.value_dev = math.sqrt(value_var)
+        self.prob_dev = math.sqrt(prob_var)
+
+        self.value_vrf = self.calcVRF(plain_value_var / plain_n, value_var / n)
+        self.prob_vrf = self.calcVRF(plain_prob_var / plain_n, prob_var / n)
+
+    # 1 if both variances are zero, e.g., without data loss events
+    def calcVRF(self, plain_var, var):
+        if var > 0:
+            return plain_var / var
+        elif plain_var > 0:
+            return float("inf")
+        return 1.0
+
+    #
+    # The z value of a two-sided confidence level
+    #
+    def getZ(self, conf_level):
+        if conf_level in self.conf_lvl_lku.keys():
+            return self.conf_lvl_lku[conf_level]
+        return normal_quantile(0.5 + float(conf_level) / 2)
 
     #
     # Calculate the confidence interval around the sample mean 
     #
     # @param conf_level: the probability that the mean falls within the interval
     #
+    # The interval of the probability is the Wilson score interval, which
+    # stays valid when few data loss events are observed. Weighted or
+    # corrected samples, and the averages of antithetic pairs, are not
+    # Bernoulli, so they use the normal interval.
+    #
     def calcConfInterval(self, conf_level):
         
-        if conf_level not in self.conf_lvl_lku.keys():
-            print "%s not a valid confidence level!" % conf_level
-            return None
+        z = self.getZ(conf_level)
     
         self.calcStdDev()
+        self.calcVarianceReduction()
+
+        n = float(self.num_samples)
+        self.value_ci = abs(z * (self.value_dev / math.sqrt(n)))
+
+        if self.weighted or self.antithetic or self.control_mean is not None:
+            self.prob_ci = abs(z * (self.prob_dev / math.sqrt(n)))
+            self.prob_ci_low = self.prob_mean - self.prob_ci
+            self.prob_ci_high = self.prob_mean + self.prob_ci
+        else:
+            p = self.prob_mean
+            denominator = 1 + z * z / n
+            center = (p + z * z / (2 * n)) / denominator
+            half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+            self.prob_ci_low = max(center - half, 0.0)
+            self.prob_ci_high = min(center + half, 1.0)
+            self.prob_ci = (self.prob_ci_high - self.prob_ci_low) / 2
 
-        self.value_ci = abs(self.conf_lvl_lku[conf_level] * (self.value_dev / math.sqrt(self.num_samples)))
-        self.prob_ci = abs(self.conf_lvl_lku[conf_level] * (self.prob_dev / math.sqrt(self.num_samples)))
+    # True once a data loss event is observed
+    def hasEvents(self):
+        return self.prob_sum > 0
 
     #
     # Calculate the relative error 
     #
-    # self.conf_lvl_lku[conf_level] * sqrt(Var)/sqrt(num_samples) / mean
+    # z * sqrt(Var)/sqrt(num_samples) / mean
+    # It is 0 until a data loss event is observed, see hasEvents().
     #
     def calcRE(self, conf_level):
         
         self.calcConfInterval(conf_level)
 
-        if self.value_mean == 0:
-            self.value_re = 0
-            self.prob_re = 0
+        if not self.hasEvents():
+            self.value_re = 0.0
+            self.prob_re = 0.0
+        else:
+            # a corrected mean may even be negative
+            self.value_re = self.value_ci / abs(self.value_mean)
+            self.prob_re = self.prob_ci / abs(self.prob_mean)
+
+    #
+    # Calculate the effective sample size of the probability estimate:
+    # the number of unweighted samples with the same variance,
+    # num_samples * p(1-p) / Var
+    #
+    def calcESS(self):
+
+        if self.prob_dev == 0:
+            self.prob_ess = float(self.num_samples)
         else:
-            self.value_re = self.value_ci / self.value_mean
-            self.prob_re = self.prob_ci / self.prob_mean
+            self.prob_ess = self.num_samples * self.prob_mean * (1 - self.prob_mean) / pow(self.prob_dev, 2)
+
+        if self.prob2_sum == 0:
+            self.prob_eff_events = 0.0
+        else:
+            self.prob_eff_events = pow(self.prob_sum, 2) / float(self.prob2_sum)
 
     # zeros have been eliminated
     def calcResults(self, conf_level):
 
         self.calcRE(conf_level)
+        self.calcESS()
     
 #
-# Generate samples from a known distribution and verify the statistics
+# Check the statistics against known answers
 #
 def test():
-    
-    num_samples = 1000
-    samples = []
-    mean = 0.5
-    std_dev = 0.001
-    for i in range(num_samples):
-        samples.append(random.gauss(mean, std_dev))
-
-    s = Samples(1000)    
-    s.calcResults("0.9", samples)
-        
-    print "Mean: %s (%s): " % (s.calcMean(), mean)
-    print "Std Dev: %s (%s): " % (s.calcStdDev(), std_dev)
-    print "Conf. Interval: (%s, %s)" % s.calcConfInterval("0.995")
-
-    (a,b,c,d) = s.getResults()
-    print "Mean: %s (%s): " % (a, mean)
-    print "Conf. Interval: (%s, %s)" % (b,c)
-    print "Relative Error: (%s)" % d
+    rng = random.Random(1)
+
+    # the quantile of the normal distribution
+    assert abs(normal_quantile(0.975) - 1.959964) < 1e-6
+    assert abs(Samples().getZ("0.99") - 2.575829) < 1e-6
+    print "normal_quantile: OK"
+
+    # merging the accumulators of two halves equals a single pass
+    samples = [rng.choice([0, 0, 0, rng.expovariate(1.0)]) for i in range(1000)]
+    whole = Samples()
+    first = Samples()
+    second = Samples()
+    for (i, sample) in enumerate(samples):
+        whole.addSample(sample)
+        if i < 400:
+            first.addSample(sample)
+        else:
+            second.addSample(sample)
+    first.merge(second)
+    whole.calcResults("0.95")
+    first.calcResults("0.95")
+    for name in ("num_samples", "value_mean", "value_dev", "prob_mean", "prob_dev", "prob_ci_low", "prob_ci_high"):
+        assert abs(getattr(whole, name) - getattr(first, name)) < 1e-9, name
+    print "merge: OK"
+
+    # the Wilson interval of 0 of n is [0, z^2/(n + z^2)]
+    n = 1000
+    z = 1.96
+    zeros = Samples()
+    zeros.addZeros(n)
+    zeros.calcResults("0.95")
+    assert zeros.prob_ci_low == 0
+    assert abs(zeros.prob_ci_high - z * z / (n + z * z)) < 1e-12
+    assert zeros.prob_re == 0 and zeros.value_re == 0
+    print "Wilson interval of 0 of n: OK"
+
+    # Antithetic pairs of a Bernoulli of probability p, driven by u and 1-u:
+    # the mean is unbiased and the variance is reduced
+    p = 0.3
+    pairs = Samples()
+    for i in range(20000):
+        u = rng.random()
+        pairs.addAntitheticSamples([int(u < p), int(1 - u < p)])
+    pairs.calcResults("0.95")
+    assert not pairs.weighted
+    assert abs(pairs.prob_mean - p) < 2 * pairs.prob_ci
+    assert pairs.prob_vrf > 1
+    print "antithetic pairs: OK"
+
+    # A control variate of known mean: the number c of k uniforms below q,
+    # correlated with a loss if c >= 2 and another uniform is below 0.9
+    (k, q) = (10, 0.1)
+    p = 0.9 * (1 - pow(1 - q, k) - k * q * pow(1 - q, k - 1))
+    controlled = Samples()
+    controlled.setControl(k * q)
+    for i in range(20000):
+        c = sum([rng.random() < q for j in range(k)])
+        controlled.addControlledSample(int(c >= 2 and rng.random() < 0.9), c)
+    controlled.calcResults("0.95")
+    assert abs(controlled.prob_mean - p) < 2 * controlled.prob_ci
+    assert controlled.prob_vrf > 1
+    print "control variate: OK"
 
 if __name__ == "__main__":
     test()    
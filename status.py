@@ -0,0 +1,56 @@
+import os
+import json
+
+#
+# The status of a running simulation, see simd.py --status.
+#
+# The status is a JSON object, rewritten every status_interval seconds
+# between iterations (see Simulation.tick()) and once more at the end of
+# the simulation. It is written to a temporary file which is then
+# renamed, so a reader never sees a partial status. Its fields are:
+#   state          = "running", or "done" once the results are final
+#   time, elapsed  = the time of the status, and the seconds since the
+#                    simulation started (or was resumed)
+#   round          = the round of iterations, see Simulation.simulate()
+#   iterations     = the iterations done, including those of the running
+#                    tasks of the worker processes
+#   planned        = the iterations planned so far
+#   iterations_per_second = since the simulation started (or was resumed)
+#   eta            = the seconds left, to the planned iterations or, with
+#                    -a, to the iterations needed to meet the required
+#                    relative error as estimated from the current one;
+#                    null if unknown
+#   systems_with_data_loss, systems_with_raid_failures, systems_with_lse
+#   raid_failure, lse = the estimators, see estimator_status(), null
+#                    until there are two samples
+#   relative_error = the largest relative error of the estimators
+#   required_re    = the relative error required by -a, or null
+# The estimators only include the tasks of the workers which are done.
+# Numbers which are not finite are null.
+#
+
+def finite(x):
+    if x is None or x != x or x in (float("inf"), float("-inf")):
+        return None
+    return x
+
+# The results of Samples, which are computed without changing the
+# accumulators, see Samples.calcStdDev()
+def estimator_status(samples, conf_level):
+    if samples.num_samples < 2:
+        return None
+    samples.calcResults(conf_level)
+
+    status = {"samples": samples.num_samples}
+    for name in ("prob_mean", "prob_ci", "prob_re", "value_mean", "value_ci", "value_re"):
+        status[name] = finite(getattr(samples, name))
+    return status
+
+def save_status(path, status):
+    tmp = path + ".tmp"
+    f = open(tmp, "w")
+    json.dump(status, f, indent=1, sort_keys=True)
+    f.write("\n")
+    f.close()
+
+    os.rename(tmp, path)
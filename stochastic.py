@@ -1,37 +1,389 @@
 from math import *
 import random
+import hashlib
+import numpy
+
+# Seed the random module with an independent stream identified by a key,
+# such as (seed, round, worker). Different keys lead to unrelated states of
+# the Mersenne Twister, so the streams do not overlap in practice.
+# The pools are seeded from the same key, and their buffers are dropped.
+# The words of the digest are returned to seed other generators (e.g., NumPy).
+def seed_stream(*key):
+    digest = hashlib.sha256("-".join([str(k) for k in key])).hexdigest()
+    random.seed(long(digest, 16))
+
+    pool_digest = hashlib.sha256(digest + "-pools").hexdigest()
+    pool_rng.seed([int(pool_digest[i:i+8], 16) for i in range(0, len(pool_digest), 8)])
+    for pool in pools.values():
+        pool.reset()
+
+    return [int(digest[i:i+8], 16) for i in range(0, len(digest), 8)]
+
+#
+# Pools of variates: the draws of a distribution are generated by NumPy in
+# blocks of POOL_BLOCK and served one by one, which saves the overhead of a
+# call per draw. Each distribution has a single pool, shared by all objects
+# which draw from it. All pools draw from pool_rng.
+# The pools are reset at each block of iterations of a simulation (see
+# simulation.STREAM_BLOCK), so the block is not much larger than the draws
+# of a distribution in a block of iterations.
+#
+POOL_BLOCK = 1024
+pool_rng = numpy.random.RandomState()
+pools = {}
+
+class VariatePool:
+    # generate(size) returns a NumPy array of size draws
+    def __init__(self, generate):
+        self.generate = generate
+        self.buffer = []
+        # the variates put into and dropped from the buffer, see pool_draws()
+        self.generated = 0
+        self.discarded = 0
+
+    def draw(self):
+        if not self.buffer:
+            self.buffer = self.generate(POOL_BLOCK).tolist()
+            self.generated += len(self.buffer)
+        return self.buffer.pop()
+
+    def reset(self):
+        self.discarded += len(self.buffer)
+        self.buffer = []
+
+    # Replace the buffer by the one of a checkpoint
+    def fill(self, buffer):
+        self.reset()
+        self.buffer = list(buffer)
+        self.generated += len(self.buffer)
+
+# the buffers of a checkpoint, for the pools which are not created yet
+restored_buffers = {}
+
+# Smaller blocks suit the streams which are seeded often, see sweep.py
+def set_pool_block(size):
+    global POOL_BLOCK
+    POOL_BLOCK = size
+
+def get_pool(key, generate):
+    if key not in pools:
+        pools[key] = VariatePool(generate)
+        pools[key].fill(restored_buffers.pop(key, []))
+    return pools[key]
+
+# The number of variates drawn from all pools so far
+def pool_draws():
+    return sum([pool.generated - pool.discarded - len(pool.buffer) for pool in pools.values()])
+
+# The state of the pools, for checkpoints
+def get_pool_state():
+    return (pool_rng.get_state(), dict([(key, list(pool.buffer)) for (key, pool) in pools.items()]))
+
+def set_pool_state(state):
+    (rng_state, buffers) = state
+    pool_rng.set_state(rng_state)
+    restored_buffers.clear()
+    for (key, buffer) in buffers.items():
+        if key in pools:
+            pools[key].fill(buffer)
+        else:
+            restored_buffers[key] = list(buffer)
+
+#
+# Antithetic pairs of iterations: the second iteration of a pair draws its
+# Weibull variates from the same uniforms U as the first, as 1 - U.
+# Call begin_antithetic(False) before the first iteration of a pair, and
+# begin_antithetic(True) before the second. The buffers are dropped, so
+# small blocks suit them, see set_pool_block().
+#
+pool_antithetic = False
+pair_rng_state = None
+
+def begin_antithetic(second):
+    global pool_antithetic, pair_rng_state
+    if second:
+        pool_rng.set_state(pair_rng_state)
+    else:
+        pair_rng_state = pool_rng.get_state()
+    pool_antithetic = second
+    for pool in pools.values():
+        pool.reset()
+
+# The uniforms of a block, flipped in the second iteration of a pair.
+# The pools draw by inversion, so a flipped uniform gives the opposite variate.
+def pool_uniforms(size):
+    u = pool_rng.random_sample(size)
+    if pool_antithetic:
+        return 1.0 - u
+    return u
+
+def weibull_pool(shape, scale):
+    return get_pool(("weibull", shape, scale), lambda size: scale * numpy.power(-numpy.log1p(-pool_uniforms(size)), 1.0 / shape))
 
 class Weibull:
     def __init__(self, shape, scale, location=0):
         self.shape = shape
         self.scale = scale
         self.location = location
+        self.pool = weibull_pool(shape, scale)
 
     def draw(self):
-        v = random.weibullvariate(self.scale, self.shape)
+        v = self.pool.draw()
+        if v < self.location:
+            return self.location
+        return v
+
+    # Draw a value conditioned on it being larger than age,
+    # i.e., the residual life of a component which has survived age
+    def draw_residual(self, age):
+        if age < self.location:
+            return self.draw()
+        return self.scale * pow(pow(age/self.scale, self.shape) - log(1.0 - random.random()), 1.0/self.shape)
+
+    # P(X <= x)
+    def cdf(self, x):
+        if x < self.location:
+            return 0.0
+        return -expm1(-pow(x/self.scale, self.shape))
+
+    # Draw a value conditioned on it being at most x, with cdf(x) > 0
+    def draw_below(self, x):
+        u = random.random() * -expm1(-pow(x/self.scale, self.shape))
+        v = self.scale * pow(-log1p(-u), 1.0/self.shape)
         if v < self.location:
             return self.location
         return v
 
+# The distributions are shared by the disks with the same parameters
+weibulls = {}
+
+def shared_weibull(shape, scale, location=0):
+    key = (shape, scale, location)
+    if key not in weibulls:
+        weibulls[key] = Weibull(shape, scale, location)
+    return weibulls[key]
+
+# The probabilities of 0..n successes of n trials with probability q
+def binomial_pmf(n, q):
+    pmf = []
+    c = 1.0
+    for k in xrange(n + 1):
+        pmf.append(c * pow(q, k) * pow(1.0 - q, n - k))
+        c = c * (n - k) / (k + 1)
+    return pmf
+
+#
+# The likelihood ratio of an iteration, for importance sampling:
+# the product of f(x)/g(x) over the draws, where f is the original density
+# and g the biased one.
+#
+class LikelihoodRatio:
+    def __init__(self):
+        self.value = 1.0
+
+    def reset(self):
+        self.value = 1.0
+
+#
+# A Weibull which draws from a biased scale, and multiplies the likelihood
+# ratio of the original to the biased distribution into ratio.
+#
+class BiasedWeibull(Weibull):
+    def __init__(self, shape, scale, location, biased_scale, ratio):
+        Weibull.__init__(self, shape, biased_scale, location)
+        self.orig_scale = scale
+        self.ratio = ratio
+
+    # log P(X > x) for a scale
+    def log_survival(self, scale, x):
+        if x < self.location:
+            return 0.0
+        return -pow(x/scale, self.shape)
+
+    # If the simulation only looks at whether the value exceeds a horizon,
+    # a censored draw is weighted by the ratio of the survival functions,
+    # which has a much lower variance than the ratio of the densities.
+    def draw(self, horizon=None):
+        v = self.pool.draw()
+        if horizon is not None and v > horizon:
+            self.ratio.value *= exp(self.log_survival(self.orig_scale, horizon) - self.log_survival(self.scale, horizon))
+        elif v < self.location:
+            # the probability mass at the location
+            self.ratio.value *= (1.0 - exp(self.log_survival(self.orig_scale, self.location))) / (1.0 - exp(self.log_survival(self.scale, self.location)))
+            v = self.location
+        else:
+            self.ratio.value *= exp(self.shape * log(self.scale/self.orig_scale)
+                    + pow(v/self.scale, self.shape) - pow(v/self.orig_scale, self.shape))
+        return v
+
 class Poisson:
     def __init__(self, rate):
         self.rate = rate
 
-    # Knuth gave a simple algorithm to generate random Poisson-distributed numbers.
-    # See https://en.wikipedia.org/wiki/Poisson_distribution
-    # The input is the scrubbing time
+    # The input is the scrubbing time.
+    # Small means are drawn by inversion, and large means by the transformed
+    # rejection of Hormann (PTRS), so exp(-mean) never underflows.
     def draw(self, time=336):
-        L = exp(-time*self.rate)
+        mean = time * self.rate
+        if mean < 10:
+            return self.draw_inversion(mean)
+        return self.draw_ptrs(mean)
+
+    def draw_inversion(self, mean):
         k = 0
-        p = 1
+        p = exp(-mean)
+        cdf = p
+        u = random.random()
+        while u > cdf and p > 0:
+            k += 1
+            p *= mean / k
+            cdf += p
+        return k
+
+    # W. Hormann, The transformed rejection method for generating Poisson
+    # random variables, Insurance: Mathematics and Economics, 1993
+    def draw_ptrs(self, mean):
+        log_mean = log(mean)
+        b = 0.931 + 2.53 * sqrt(mean)
+        a = -0.059 + 0.02483 * b
+        inv_alpha = 1.1239 + 1.1328 / (b - 3.4)
+        v_r = 0.9277 - 3.6224 / (b - 2)
+
         while True:
-            k = k + 1
-            u = random.uniform(0,1)
-            p = p * u
-            if p <= L:
-                break
+            u = random.random() - 0.5
+            v = random.random()
+            us = 0.5 - abs(u)
+            k = int(floor((2 * a / us + b) * u + mean + 0.43))
+            if us >= 0.07 and v <= v_r:
+                return k
+            if k < 0 or (us < 0.013 and v > us):
+                continue
+            if log(v * inv_alpha / (a / (us * us) + b)) <= -mean + k * log_mean - lgamma(k + 1):
+                return k
+
+#
+# A discrete distribution over a histogram of (value, count), drawn in O(1)
+# with Vose's alias method: a slot is picked uniformly, and it yields its
+# own value with probability prob[i], otherwise the value of alias[i].
+# The memory is proportional to the number of distinct values.
+#
+class AliasTable:
+    def __init__(self, values, counts):
+        n = len(values)
+        total = float(sum(counts))
+
+        self.values = list(values)
+        self.counts = list(counts)
+        self.prob = [1.0] * n
+        self.alias = range(n)
+        self.mean = 0.0
+        if total > 0:
+            self.mean = sum([v * c for (v, c) in zip(values, counts)]) / total
+
+        scaled = [c * n / total for c in counts]
+        small = [i for i in xrange(n) if scaled[i] < 1.0]
+        large = [i for i in xrange(n) if scaled[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] += scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # the rest are 1 up to rounding
+
+        self.values_array = numpy.array(self.values, dtype=numpy.int64)
+        self.prob_array = numpy.array(self.prob)
+        self.alias_array = numpy.array(self.alias, dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.values)
+
+    def draw(self):
+        i = int(random.random() * len(self.values))
+        if random.random() < self.prob[i]:
+            return self.values[i]
+        return self.values[self.alias[i]]
+
+    # The sum of num draws
+    def draw_sum(self, num):
+        total = 0
+        for j in xrange(num):
+            total += self.draw()
+        return total
+
+    # A NumPy array of size draws from a numpy.random.RandomState
+    def draws(self, size, rng):
+        i = rng.randint(0, len(self.values), size)
+        return numpy.where(rng.random_sample(size) < self.prob_array[i], self.values_array[i], self.values_array[self.alias_array[i]])
+
+#
+# The number of LSEs a disk develops over a scrubbing period: a Poisson
+# whose mean is rate * S, where the scrubbing time S is max(W, location)
+# for a Weibull W. The probabilities are tabulated once, by integrating
+# over the quantiles of S with Gauss-Legendre, and drawn with an
+# AliasTable. The tail beyond the table (< 1e-15) is dropped.
+#
+class MixedPoisson:
+    def __init__(self, rate, scrubbing_parms, nodes=512):
+        (shape, scale, location) = scrubbing_parms
+        self.rate = rate
+        self.scrubbing_parms = scrubbing_parms
+
+        # S = location below the quantile u0, and the Weibull above
+        u0 = 1.0 - exp(-pow(1.0 * location / scale, shape))
+        (x, w) = numpy.polynomial.legendre.leggauss(nodes)
+        u = u0 + (1.0 - u0) * (x + 1) / 2
+        weights = numpy.append(w * (1.0 - u0) / 2, u0)
+        s = numpy.append(scale * numpy.power(-numpy.log1p(-u), 1.0 / shape), location)
+        s = numpy.maximum(s, location)
+        means = rate * s
+
+        if means.max() <= 0:
+            pmf = numpy.ones(1)
+        else:
+            top = means.max()
+            k = numpy.arange(int(top + 12 * sqrt(top) + 30))
+            log_means = numpy.log(numpy.maximum(means, 1e-300))
+            log_factorials = numpy.array([lgamma(i + 1) for i in k])
+            pmf = numpy.dot(weights, numpy.exp(-means[:, None] + k[None, :] * log_means[:, None] - log_factorials[None, :]))
+
+        pmf = pmf[:numpy.flatnonzero(pmf > 1e-15 * pmf.sum()).max() + 1]
+        self.pmf = pmf / pmf.sum()
+        self.table = AliasTable(range(len(self.pmf)), self.pmf.tolist())
+
+        # the pool draws by inversion, see pool_uniforms()
+        self.cdf = numpy.cumsum(self.pmf)
+        self.pool = get_pool(("mixed_poisson", rate, tuple(scrubbing_parms)), self.generate)
+
+    def generate(self, size):
+        counts = numpy.searchsorted(self.cdf, pool_uniforms(size), side="right")
+        return numpy.minimum(counts, len(self.pmf) - 1)
+
+    def draw(self):
+        return self.pool.draw()
+
+    # The number of LSEs of num disks
+    def draw_sum(self, num):
+        total = 0
+        for i in xrange(num):
+            total += self.pool.draw()
+        return total
+
+    def draws(self, size, rng):
+        return self.table.draws(size, rng)
+
+# The tables are shared by the disks with the same parameters
+mixed_poisson_tables = {}
 
-        return k - 1 
+def mixed_poisson(rate, scrubbing_parms):
+    key = (rate, tuple(scrubbing_parms))
+    if key not in mixed_poisson_tables:
+        mixed_poisson_tables[key] = MixedPoisson(rate, scrubbing_parms)
+    return mixed_poisson_tables[key]
 
 def test():
     #w = Weibull(1, 12, 0)
@@ -0,0 +1,231 @@
+#!/usr/bin/python
+import getopt
+import itertools
+import multiprocessing
+from system import *
+from statistics import *
+from simd import *
+
+#
+# Sweep a grid of configurations with common random numbers.
+#
+# Iteration i of every configuration starts from the random stream
+# (seed, i), so the configurations see the same failures as far as they
+# draw them alike, and the difference between two configurations is
+# estimated from the paired differences of their iterations. Its variance
+# is much smaller than with independent runs when the results of the
+# configurations are correlated.
+#
+# The configurations are spread over worker processes. The
+# deduplication model of the trace is loaded once per process.
+#
+
+# The pools of variates are drawn again in each iteration
+SWEEP_POOL_BLOCK = 64
+
+DISK_CAPACITY = 2*1024*1024*1024L
+
+# (raid_type, raid_num, capacity_factor, parms, mission_time)
+def config_name(config):
+    return "%s n=%d c=%g %s m=%g" % config
+
+#
+# Return the non-zero results of the iterations of a configuration,
+# as (iterations, values) arrays of the RAID failures and of the LSEs,
+# and the D/F of the trace
+#
+def run_config(config, iterations, seed, trace, filelevel, dedup, weighted):
+    (raid_type, raid_num, capacity_factor, parms, mission_time) = config
+    (disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms) = get_presets(parms, capacity_factor)
+
+    system = System(mission_time, raid_type, raid_num, DISK_CAPACITY * capacity_factor, disk_fail_parms,
+            disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, trace, filelevel, dedup, weighted)
+    set_pool_block(SWEEP_POOL_BLOCK)
+
+    raid_failures = ([], [])
+    lses = ([], [])
+    for i in xrange(iterations):
+        seed_stream(seed, i)
+        system.reset()
+        result = system.run()
+
+        if result[0] != 0:
+            raid_failures[0].append(i)
+            raid_failures[1].append(result[0])
+        if result[1] != 0:
+            lses[0].append(i)
+            lses[1].append(result[1])
+
+    results = []
+    for (index, values) in (raid_failures, lses):
+        results.append((numpy.array(index, dtype=numpy.int64), numpy.array(values, dtype=float)))
+    return (results[0], results[1], system.get_df())
+
+def sweep_task(args):
+    return run_config(*args)
+
+def sweep(configs, iterations, seed, trace, filelevel, dedup, weighted, workers):
+    tasks = [(config, iterations, seed, trace, filelevel, dedup, weighted) for config in configs]
+
+    if workers > 1 and len(configs) > 1:
+        pool = multiprocessing.Pool(min(workers, len(configs)))
+        results = []
+        for (k, result) in enumerate(pool.imap(sweep_task, tasks)):
+            print >> sys.stderr, "%d/%d: %s" % (k + 1, len(configs), config_name(configs[k]))
+            results.append(result)
+        pool.close()
+        pool.join()
+        return results
+
+    results = []
+    for (k, task) in enumerate(tasks):
+        results.append(sweep_task(task))
+        print >> sys.stderr, "%d/%d: %s" % (k + 1, len(configs), config_name(configs[k]))
+    return results
+
+# The values of a measure: the losses, or 1 for the probability of a loss
+def measure(samples, prob):
+    (index, values) = samples
+    if prob:
+        return (index, numpy.ones(len(values)))
+    return (index, values)
+
+#
+# The mean of x - y over n paired iterations, with the half width of its
+# confidence interval, and the ratio of the variance of independent runs
+# to the variance of the paired differences.
+# x and y are the non-zero (iterations, values) of the two configurations.
+#
+def paired_difference(x, y, n, z):
+    (xi, xv) = x
+    (yi, yv) = y
+    (common, xc, yc) = numpy.intersect1d(xi, yi, assume_unique=True, return_indices=True)
+
+    mean = (xv.sum() - yv.sum()) / n
+    d2 = (xv ** 2).sum() + (yv ** 2).sum() - 2 * (xv[xc] * yv[yc]).sum()
+    var = max(d2 - n * mean * mean, 0.0) / (n - 1)
+
+    x_mean = xv.sum() / n
+    y_mean = yv.sum() / n
+    independent = ((xv ** 2).sum() - n * x_mean * x_mean + (yv ** 2).sum() - n * y_mean * y_mean) / (n - 1)
+
+    # 1.0 if neither varies, e.g., without any data loss
+    gain = Samples().calcVRF(independent, var)
+    return (mean, z * sqrt(var / n), gain)
+
+def print_table(title, configs, results, part, prob, iterations, conf_level):
+    z = Samples().getZ(conf_level)
+    base = measure(results[0][part], prob)
+
+    print "******** %s ********" % title
+    print "%-45s %13s %13s %13s %13s %10s" % ("configuration", "mean", "+/-", "diff vs #0", "+/-", "CRN gain")
+    for (k, config) in enumerate(configs):
+        x = measure(results[k][part], prob)
+
+        samples = Samples()
+        samples.addSampleArray(x[1], iterations)
+        samples.calcResults(conf_level)
+        if prob:
+            (mean, ci) = (samples.prob_mean, samples.prob_ci)
+        else:
+            (mean, ci) = (samples.value_mean, samples.value_ci)
+
+        if k == 0:
+            print "%-45s %13e %13e %13s %13s %10s" % ("#0 " + config_name(config), mean, ci, "-", "-", "-")
+            continue
+        (diff, diff_ci, gain) = paired_difference(x, base, iterations, z)
+        print "%-45s %13e %13e %13e %13e %10.1f" % ("#%d %s" % (k, config_name(config)), mean, ci, diff, diff_ci, gain)
+
+def print_sweep(configs, results, iterations, filelevel):
+    if filelevel:
+        unit = "files"
+    else:
+        unit = "blocks/chunks"
+
+    print "**************************************"
+    print "Sweep: %d configurations, %ld iterations each, common random numbers" % (len(configs), iterations)
+    print_table("Probability of RAID Failures", configs, results, 0, True, iterations, "0.95")
+    print_table("Fraction of %s Lost by RAID Failures" % unit, configs, results, 0, False, iterations, "0.95")
+    print_table("Probability of LSEs", configs, results, 1, True, iterations, "0.95")
+    print_table("# of %s Lost by LSEs" % unit, configs, results, 1, False, iterations, "0.95")
+    print "**************************************"
+
+def usage(arg):
+    print arg, ": -h [--help] -i <num_iterations> [--iterations <num_iterations>] -s <seed> [--seed <seed>] --workers <num_workers>"
+    print "-r <raid_types> [--raid <raid_types>] -n <num_raids> [--raid_num <num_raids>]"
+    print "-c <capacity_factors> [--capacity <capacity_factors>] -p <parameter_sets> [--parameters <parameter_sets>]"
+    print "-m <mission_times> [--mission_time <mission_times>]"
+    print "-t <trace> [--trace <trace_file>] -f [--filelevel] -d [--dedup] -w [--weighted]"
+    print ""
+    print "Each option of the grid is a comma separated list, such as -r mds_7_1,mds_14_2 -c 1,2"
+    print "The parameter sets are those of simd.py: Elerath2009, Elerath2014A and Elerath2014B"
+    print "Every configuration of the grid runs the same iterations with the same random streams,"
+    print "and is compared with the first configuration by paired differences"
+    sys.exit(2)
+
+if __name__ == "__main__":
+    try:
+        (opts, args) = getopt.gnu_getopt(sys.argv[1:], "hi:s:r:n:c:p:m:t:fdw", ["help", "iterations=", "seed=", "workers=",
+            "raid=", "raid_num=", "capacity=", "parameters=", "mission_time=", "trace=", "filelevel", "dedup", "weighted"])
+    except:
+        usage(sys.argv[0])
+
+    iterations = 10000L
+    seed = None
+    workers = 1
+
+    raid_types = ["mds_14_2"]
+    raid_nums = [1]
+    capacity_factors = [1.0]
+    parms = ["Elerath2014A"]
+    mission_times = [87600.0]
+
+    trace = None
+    filelevel = False
+    dedup = False
+    weighted = False
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage(sys.argv[0])
+        elif o in ("-i", "--iterations"):
+            iterations = long(a)
+        elif o in ("-s", "--seed"):
+            seed = long(a)
+        elif o == "--workers":
+            workers = int(a)
+        elif o in ("-r", "--raid"):
+            raid_types = a.split(",")
+        elif o in ("-n", "--raid_num"):
+            raid_nums = [int(v) for v in a.split(",")]
+        elif o in ("-c", "--capacity"):
+            capacity_factors = [float(v) for v in a.split(",")]
+        elif o in ("-p", "--parameters"):
+            parms = a.split(",")
+        elif o in ("-m", "--mission_time"):
+            mission_times = [float(v) for v in a.split(",")]
+        elif o in ("-t", "--trace"):
+            trace = a
+        elif o in ("-f", "--filelevel"):
+            filelevel = True
+        elif o in ("-d", "--dedup"):
+            dedup = True
+        elif o in ("-w", "--weighted"):
+            weighted = True
+        else:
+            print "invalid option"
+            sys.exit(1)
+
+    for p in parms:
+        if get_presets(p, 1.0) == None:
+            print "Invalid parameter set", p
+            usage(sys.argv[0])
+    if iterations < 2:
+        usage(sys.argv[0])
+    if seed == None:
+        seed = random.SystemRandom().getrandbits(64)
+
+    configs = list(itertools.product(raid_types, raid_nums, capacity_factors, parms, mission_times))
+
+    results = sweep(configs, iterations, seed, trace, filelevel, dedup, weighted, workers)
+    print_sweep(configs, results, iterations, filelevel)
@@ -4,8 +4,44 @@ import itertools
 from collections import deque
 import random
 from component import *
+from scheduler import *
+from tracecache import *
 # use array instead of list to reduce memory overhead
 import array
+import numpy
+
+# Read the integers of a trace into an AliasTable of (value, count), until
+# a line for which stop(line) is True. Return (table, the line which stops)
+def read_use_table(lines, stop):
+	histogram = {}
+	last = None
+	for line in lines:
+		if stop(line):
+			last = line
+			break
+		v = int(line)
+		histogram[v] = histogram.get(v, 0) + 1
+
+	values = sorted(histogram.keys())
+	return (AliasTable(values, [histogram[v] for v in values]), last)
+
+# Set the use_table, rf_array and df of a model from the cache of its trace,
+# or parse the trace with model.parse_trace() and cache the results.
+# first_line tells the kind of the trace.
+def load_trace(model, first_line):
+	cached = read_trace_cache(model.trace, first_line)
+	if cached is not None:
+		(histogram, model.rf_array, model.df) = cached
+		if histogram is not None:
+			model.use_table = AliasTable(*histogram)
+		return
+
+	tracefile = open(model.trace, "r")
+	assert(tracefile.readline() == first_line)
+	model.parse_trace(tracefile)
+	tracefile.close()
+
+	write_trace_cache(model.trace, first_line, model.use_table, model.rf_array, model.df)
 
 class DeduplicationModel:
 
@@ -22,6 +58,24 @@ class DeduplicationModel:
 	def sector_error(self, lse_count):
 		return None
 
+	# raid_failure() of a NumPy array of corrupted areas
+	def raid_failures(self, corrupted_areas):
+		index = ((corrupted_areas + 0.005) * 100).astype(numpy.int64)
+		assert(((index >= 0) & (index <= 100)).all())
+		rf = numpy.array(self.rf_array, dtype=numpy.float64)
+		return 1.0 - rf[-1 - index]
+
+	# sector_error() of a NumPy array of LSE counts, which are all > 0,
+	# drawn from a numpy.random.RandomState
+	def sector_errors(self, lse_counts, rng):
+		if len(lse_counts) == 0:
+			return numpy.zeros(0, dtype=numpy.int64)
+		assert((lse_counts > 0).all())
+
+		lost = self.use_table.draws(int(lse_counts.sum()), rng)
+		# the sum of the draws of each count
+		return numpy.add.reduceat(lost, numpy.cumsum(lse_counts) - lse_counts)
+
 class DeduplicationModel_Chunk_NoDedup(DeduplicationModel):
 	def __init__(self, weighted):
 		self.filelevel = False
@@ -42,6 +96,15 @@ class DeduplicationModel_Chunk_NoDedup(DeduplicationModel):
 		else:
 			return lse_count
 
+	def raid_failures(self, corrupted_areas):
+		return corrupted_areas
+
+	def sector_errors(self, lse_counts, rng):
+		if self.weighted:
+			return lse_counts * 8192
+		else:
+			return lse_counts
+
 # reference count / chunk size * reference count
 # reference count / chunk size * reference count
 # ...
@@ -56,33 +119,26 @@ class DeduplicationModel_Chunk_Dedup(DeduplicationModel):
 		self.dedup = True
 
 		self.df = 0
-		# array of uncorrectable sector errors
-		self.use_array = array.array("l")
+		# the distribution of uncorrectable sector errors
+		self.use_table = None
 		# array of raid failure
 		self.rf_array = array.array("f")
 
 		self.weighted = weighted 
 		self.trace = trace
-		tracefile = open(self.trace, "r")
 		if self.weighted:
-			assert(tracefile.readline() == "CHUNK:DEDUP:WEIGHTED\n")
+			load_trace(self, "CHUNK:DEDUP:WEIGHTED\n")
 		else:
-			assert(tracefile.readline() == "CHUNK:DEDUP:NOT WEIGHTED\n")
+			load_trace(self, "CHUNK:DEDUP:NOT WEIGHTED\n")
 
-		for line in tracefile:
-			if line[:-1].isdigit() == True:
-				self.use_array.append(int(line))
-			else:
-				assert(self.df == 0)
-				self.df = float(line)
-				break;
+	def parse_trace(self, tracefile):
+		(self.use_table, line) = read_use_table(tracefile, lambda line: line[:-1].isdigit() == False)
+		self.df = float(line)
 		for line in tracefile:
 			self.rf_array.append(float(line))
 		assert(self.df >= 1)
 		assert(len(self.rf_array) == 101)
 
-		tracefile.close()
-
 	# percent of corrupted logical chunks
 	def raid_failure(self, corrupted_area):
 		index = int((corrupted_area+0.005)*100)
@@ -92,9 +148,7 @@ class DeduplicationModel_Chunk_Dedup(DeduplicationModel):
 
 	# the size of corrupted logical chunks
 	def sector_error(self, lse_count):
-		lost = 0;
-		for i in xrange(lse_count):
-			lost += self.use_array[random.randrange(len(self.use_array))]
+		lost = self.use_table.draw_sum(lse_count)
 
 		assert(lost>=0)
 		return lost 
@@ -110,10 +164,10 @@ class DeduplicationModel_File_NoDedup_NotWeighted(DeduplicationModel):
 		self.weighted = False
 
 		self.trace = trace
-		tracefile = open(self.trace, "r")
-
-		assert(list(itertools.islice(tracefile, 1))[0] == "FILE:NO DEDUP:NOT WEIGHTED\n")
+		self.use_table = None
+		load_trace(self, "FILE:NO DEDUP:NOT WEIGHTED\n")
 
+	def parse_trace(self, tracefile):
 		# Totally 101 items for RAID failures
 		self.rf_array = [float(i) for i in itertools.islice(tracefile, 0, None)]
 		self.df = 1.0
@@ -129,6 +183,9 @@ class DeduplicationModel_File_NoDedup_NotWeighted(DeduplicationModel):
 	def sector_error(self, lse_count):
 		return lse_count 
 
+	def sector_errors(self, lse_counts, rng):
+		return lse_counts
+
 # file size for chunk 1 
 # file size for chunk 2 
 # ...
@@ -144,30 +201,24 @@ class DeduplicationModel_File_NoDedup_Weighted(DeduplicationModel):
 
 		self.df = 0
 		self.trace = trace
-		tracefile = open(self.trace, "r")
 
-		# array of uncorrectable sector errors
-		self.use_array = array.array("l")
+		# the distribution of uncorrectable sector errors
+		self.use_table = None
 		# array of raid failure
 		self.rf_array = array.array("f")
 
-		assert(tracefile.readline() == "FILE:NO DEDUP:WEIGHTED\n")
+		load_trace(self, "FILE:NO DEDUP:WEIGHTED\n")
 
-		for line in tracefile:
-			if int(line) == 0:
-				self.df = 1.0
-				self.rf_array.append(float(line))
-				break
-			else:
-				self.use_array.append(int(line))
+	def parse_trace(self, tracefile):
+		(self.use_table, line) = read_use_table(tracefile, lambda line: int(line) == 0)
+		self.df = 1.0
+		self.rf_array.append(float(line))
 		for line in tracefile:
 			self.rf_array.append(float(line))
 
 		assert(self.df >= 1)
 		assert(len(self.rf_array) == 101)
 
-		tracefile.close()
-
 	# percent of corrupted files in size
 	def raid_failure(self, corrupted_area):
 		index = int((corrupted_area+0.005)*100)
@@ -177,9 +228,7 @@ class DeduplicationModel_File_NoDedup_Weighted(DeduplicationModel):
 
 	# size of corrupted files
 	def sector_error(self, lse_count):
-		bytes_lost = 0;
-		for i in xrange(lse_count):
-			bytes_lost += self.use_array[random.randrange(len(self.use_array))]
+		bytes_lost = self.use_table.draw_sum(lse_count)
 
 		assert(bytes_lost>=0)
 		return bytes_lost
@@ -198,36 +247,29 @@ class DeduplicationModel_File_Dedup(DeduplicationModel):
 		self.dedup = True
 		self.weighted = weighted
 		self.trace = trace
-		tracefile = open(self.trace, "r")
-
-		if self.weighted:
-			assert(tracefile.readline() == "FILE:DEDUP:WEIGHTED\n")
-		else:
-			assert(tracefile.readline() == "FILE:DEDUP:NOT WEIGHTED\n")
 
 		self.df = 0
 
-		# array of uncorrectable sector errors
-		self.use_array = array.array("l")
+		# the distribution of uncorrectable sector errors
+		self.use_table = None
 		# array of raid failure
 		self.rf_array = array.array("f")
 
+		if self.weighted:
+			load_trace(self, "FILE:DEDUP:WEIGHTED\n")
+		else:
+			load_trace(self, "FILE:DEDUP:NOT WEIGHTED\n")
+
+	def parse_trace(self, tracefile):
 		# The last 101 items are for RAID failures
-		for line in tracefile:
-			if line[:-1].isdigit() == True:
-				self.use_array.append(int(line))
-			else:
-				assert(self.df == 0)
-				self.df = float(line)
-				break;
+		(self.use_table, line) = read_use_table(tracefile, lambda line: line[:-1].isdigit() == False)
+		self.df = float(line)
 		for line in tracefile:
 			self.rf_array.append(float(line))
 
 		assert(self.df >= 1)
 		assert(len(self.rf_array) == 101)
 
-		tracefile.close()
-
 	# percent of corrupted files in number or size
 	def raid_failure(self, corrupted_area):
 		index = int((corrupted_area+0.005)*100)
@@ -237,13 +279,36 @@ class DeduplicationModel_File_Dedup(DeduplicationModel):
 
 	# number or size of corrupted files
 	def sector_error(self, lse_count):
-		corrupted_files = 0
-		for i in xrange(lse_count):
-			corrupted_files += self.use_array[random.randrange(len(self.use_array))]
+		corrupted_files = self.use_table.draw_sum(lse_count)
 
 		assert(corrupted_files>=0)
 		return corrupted_files
 
+# Select the deduplication model according to the file system flags
+def create_dedup_model(trace, filelevel, dedup, weighted):
+	if filelevel == False:
+		if dedup == False:
+			return DeduplicationModel_Chunk_NoDedup(weighted)
+		else:
+			return DeduplicationModel_Chunk_Dedup(trace, weighted)
+	else:
+		if dedup == False and weighted == False:
+			return DeduplicationModel_File_NoDedup_NotWeighted(trace)
+		elif dedup == False and weighted == True:
+			return DeduplicationModel_File_NoDedup_Weighted(trace)
+		elif dedup == True:
+			return DeduplicationModel_File_Dedup(trace, weighted)
+
+# The models are only read once they are built,
+# so the systems with the same trace and flags share one
+dedup_models = {}
+
+def shared_dedup_model(trace, filelevel, dedup, weighted):
+	key = (trace, filelevel, dedup, weighted)
+	if key not in dedup_models:
+		dedup_models[key] = create_dedup_model(trace, filelevel, dedup, weighted)
+	return dedup_models[key]
+
 class System:
 	#RESULT_NOTHING_LOST = 0 #"Nothing Lost"
 	#RESULT_RAID_FAILURE = 1 #"RAID Failure"
@@ -251,39 +316,65 @@ class System:
 
 	logger = logging.getLogger("sim")
 
+	# the class of the RAIDs, a subclass of Raid when instrumented, see instrument.py
+	raid_class = Raid
+
 	# A system consists of many RAIDs
 	def __init__(self, mission_time, raid_type, raid_num, disk_capacity, 
-			disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, trace, filelevel, dedup, weighted):
+			disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms, trace, filelevel, dedup, weighted, bias=None):
 		self.mission_time = mission_time
 		self.raid_num = raid_num
 		self.avail_raids = raid_num
 
 		self.logger.debug("System: mission_time = %d, raid_num = %d" % (self.mission_time, self.raid_num))
 
-		self.event_queue = None
+		self.event_queue = EventScheduler(raid_num)
 
-		self.raids = [Raid(raid_type, disk_capacity, disk_fail_parms,
-			disk_repair_parms, disk_lse_parms, disk_scrubbing_parms) for i in range(raid_num)]
+		# the events counted by --instrument if counting: those replaced
+		# and popped in the queue, and the repairs, see instrument.py
+		self.counting = False
+		self.heap_replaces = 0
+		self.heap_pops = 0
+		self.repair_events = 0
 
-		if filelevel == False:
-			if dedup == False:
-				self.dedup_model = DeduplicationModel_Chunk_NoDedup(weighted)
-			else:
-				self.dedup_model = DeduplicationModel_Chunk_Dedup(trace, weighted)
+		# Importance sampling if bias = (fail_bias, repair_bias)
+		# All disks share the distributions
+		self.likelihood = None
+		if bias is None:
+			disk = Disk(disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms)
 		else:
-			if dedup == False and weighted == False:
-				self.dedup_model = DeduplicationModel_File_NoDedup_NotWeighted(trace);
-			elif dedup == False and weighted == True:
-				self.dedup_model = DeduplicationModel_File_NoDedup_Weighted(trace);
-			elif dedup == True:
-				self.dedup_model = DeduplicationModel_File_Dedup(trace, weighted)
+			self.likelihood = LikelihoodRatio()
+			disk = BiasedDisk(disk_fail_parms, disk_repair_parms, disk_lse_parms, disk_scrubbing_parms,
+				bias, self.likelihood, mission_time)
+
+		self.raids = [self.raid_class(raid_type, disk_capacity, disk) for i in range(raid_num)]
+
+		# the RAIDs where parity_fragments disks fail for the first time
+		# within the mission, a control variate, see get_critical_raids_mean()
+		self.critical_raids = 0
+
+		self.dedup_model = shared_dedup_model(trace, filelevel, dedup, weighted)
 
 	def reset(self):
-		self.event_queue = []
-		for r_idx in range(len(self.raids)):
-			self.event_queue.extend(self.raids[r_idx].reset(r_idx, self.mission_time))
+		self.avail_raids = self.raid_num
+		if self.likelihood is not None:
+			self.likelihood.reset()
 
-		self.event_queue = sorted(self.event_queue, reverse=True)
+		self.critical_raids = 0
+		self.event_queue.clear()
+		for r_idx in range(len(self.raids)):
+			events = self.raids[r_idx].reset(r_idx, self.mission_time)
+			if len(events) >= self.raids[r_idx].parity_fragments:
+				self.critical_raids += 1
+			self.event_queue.extend(events)
+		self.event_queue.heapify()
+
+	# The expected number of critical RAIDs: the number of first failures
+	# of the disks of a RAID is binomial
+	def get_critical_raids_mean(self):
+		raid = self.raids[0]
+		q = raid.disk.disk_fail_dist.cdf(self.mission_time)
+		return self.raid_num * sum(binomial_pmf(raid.disk_num, q)[raid.parity_fragments:])
 
 	def calc_bytes_lost(self):
 		results = [0, 0]
@@ -299,23 +390,28 @@ class System:
 
 	def go_to_next_event(self):
 
-		while True:
-			if len(self.event_queue) == 0:
-				return None
-			(event_time, disk_idx, raid_idx) = self.event_queue.pop()
-			if self.raids[raid_idx].state == Raid.RAID_STATE_OK:
-				break
+		# events of failed RAIDs are skipped by the queue
+		event = self.event_queue.head()
+		if event == None:
+			return None
+		(event_time, disk_idx, raid_idx) = event
 
 		# After update, the system state is consistent
 		(event_type, next_event_time) = self.raids[raid_idx].update_to_event(event_time, disk_idx)
 		if next_event_time <= self.mission_time:
-			self.event_queue.append((next_event_time, disk_idx, raid_idx))
-			size = len(self.event_queue)
-			if size >= 2 and self.event_queue[size - 1] > self.event_queue[size - 2]:
-				self.event_queue = sorted(self.event_queue, reverse=True)
-				#print event_type, self.event_queue
+			self.event_queue.replace((next_event_time, disk_idx, raid_idx))
+		else:
+			self.event_queue.pop()
+
+		if self.counting:
+			if next_event_time <= self.mission_time:
+				self.heap_replaces += 1
+			else:
+				self.heap_pops += 1
+			if event_type == Disk.DISK_EVENT_REPAIR:
+				self.repair_events += 1
 
-		self.logger.debug("raid_idx = %d, disk_idx = %d, event_type = %s, event_time = %d" % (raid_idx, disk_idx, event_type, event_time))
+		# the events are traced by --trajectories, see tracing.py
 		return (event_type, event_time, raid_idx)
 
 	# Three possible returns
@@ -339,6 +435,7 @@ class System:
 			if self.raids[raid_idx].check_failure(event_time) == True:
 				# TO-DO: When deduplication model is ready, we need to amplify bytes_lost
 				# e.g., bytes_lost * deduplication factor
+				self.event_queue.discard(raid_idx)
 				self.avail_raids -= 1
 				if self.avail_raids == 0:
 					break
@@ -353,5 +450,48 @@ class System:
 		# The mission concludes or all RAIDs fail
 		return self.calc_bytes_lost()
 
+	def snapshot(self):
+		return (self.avail_raids, [raid.snapshot() for raid in self.raids])
+
+	# The pending events are not part of a snapshot,
+	# call resample() to draw them after restore()
+	def restore(self, snapshot):
+		(self.avail_raids, raids) = snapshot
+		for r_idx in range(len(self.raids)):
+			self.raids[r_idx].restore(raids[r_idx])
+
+	# Draw the pending events of the RAIDs which have not failed again,
+	# given the system state at current_time
+	def resample(self, current_time):
+		self.event_queue.clear()
+		for r_idx in range(len(self.raids)):
+			if self.raids[r_idx].state == Raid.RAID_STATE_OK:
+				self.event_queue.extend(self.raids[r_idx].resample(r_idx, current_time, self.mission_time))
+		self.event_queue.heapify()
+
+	# The weight of the last iteration, None without importance sampling
+	def get_weight(self):
+		if self.likelihood is None:
+			return None
+		return self.likelihood.value
+
 	def get_df(self):
 		return self.dedup_model.df
+
+# The subclasses made by the factories of system_subclass(), by (prefix, class)
+system_subclasses = {}
+
+#
+# Return a function which returns the subclass make(system_class) of a
+# System class, made once per class and named prefix + its name,
+# see instrument.py and tracing.py
+#
+def system_subclass(prefix, make):
+	def factory(system_class):
+		key = (prefix, system_class)
+		if key not in system_subclasses:
+			subclass = make(system_class)
+			subclass.__name__ = prefix + system_class.__name__
+			system_subclasses[key] = subclass
+		return system_subclasses[key]
+	return factory
@@ -0,0 +1,86 @@
+import os
+import struct
+import numpy
+
+#
+# A binary sidecar cache of a parsed trace, next to the trace as
+# <trace>.simdcache, so a trace is only parsed once.
+#
+# The cache holds the histogram of uncorrectable sector errors, the RAID
+# failure array and the D/F of a deduplication model. It is keyed by the
+# size and the modification time of the trace, and by the first line of
+# the trace, which tells the model. It is read through numpy.memmap.
+#
+# layout: magic (8 bytes), trace size (int64), trace mtime (float64),
+#         length of the first line (int64), number of histogram entries
+#         (int64, -1 without a histogram), length of the RAID failure
+#         array (int64), D/F (float64), the first line, padding to
+#         8 bytes, values (int64), counts (int64), RAID failures (float64)
+#
+MAGIC = "SIMDTRC1"
+HEADER = struct.Struct("<8sqdqqqd")
+
+def cache_path(trace):
+    return trace + ".simdcache"
+
+#
+# Return (histogram, rf_array, df) of the trace, where histogram is
+# (values, counts) or None, or None if there is no valid cache
+#
+def read_trace_cache(trace, first_line):
+    try:
+        st = os.stat(trace)
+        f = open(cache_path(trace), "rb")
+    except (IOError, OSError):
+        return None
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        f.close()
+        return None
+    (magic, size, mtime, length, n, m, df) = HEADER.unpack(data)
+    line = f.read(length)
+    f.close()
+
+    if magic != MAGIC or size != st.st_size or mtime != st.st_mtime or line != first_line:
+        return None
+
+    offset = HEADER.size + length
+    offset += -offset % 8
+    mm = numpy.memmap(cache_path(trace), dtype=numpy.uint8, mode="r")
+
+    histogram = None
+    if n >= 0:
+        values = mm[offset:offset + 8*n].view("<i8")
+        counts = mm[offset + 8*n:offset + 16*n].view("<i8")
+        histogram = (values.tolist(), counts.tolist())
+        offset += 16*n
+    rf_array = mm[offset:offset + 8*m].view("<f8").tolist()
+
+    return (histogram, rf_array, df)
+
+# use_table is an AliasTable or None.
+# The cache is not written if the directory of the trace is read-only.
+def write_trace_cache(trace, first_line, use_table, rf_array, df):
+    n = -1
+    arrays = []
+    if use_table is not None:
+        n = len(use_table)
+        arrays.append(numpy.array(use_table.values, dtype="<i8"))
+        arrays.append(numpy.array(use_table.counts, dtype="<i8"))
+    arrays.append(numpy.array(rf_array, dtype="<f8"))
+
+    st = os.stat(trace)
+    header = HEADER.pack(MAGIC, st.st_size, st.st_mtime, len(first_line), n, len(rf_array), df) + first_line
+    header += "\0" * (-len(header) % 8)
+
+    tmp = "%s.%d.tmp" % (cache_path(trace), os.getpid())
+    try:
+        f = open(tmp, "wb")
+        f.write(header)
+        for a in arrays:
+            f.write(a.tostring())
+        f.close()
+        os.rename(tmp, cache_path(trace))
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,193 @@
+import os
+from collections import deque
+
+from system import *
+
+#
+# Traces of the iterations which lose data, see --trajectories.
+#
+# The System of a traced simulation is a subclass made by traced(). Its
+# events are recorded in a ring buffer of a fixed size, which is cleared
+# at each reset, so only the last events of a long iteration are kept.
+# When an iteration loses data, its records are kept until the simulation
+# writes them with the results of the iteration, see TrajectoryLog.
+#
+# A record is (time, raid_idx, disk_idx, kind, value):
+#   fail, repair  = a disk event, value is the number of failed disks
+#                   of the RAID after the event
+#   raid_failure  = the RAID fails, value is the corrupted area
+#   sectors_lost  = LSEs hit the RAID, value is their number
+#   resample      = a split trajectory starts again, see SplittingSystem
+# disk_idx is -1 for the records which are not disk events.
+#
+
+# the kinds of records, the first two are Disk.DISK_EVENT_FAIL and DISK_EVENT_REPAIR
+TRACE_FAIL = Disk.DISK_EVENT_FAIL
+TRACE_REPAIR = Disk.DISK_EVENT_REPAIR
+TRACE_RAID_FAILURE = 2
+TRACE_SECTORS_LOST = 3
+TRACE_RESAMPLE = 4
+
+TRACE_KINDS = {TRACE_FAIL: "fail", TRACE_REPAIR: "repair", TRACE_RAID_FAILURE: "raid_failure",
+        TRACE_SECTORS_LOST: "sectors_lost", TRACE_RESAMPLE: "resample"}
+
+#
+# The subclass of a System class (System, SplittingSystem or
+# ConditionalSystem, instrumented or not) which records the trajectories
+# of its iterations, see traced(). Call trace() on a system before
+# running it.
+#
+def make_traced(system_class):
+
+    class TracedSystem(system_class):
+
+        # size is the number of records kept for an iteration
+        def trace(self, size):
+            self.trajectory = deque(maxlen=size)
+            # the records of the iteration, including those dropped
+            self.trajectory_records = 0
+            # the RAID of the last failure, whose losses are not recorded yet,
+            # with its state and its LSEs before the failure
+            self.traced_raid = None
+            self.traced_state = Raid.RAID_STATE_OK
+            self.traced_lse_count = 0
+            self.traced_time = 0
+            # True if a trajectory of the iteration loses data
+            self.trajectory_lost = False
+            # (records, dropped) of the iterations which lose data,
+            # see pop_trajectory()
+            self.lost_trajectories = deque()
+
+        def record(self, event_time, raid_idx, disk_idx, kind, value):
+            self.trajectory.append((event_time, raid_idx, disk_idx, kind, value))
+            self.trajectory_records += 1
+
+        def reset(self):
+            system_class.reset(self)
+            self.trajectory.clear()
+            self.trajectory_records = 0
+            self.traced_raid = None
+            self.trajectory_lost = False
+
+        # The losses of a failure are known once run() has checked it,
+        # so they are recorded before the next event
+        def record_losses(self):
+            r_idx = self.traced_raid
+            raid = self.raids[r_idx]
+            if raid.state == Raid.RAID_STATE_FAILED and self.traced_state != Raid.RAID_STATE_FAILED:
+                self.record(self.traced_time, r_idx, -1, TRACE_RAID_FAILURE, raid.corrupted_area)
+            if raid.lse_count > self.traced_lse_count:
+                self.record(self.traced_time, r_idx, -1, TRACE_SECTORS_LOST, raid.lse_count - self.traced_lse_count)
+            self.traced_raid = None
+
+        def go_to_next_event(self):
+            if self.traced_raid is not None:
+                self.record_losses()
+
+            head = self.event_queue.head()
+            e = system_class.go_to_next_event(self)
+            if e == None:
+                return e
+
+            (event_type, event_time, raid_idx) = e
+            raid = self.raids[raid_idx]
+            self.record(event_time, raid_idx, head[1], event_type, raid.failed_disk_count)
+            if event_type == Disk.DISK_EVENT_FAIL:
+                self.traced_raid = raid_idx
+                self.traced_state = raid.state
+                self.traced_lse_count = raid.lse_count
+                self.traced_time = event_time
+            return e
+
+        # A split trajectory checks the LSEs of the failure after
+        # resample(), so each copy restores the failure to record them,
+        # see SplittingSystem.split()
+        def snapshot(self):
+            traced = (self.traced_raid, self.traced_state, self.traced_lse_count, self.traced_time)
+            return (system_class.snapshot(self), traced)
+
+        def restore(self, snapshot):
+            (base, traced) = snapshot
+            system_class.restore(self, base)
+            (self.traced_raid, self.traced_state, self.traced_lse_count, self.traced_time) = traced
+
+        def resample(self, current_time):
+            system_class.resample(self, current_time)
+            self.record(current_time, -1, -1, TRACE_RESAMPLE, 0)
+
+        def calc_bytes_lost(self):
+            if self.traced_raid is not None:
+                self.record_losses()
+
+            results = system_class.calc_bytes_lost(self)
+            if results[0] != 0 or results[1] != 0:
+                self.trajectory_lost = True
+            return results
+
+        def run(self):
+            result = system_class.run(self)
+            if self.trajectory_lost:
+                self.lost_trajectories.append((list(self.trajectory), self.trajectory_records - len(self.trajectory)))
+            return result
+
+        # Return (records, dropped) of the earliest iteration which lost
+        # data and has not been written, where dropped is the number of
+        # its records which were not kept
+        def pop_trajectory(self):
+            return self.lost_trajectories.popleft()
+
+    return TracedSystem
+
+traced = system_subclass("Traced", make_traced)
+
+# The block of an iteration in a TrajectoryLog
+def format_trajectory(iteration, result, trajectory):
+    (records, dropped) = trajectory
+    lines = ["iteration %d: raid_failure=%g lse=%g records=%d dropped=%d\n" % (iteration, result[0], result[1],
+            len(records), dropped)]
+    for (event_time, raid_idx, disk_idx, kind, value) in records:
+        lines.append("%.3f %d %d %s %g\n" % (event_time, raid_idx, disk_idx, TRACE_KINDS[kind], value))
+    lines.append("\n")
+    return "".join(lines)
+
+#
+# The text log of the trajectories, with a block for each iteration
+# which loses data:
+#   iteration 1234: raid_failure=0.2112 lse=1 records=6 dropped=0
+#   51234.125 0 3 fail 1
+#   51240.250 0 3 repair 0
+#   ...
+#   <empty line>
+# The result of the iteration is that of calc_bytes_lost(), or the
+# weighted sum of its trajectories if it is split.
+#
+class TrajectoryLog:
+
+    # a log is appended to
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def write(self, iteration, result, trajectory):
+        self.file.write(format_trajectory(iteration, result, trajectory))
+
+    def size(self):
+        self.file.flush()
+        return os.fstat(self.file.fileno()).st_size
+
+    # Drop the trajectories written after the log had the size, see Simulation.set_state()
+    def truncate(self, size):
+        self.file.flush()
+        self.file.truncate(size)
+        self.file.seek(0, 2)
+
+    def close(self):
+        self.file.close()
+
+# Collect the trajectories in a worker process, see simulation.run_task()
+class TrajectoryList:
+
+    def __init__(self):
+        self.trajectories = []
+
+    def write(self, iteration, result, trajectory):
+        self.trajectories.append((iteration, result, trajectory))